@@ -0,0 +1,104 @@
+import threading
+
+
+class AckGroup:
+    """Counts the records of a message (or a batch of messages) that still
+    have to be written before it can be acked.
+
+    add() is called as records are handed out, done() once each one is
+    committed (or dropped for good) and seal() when the whole message has
+    been handed out. on_done(True) runs when a sealed group has nothing
+    left; fail() runs on_done(False) instead, at most once. Records may
+    be handed out on one thread and committed on another.
+    """
+
+    __slots__ = ("on_done", "pending", "sealed", "finished", "_lock")
+
+    def __init__(self, on_done):
+        self.on_done = on_done
+        self.pending = 0
+        self.sealed = False
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.pending += n
+
+    def done(self, n=1):
+        with self._lock:
+            self.pending -= n
+            ready = self.sealed and self.pending == 0
+        if ready:
+            self._finish(True)
+
+    def seal(self):
+        with self._lock:
+            self.sealed = True
+            ready = self.pending == 0
+        if ready:
+            self._finish(True)
+
+    def fail(self):
+        self._finish(False)
+
+    def _finish(self, ok):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.on_done(ok)
+
+
+def settle(msg, ok):
+    """on_done for a Pub/Sub message: ack after commit, nack on failure."""
+    if ok:
+        msg.ack()
+    else:
+        msg.nack()
+
+
+class RecordOrigins:
+    """Remembers which AckGroup each in-flight record came from.
+
+    The speed step holds the first breadcrumb of a trip until the second
+    one arrives or the trip is evicted, so the group is looked up by
+    record identity when the record is finally stored.
+    """
+
+    def __init__(self):
+        self._groups = {}
+
+    def track(self, record, group):
+        group.add()
+        self._groups[id(record)] = group
+
+    def take(self, record):
+        """Returns the record's group, or None if it was already taken."""
+        return self._groups.pop(id(record), None)
+
+    def __len__(self):
+        return len(self._groups)
+
+
+def tracked_speeds(speeds, origins, data, group):
+    """TripStateStore.update() that keeps track of ack groups.
+
+    Returns (record, group) pairs to store, including the held points of
+    trips evicted on the way. A point held as the first of its trip keeps
+    its group pending; a skipped one is done at once.
+    """
+    origins.track(data, group)
+    pairs = released(speeds.update(data), origins)
+    if not speeds.holds(data):
+        # Stored above (already taken) or skipped
+        leftover = origins.take(data)
+        if leftover is not None:
+            leftover.done()
+    return pairs
+
+
+def released(records, origins):
+    """(record, group) pairs for records the store hands back, such as
+    the held points returned by TripStateStore.evict() and drain()."""
+    return [(record, origins.take(record)) for record in records]
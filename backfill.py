@@ -0,0 +1,116 @@
+import time
+from datetime import timedelta
+
+from breadcrumb_partitions import BreadcrumbPartitions, EPOCH_DATE, PARENT, partition_name
+
+# ---------- BACKFILL ----------
+# A backfill COPYs each day into an unlogged staging table with no
+# indexes or constraints, breadcrumb_YYYYMMDD_backfill. finish() then
+# makes each one logged, builds breadcrumb's indexes on it, adds the
+# partition bound as a CHECK and the Trip FK as NOT VALID, validates the
+# FK in one pass, and attaches it as the day's partition. A day that
+# already has a partition gets that partition's rows merged in and is
+# swapped. The table, its indexes and FK end up named as on a partition
+# the subscribers created.
+STAGING_SUFFIX = "_backfill"
+
+
+def staging_name(day):
+    return partition_name(day) + STAGING_SUFFIX
+
+
+class BackfillPartitions(BreadcrumbPartitions):
+    """Routes a PartitionedCopyWriter's rows to the days' staging tables.
+
+    Rows with no tstamp still go to breadcrumb_undated. Needs the
+    partitioned breadcrumb of pipeline.sql or migrate_breadcrumb.sql.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.live_days = set()
+        self._staging = {}
+
+    def load(self, conn):
+        super().load(conn)
+        if not self.partitioned:
+            raise RuntimeError("backfill needs the partitioned breadcrumb table (pipeline.sql)")
+        self.live_days, self._days = self._days, set()
+        # Staging tables left by an interrupted backfill start over
+        cur = conn.cursor()
+        cur.execute("SELECT relname FROM pg_class WHERE relname LIKE %s AND relkind = 'r' "
+                    "AND pg_table_is_visible(oid)", (PARENT + "\\_%" + STAGING_SUFFIX,))
+        for (name,) in cur.fetchall():
+            cur.execute(f"DROP TABLE {name}")
+        cur.close()
+        conn.commit()
+
+    def table(self, day):
+        if day is None:
+            return super().table(day)
+        name = self._staging.get(day)
+        if name is None:
+            name = self._staging[day] = staging_name(day)
+        return name
+
+    def _create(self, cur, day):
+        cur.execute(f"CREATE UNLOGGED TABLE IF NOT EXISTS {staging_name(day)} (LIKE {PARENT})")
+
+    def finish(self, conn):
+        """Attaches every staged day; returns {day: seconds}."""
+        cur = conn.cursor()
+        cur.execute("SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s)", (PARENT,))
+        # "CREATE INDEX name ON ONLY breadcrumb USING ..." -> " USING ..."
+        index_specs = [d[d.index(" USING "):] for (d,) in cur.fetchall()]
+        # A partition's copy of the FK keeps the parent's name
+        cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                    (PARENT,))
+        fk_name = cur.fetchone()[0]
+        conn.commit()
+        timings = {}
+        for day in sorted(self._days):
+            start = time.perf_counter()
+            try:
+                self._attach(cur, day, index_specs, fk_name)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self.live_days.add(day)
+            timings[day] = time.perf_counter() - start
+        self._days = set()
+        cur.close()
+        return timings
+
+    def _attach(self, cur, day, index_specs, fk_name):
+        staging, live = staging_name(day), partition_name(day)
+        lo = EPOCH_DATE + timedelta(days=day)
+        hi = lo + timedelta(days=1)
+        if day in self.live_days:
+            # Writes to the live day wait until the swap commits
+            cur.execute(f"LOCK TABLE {live} IN SHARE MODE")
+            cur.execute(f"INSERT INTO {staging} SELECT * FROM {live}")
+        # WAL-logged once, before any index exists
+        cur.execute(f"ALTER TABLE {staging} SET LOGGED")
+        for spec in index_specs:
+            cur.execute(f"CREATE INDEX ON {staging}{spec}")
+        # With the bound as a CHECK, ATTACH does not scan the rows again;
+        # the FK is checked by one join instead of a trigger per row
+        cur.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_bound "
+                    f"CHECK (tstamp IS NOT NULL AND tstamp >= %s AND tstamp < %s)", (lo, hi))
+        cur.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {fk_name} "
+                    f"FOREIGN KEY (trip_id) REFERENCES trip NOT VALID")
+        cur.execute(f"ALTER TABLE {staging} VALIDATE CONSTRAINT {fk_name}")
+        if day in self.live_days:
+            cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {live}")
+            cur.execute(f"DROP TABLE {live}")
+        # The indexes and FK match breadcrumb's, so they are attached as is
+        cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {staging} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+        cur.execute(f"ALTER TABLE {staging} DROP CONSTRAINT {staging}_bound")
+        cur.execute(f"ALTER TABLE {staging} RENAME TO {live}")
+        # breadcrumb_YYYYMMDD_backfill_point_idx -> breadcrumb_YYYYMMDD_point_idx
+        cur.execute("SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+                    "WHERE x.indrelid = to_regclass(%s)", (live,))
+        for (index,) in cur.fetchall():
+            if index.startswith(staging + "_"):
+                cur.execute(f"ALTER INDEX {index} RENAME TO {live}{index[len(staging):]}")
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from day_archive import ParquetDayWriter, count_records, iter_batches, iter_records
+from synth import vehicle_breadcrumbs
+
+# Disk size, full load time and record count time for an indent=2 JSON
+# day file vs. a Parquet day file, and whether replaying either gives the
+# same records, types included. Pass --day-file to use a real day.
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--day-file", help="existing 2025-MM-DD.json to convert")
+    parser.add_argument("--vehicles", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.day_file:
+        with open(args.day_file) as f:
+            records = json.load(f)
+    else:
+        records = []
+        for vid in range(3000, 3000 + args.vehicles):
+            records.extend(vehicle_breadcrumbs(vid))
+
+    tmp = tempfile.mkdtemp()
+    json_path = os.path.join(tmp, "day.json")
+    parquet_path = os.path.join(tmp, "day.parquet")
+
+    with open(json_path, "w") as f:
+        json.dump(records, f, indent=2)
+    with ParquetDayWriter(parquet_path) as writer:
+        writer.write(records)
+
+    def load_json():
+        with open(json_path) as f:
+            return len(json.load(f))
+
+    def load_parquet():
+        return sum(b.num_rows for b in iter_batches(parquet_path))
+
+    json_size = os.path.getsize(json_path)
+    parquet_size = os.path.getsize(parquet_path)
+    _, json_load = timed(load_json)
+    _, parquet_load = timed(load_parquet)
+    _, json_count = timed(lambda: count_records(json_path))
+    _, parquet_count = timed(lambda: count_records(parquet_path))
+
+    print(f"{len(records)} records")
+    print(f"size   json {json_size / 1e6:8.2f} MB   parquet {parquet_size / 1e6:8.2f} MB   "
+          f"{json_size / parquet_size:5.1f}x")
+    print(f"load   json {json_load:8.3f} s    parquet {parquet_load:8.3f} s    "
+          f"{json_load / parquet_load:5.1f}x")
+    print(f"count  json {json_count:8.3f} s    parquet {parquet_count:8.5f} s")
+
+    # Compared by repr so 12 and 12.0 count as different
+    same = [repr(r) for r in iter_records(json_path)] == [repr(r) for r in iter_records(parquet_path)]
+    print(f"json and parquet replay the same records: {same}")
+
+
+if __name__ == "__main__":
+    main()
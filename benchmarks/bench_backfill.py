@@ -0,0 +1,108 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from day_archive import JsonArrayWriter
+from synth import vehicle_breadcrumbs
+
+# A multi-day replay through subscriber_bulk_insert.py into the live
+# partitions (indexes and the Trip FK maintained row by row) vs. the same
+# replay with --backfill (unlogged staging tables, indexes and FK built
+# at the end, then attached). Before the backfill, a few vehicles of the
+# first day are ingested live so that day's partition is swapped, not
+# just attached. Runs on a local PostgreSQL in scratch schemas.
+
+SUBSCRIBER = os.path.join(ROOT, "vehicle_data", "merged_data", "subscriber_bulk_insert.py")
+
+
+def connect(schema):
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost"),
+        options=f"-c search_path={schema}",
+    )
+
+
+def write_day(workdir, name, day, vehicles):
+    path = os.path.join(workdir, name)
+    with JsonArrayWriter(path) as writer:
+        for vid in vehicles:
+            writer.write(vehicle_breadcrumbs(vid, opd_date=f"{day:02d}MAY2025:00:00:00"))
+    return path
+
+
+def replay(schema, workdir, files, backfill=False):
+    env = dict(os.environ, PGOPTIONS=f"-c search_path={schema}")
+    cmd = [sys.executable, SUBSCRIBER, "--replay", *files] + (["--backfill"] if backfill else [])
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if proc.returncode:
+        sys.exit(proc.stdout[-2000:] + proc.stderr[-2000:])
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("Backfill:")]
+    return seconds, lines[0] if lines else ""
+
+
+def summary(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT count(*), count(DISTINCT trip_id) FROM breadcrumb")
+    rows, trips = cur.fetchone()
+    # Leaf partitions with the Trip FK and both indexes attached to breadcrumb's
+    cur.execute("""
+        SELECT count(*) FILTER (WHERE fks = 1 AND idx = 2), count(*)
+        FROM (SELECT t.relid,
+                     (SELECT count(*) FROM pg_constraint c WHERE c.conrelid = t.relid AND c.contype = 'f'
+                      AND c.conparentid <> 0 AND c.convalidated) AS fks,
+                     (SELECT count(*) FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+                      WHERE x.indrelid = t.relid) AS idx
+              FROM pg_partition_tree('breadcrumb') t WHERE t.isleaf) p""")
+    complete, leaves = cur.fetchone()
+    conn.commit()
+    return rows, trips, complete, leaves
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--vehicles", type=int, default=60)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_backfill_")
+    vehicles = range(3000, 3000 + args.vehicles)
+    days = [write_day(workdir, f"2025-05-{d:02d}.json", d, vehicles) for d in range(10, 10 + args.days)]
+    # Other vehicles on the first day, already ingested when the backfill runs
+    early = write_day(workdir, "early.json", 10, range(2000, 2005))
+
+    results = {}
+    for name in ("live", "backfill"):
+        schema = f"bench_backfill_{name}"
+        conn = connect(schema)
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+        with open(os.path.join(ROOT, "pipeline.sql")) as f:
+            cur.execute(f.read())
+        conn.commit()
+        replay(schema, workdir, [early])
+        seconds, note = replay(schema, workdir, days, backfill=name == "backfill")
+        results[name] = summary(conn)
+        rows, trips, complete, leaves = results[name]
+        print(f"{name:9s} {seconds:7.2f}s  {rows} rows, {trips} trips, "
+              f"{complete}/{leaves} partitions with FK and indexes  {note}")
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+    print("same rows and trips:", results["live"][:2] == results["backfill"][:2])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from copy_writer import BinaryCopyWriter, BREADCRUMB_COLUMNS
+from speed_transform import TripSpeedTracker
+from timestamps import timestamp_epoch, timestamp_text
+from synth import day_breadcrumbs
+
+# Text copy_from (f-string CSV, as flush_buffers did) vs. binary COPY from
+# copy_writer.py, loading breadcrumb rows into a local PostgreSQL. Uses
+# unlogged scratch tables shaped like pipeline.sql's breadcrumb, without
+# the foreign key, so nothing in the real tables is touched.
+
+SCRATCH = """
+DROP TABLE IF EXISTS bench_breadcrumb_text, bench_breadcrumb_binary;
+CREATE UNLOGGED TABLE bench_breadcrumb_text (
+        tstamp timestamp, latitude float, longitude float, speed float, trip_id integer);
+CREATE UNLOGGED TABLE bench_breadcrumb_binary (LIKE bench_breadcrumb_text);
+"""
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost")
+    )
+
+
+def text_flush(cur, rows):
+    breadcrumb_csv = io.StringIO()
+    for row in rows:
+        breadcrumb_csv.write(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]}\n")
+    breadcrumb_csv.seek(0)
+    cur.copy_from(breadcrumb_csv, "bench_breadcrumb_text", sep=",",
+                  columns=("tstamp", "latitude", "longitude", "speed", "trip_id"))
+
+
+def binary_flush(writer, cur, rows):
+    writer.add_rows(rows)
+    writer.copy_to(cur)
+
+
+def timed(label, n, batches, flush):
+    start = time.perf_counter()
+    for batch in batches:
+        flush(batch)
+    seconds = time.perf_counter() - start
+    print(f"{label:24s} {seconds:7.3f}s  {n / seconds:12.0f} rows/s")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+
+    speeds = TripSpeedTracker()
+    records = [r for data in day_breadcrumbs(7, args.vehicles) for r in speeds.update(data)]
+    fields = lambda r: (r.get("GPS_LATITUDE"), r.get("GPS_LONGITUDE"), r.get("SPEED"), r.get("EVENT_NO_TRIP"))
+    text_rows = [(timestamp_text(r["OPD_DATE"], r["ACT_TIME"]),) + fields(r) for r in records]
+    binary_rows = [(timestamp_epoch(r["OPD_DATE"], r["ACT_TIME"]),) + fields(r) for r in records]
+    n = len(records)
+    chunks = lambda rows: [rows[i:i + args.batch] for i in range(0, n, args.batch)]
+    print(f"{n} breadcrumb rows in COPY batches of {args.batch}")
+
+    # Encoding alone, no database
+    writer = BinaryCopyWriter("bench_breadcrumb_binary", BREADCRUMB_COLUMNS)
+
+    def encode_text(rows):
+        buf = io.StringIO()
+        for row in rows:
+            buf.write(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]}\n")
+
+    def encode_binary(rows):
+        writer.add_rows(rows)
+        writer.reset()
+
+    text_encode = timed("encode text", n, chunks(text_rows), encode_text)
+    binary_encode = timed("encode binary", n, chunks(binary_rows), encode_binary)
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(SCRATCH)
+    conn.commit()
+
+    def commit_after(flush):
+        def run(rows):
+            flush(rows)
+            conn.commit()
+        return run
+
+    text_load = timed("copy_from text", n, chunks(text_rows), commit_after(lambda rows: text_flush(cur, rows)))
+    binary_load = timed("COPY binary", n, chunks(binary_rows), commit_after(lambda rows: binary_flush(writer, cur, rows)))
+
+    cur.execute("SELECT count(*), sum(speed), min(tstamp), max(tstamp) FROM bench_breadcrumb_text")
+    text_check = cur.fetchone()
+    cur.execute("SELECT count(*), sum(speed), min(tstamp), max(tstamp) FROM bench_breadcrumb_binary")
+    binary_check = cur.fetchone()
+    assert text_check[0] == binary_check[0] == n and text_check[2:] == binary_check[2:]
+    assert abs(text_check[1] - binary_check[1]) < 1e-6 * abs(text_check[1]) + 1e-6
+
+    cur.execute("DROP TABLE bench_breadcrumb_text, bench_breadcrumb_binary")
+    conn.commit()
+    conn.close()
+    print(f"speedup: encode {text_encode / binary_encode:.1f}x, load {text_load / binary_load:.1f}x; tables match")
+
+
+if __name__ == "__main__":
+    main()
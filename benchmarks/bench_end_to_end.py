@@ -0,0 +1,191 @@
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from day_archive import JsonArrayWriter
+from synth import vehicle_breadcrumbs
+
+# End-to-end ingest benchmark. A synthetic day file is published by
+# multi_day_pub.py through the in-memory Pub/Sub of fake_pubsub.py, and each
+# subscriber variant consumes it into a scratch schema on a local PostgreSQL
+# (DB_NAME, DB_HOST, ... as for the subscribers). Every variant runs in its
+# own process so peak RSS is its own. Reported per variant:
+#   - records/s from the first publish to the last ack
+#   - p50/p99 latency from publish to ack; every subscriber acks only
+#     after the message's rows are committed
+#   - peak RSS of the process (publisher and fake Pub/Sub included), its
+#     RSS at the start for comparison, and the largest worker process for
+#     SUBSCRIBER_PROCESSES
+# Fewer rows than records are stored because the >45 m/s filter drops the
+# synthetic odometer glitches.
+
+MERGED = os.path.join(ROOT, "vehicle_data", "merged_data")
+VARIANTS = {
+    "subscriber": (os.path.join(MERGED, "subscriber.py"), {}),
+    "subscriber-processes": (os.path.join(MERGED, "subscriber.py"), {"SUBSCRIBER_PROCESSES": "2"}),
+    "bulk_insert": (os.path.join(MERGED, "subscriber_bulk_insert.py"), {}),
+    "subscriber2": (os.path.join(ROOT, "project_assignment3", "subscriber2.py"), {}),
+}
+PUBLISHER = os.path.join(MERGED, "multi_day_pub.py")
+DAY = "2025-05-07"
+
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_day(workdir, vehicles, points_per_trip):
+    """A day file like data_gatherer.py writes, vehicle by vehicle."""
+    opd_date = DAY[8:] + "MAY2025:00:00:00"
+    with JsonArrayWriter(os.path.join(workdir, DAY + ".json")) as writer:
+        for vid in range(3000, 3000 + vehicles):
+            writer.write(vehicle_breadcrumbs(vid, points_per_trip=points_per_trip, opd_date=opd_date,
+                                             glitch_rate=0.002))
+        return writer.count
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# ---------- ONE VARIANT, IN ITS OWN PROCESS ----------
+def run_variant(variant, workdir, rate, idle):
+    import psycopg2
+    from fake_pubsub import FakePublisherClient, FakeSubscriberClient
+
+    path, env = VARIANTS[variant]
+    schema = "bench_" + variant.replace("-", "_")
+    os.environ.update(env)
+    # Every connection the subscriber (and its workers) open uses the scratch schema
+    os.environ["PGOPTIONS"] = f"-c search_path={schema}"
+    db = dict(dbname=os.getenv("DB_NAME", "trimet"), user=os.getenv("DB_USER", "postgres"),
+              password=os.getenv("DB_PASSWORD", "123456"), host=os.getenv("DB_HOST", "localhost"))
+    conn = psycopg2.connect(**db)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+    with open(os.path.join(ROOT, "pipeline.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+
+    os.chdir(workdir)
+    module = load(variant.replace("-", "_"), path)
+    if hasattr(module, "DB_PARAMS"):
+        # subscriber.py keeps its connection settings in a dict
+        module.DB_PARAMS.clear()
+        module.DB_PARAMS.update(db)
+    module.idle_seconds = idle
+    publisher_module = load("multi_day_pub", PUBLISHER)
+
+    subscriber = FakeSubscriberClient(forget_acked=True)
+    subscription = subscriber.subscription(subscriber.subscription_path(module.project_id, module.sub_id))
+    publisher = FakePublisherClient(keep_messages=False, subscriptions=[subscription])
+    if rate:
+        # Paced publishing, for latency at a given load rather than a backlog
+        publish, interval = publisher.publish, 1.0 / rate
+        next_at = [time.monotonic()]
+
+        def paced(topic, data, **attrs):
+            next_at[0] += interval
+            delay = next_at[0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            return publish(topic, data, **attrs)
+        publisher.publish = paced
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    publishing = threading.Thread(target=publisher_module.main, kwargs={"publisher": publisher}, daemon=True)
+    publishing.start()
+    # The subscriber stops once no message arrived for idle seconds
+    with open(os.devnull, "w") as quiet:
+        stdout, sys.stdout = sys.stdout, quiet
+        try:
+            module.main(subscriber=subscriber)
+        finally:
+            sys.stdout = stdout
+    publishing.join()
+
+    cur.execute("SELECT count(*) FROM breadcrumb")
+    stored = cur.fetchone()[0]
+    cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
+
+    records = publisher_module.total_count
+    seconds = (subscription.last_ack or subscription.first_put) - subscription.first_put
+    lat = subscription.latencies
+    return {
+        "variant": variant,
+        "records": records,
+        "messages": subscription._count,
+        "acked": len(subscription.acked),
+        "stored": stored,
+        "seconds": seconds,
+        "records_per_second": records / seconds if seconds else None,
+        "p50_ms": percentile(lat, 0.50) * 1000 if lat else None,
+        "p99_ms": percentile(lat, 0.99) * 1000 if lat else None,
+        # ru_maxrss is in KiB on Linux
+        "baseline_rss_mb": baseline / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", nargs="+", choices=sorted(VARIANTS), default=sorted(VARIANTS))
+    parser.add_argument("--vehicles", type=int, default=20, help="a weekday has ~1100")
+    parser.add_argument("--points-per-trip", type=int, default=400)
+    parser.add_argument("--envelope-size", type=int, default=0, help="ENVELOPE_SIZE for the publisher")
+    parser.add_argument("--rate", type=float, default=0, help="messages/s to publish at; 0 publishes flat out")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds without messages before a subscriber stops")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_variant(args.child, args.workdir, args.rate, args.idle)
+        print("RESULT " + json.dumps(result))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_end_to_end_")
+    records = write_day(workdir, args.vehicles, args.points_per_trip)
+    print(f"{records} records from {args.vehicles} vehicles, envelope size {args.envelope_size}, "
+          f"rate {args.rate or 'unpaced'}")
+
+    env = dict(os.environ, ENVELOPE_SIZE=str(args.envelope_size))
+    print(f"{'variant':22s} {'rec/s':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'RSS MB':>8s} {'start':>6s} "
+          f"{'worker':>7s}  stored/published")
+    for variant in args.variants:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", variant, "--workdir", workdir,
+             "--rate", str(args.rate), "--idle", str(args.idle)],
+            capture_output=True, text=True, env=env,
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("RESULT ")]
+        if proc.returncode or not lines:
+            print(f"{variant:22s} failed:\n{proc.stderr[-2000:]}")
+            continue
+        r = json.loads(lines[-1][len("RESULT "):])
+        print(f"{variant:22s} {r['records_per_second']:9.0f} {r['p50_ms']:9.1f} {r['p99_ms']:9.1f} "
+              f"{r['peak_rss_mb']:8.0f} {r['baseline_rss_mb']:6.0f} {r['worker_rss_mb']:7.0f}  "
+              f"{r['stored']}/{r['records']} rows, {r['acked']}/{r['messages']} messages")
+
+
+if __name__ == "__main__":
+    main()
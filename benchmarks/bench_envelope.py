@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from envelope import encode_messages, decode_message
+from synth import vehicle_breadcrumbs
+
+# Messages, bytes and encode/decode time for one record per message vs.
+# multi-record envelopes
+
+
+class Message:
+    __slots__ = ("data", "attributes")
+
+    def __init__(self, data, attributes):
+        self.data = data
+        self.attributes = attributes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 50, 200, 500])
+    args = parser.parse_args()
+
+    records = []
+    for vid in range(3000, 3000 + args.vehicles):
+        records.extend(vehicle_breadcrumbs(vid))
+    print(f"{len(records)} records")
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        messages = [Message(d, a) for d, a in encode_messages(records, size)]
+        encoded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = sum(len(decode_message(m)) for m in messages)
+        elapsed = time.perf_counter() - start
+
+        assert decoded == len(records)
+        nbytes = sum(len(m.data) for m in messages)
+        print(f"envelope={size:4d}  {len(messages):8d} msgs  {nbytes / 1e6:8.2f} MB  "
+              f"encode {encoded:6.2f}s  decode {elapsed:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fake_busdata import FakeBusData
+from fetch_engine import Fetcher
+
+# Sequential vs. concurrent breadcrumb fetching against the local stand-in
+
+
+def run(fetcher, vehicle_ids):
+    start = time.time()
+    records = 0
+    for result in fetcher.fetch_all(vehicle_ids):
+        if result.data:
+            records += len(result.data)
+    return time.time() - start, records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16, 32])
+    args = parser.parse_args()
+
+    server = FakeBusData(latency=args.latency, failure_rate=args.failure_rate,
+                         points_per_trip=50).start()
+    vehicle_ids = [str(3000 + i) for i in range(args.vehicles)]
+
+    print(f"{args.vehicles} vehicles, {args.latency}s latency, "
+          f"{args.failure_rate:.0%} failures")
+    for workers in args.workers:
+        fetcher = Fetcher(server.base_url, max_workers=workers, timeout=5, backoff=0.05)
+        seconds, records = run(fetcher, vehicle_ids)
+        failed = sum(1 for r in fetcher.results if r.error is not None)
+        print(f"workers={workers:3d}  {seconds:7.2f}s  {records} records  {failed} failed")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from copy_writer import BREADCRUMB_COLUMNS, row_bytes
+from flush_scheduler import FlushScheduler
+
+# Flush policies against a modeled COPY + commit that costs
+# --overhead-ms per flush plus --row-us per row: the old inline flush every
+# 500 rows, the scheduler with a fixed 500-row batch, and the adaptive
+# scheduler. The producer does --work-us of transform work per row.
+
+ROW_BYTES = row_bytes(BREADCRUMB_COLUMNS)
+
+
+class ModeledCopy:
+    def __init__(self, overhead, per_row):
+        self.overhead = overhead
+        self.per_row = per_row
+        self.rows = 0
+
+    def __call__(self, items):
+        time.sleep(self.overhead + self.per_row * len(items))
+        self.rows += len(items)
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def inline(rows, work, sink):
+    buffer = []
+    for i in range(rows):
+        busy(work)
+        buffer.append(i)
+        if len(buffer) >= 500:
+            sink(buffer)
+            buffer = []
+    if buffer:
+        sink(buffer)
+
+
+def scheduled(rows, work, sink, **kw):
+    scheduler = FlushScheduler(sink, **kw)
+    for i in range(rows):
+        busy(work)
+        scheduler.add(i, ROW_BYTES)
+    scheduler.close()
+    return scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--work-us", type=float, default=5.0)
+    parser.add_argument("--overhead-ms", type=float, default=5.0)
+    parser.add_argument("--row-us", type=float, default=2.0)
+    args = parser.parse_args()
+
+    work = args.work_us / 1e6
+    model = (args.overhead_ms / 1000, args.row_us / 1e6)
+    print(f"{args.rows} rows, {args.work_us} us work/row, flush = {args.overhead_ms} ms + {args.row_us} us/row")
+
+    variants = [
+        ("inline, 500 rows", lambda sink: inline(args.rows, work, sink)),
+        ("scheduler, 500 rows", lambda sink: scheduled(args.rows, work, sink, min_rows=500, max_rows=500)),
+        ("scheduler, adaptive", lambda sink: scheduled(args.rows, work, sink)),
+    ]
+    for label, run in variants:
+        sink = ModeledCopy(*model)
+        start = time.perf_counter()
+        scheduler = run(sink)
+        seconds = time.perf_counter() - start
+        assert sink.rows == args.rows
+        print(f"{label:22s} {seconds:6.2f}s  {args.rows / seconds:9.0f} rows/s")
+        if scheduler is not None:
+            print(f"{'':22s} {scheduler.stats}; final batch {scheduler.batch_rows} rows")
+
+    # A trickle of rows is still written within the latency bound
+    sink = ModeledCopy(*model)
+    scheduler = FlushScheduler(sink, max_latency=0.2)
+    for i in range(20):
+        scheduler.add(i, ROW_BYTES)
+        time.sleep(0.05)
+    time.sleep(0.3)
+    assert sink.rows == 20, sink.rows
+    print(f"trickle of 20 rows      {scheduler.stats}")
+    scheduler.close()
+
+
+if __name__ == "__main__":
+    main()
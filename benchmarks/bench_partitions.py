@@ -0,0 +1,153 @@
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from breadcrumb_partitions import BreadcrumbPartitions, PartitionedCopyWriter
+from copy_writer import BinaryCopyWriter, BREADCRUMB_COLUMNS, TRIP_COLUMNS
+from synth import day_breadcrumbs
+from timestamps import timestamp_epoch
+
+# Per-trip extraction (as for longest_trip.tsv) and a bounding-box query
+# on the old flat BreadCrumb vs. the day-partitioned, indexed one from
+# pipeline.sql, with the same synthetic days loaded. The flat table is
+# then converted with migrate_breadcrumb.sql and checked against it.
+# Runs on a local PostgreSQL in scratch schemas dropped afterwards.
+
+FLAT_SQL = """
+create type service_type as enum ('Weekday', 'Saturday', 'Sunday');
+create type tripdir_type as enum ('Out', 'Back');
+create table Trip (trip_id integer, route_id integer, vehicle_id integer,
+                   service_key service_type, direction tripdir_type, PRIMARY KEY (trip_id));
+create table BreadCrumb (tstamp timestamp, latitude float, longitude float, speed float, trip_id integer,
+                         FOREIGN KEY (trip_id) REFERENCES Trip);
+"""
+TRIP_SQL = "SELECT longitude, latitude, speed FROM breadcrumb WHERE trip_id = %s ORDER BY tstamp"
+# Around the synthetic routes' start, a few hundred meters across
+BOX_SQL = ("SELECT count(*) FROM breadcrumb "
+           "WHERE point(longitude, latitude) <@ box '((-122.70, 45.50), (-122.69, 45.51))'")
+
+
+def connect(schema):
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost"),
+        options=f"-c search_path={schema}",
+    )
+
+
+def rows(days, vehicles):
+    for day in days:
+        for r in day_breadcrumbs(day, vehicles):
+            yield (timestamp_epoch(r["OPD_DATE"], r["ACT_TIME"]), r["GPS_LATITUDE"], r["GPS_LONGITUDE"],
+                   r.get("SPEED"), r["EVENT_NO_TRIP"]), (r["EVENT_NO_TRIP"], r["VEHICLE_ID"])
+
+
+def load(conn, days, vehicles, partitioned):
+    cur = conn.cursor()
+    if partitioned:
+        partitions = BreadcrumbPartitions()
+        partitions.load(conn)
+        breadcrumbs = PartitionedCopyWriter(partitions, BREADCRUMB_COLUMNS)
+    else:
+        breadcrumbs = BinaryCopyWriter("breadcrumb", BREADCRUMB_COLUMNS)
+    trips = {}
+    start = time.perf_counter()
+    for row, (trip_id, vehicle_id) in rows(days, vehicles):
+        trips.setdefault(trip_id, vehicle_id)
+        breadcrumbs.add_rows((row,))
+    trip_copy = BinaryCopyWriter("trip", TRIP_COLUMNS)
+    trip_copy.add_rows(trips.items())
+    trip_copy.copy_to(cur)
+    if partitioned:
+        breadcrumbs.prepare(conn)
+    n = breadcrumbs.copy_to(cur)
+    conn.commit()
+    cur.execute("ANALYZE breadcrumb")
+    conn.commit()
+    return n, time.perf_counter() - start, sorted(trips)
+
+
+def timed(conn, sql, args_list):
+    cur = conn.cursor()
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        cur.execute(sql, args)
+        cur.fetchall()
+        times.append(time.perf_counter() - start)
+    conn.commit()
+    times.sort()
+    return times[len(times) // 2] * 1000, times[-1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    days = range(5, 5 + args.days)
+
+    results = {}
+    for name, partitioned in (("flat", False), ("partitioned", True)):
+        schema = f"bench_partitions_{name}"
+        conn = connect(schema)
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+        if partitioned:
+            with open(os.path.join(ROOT, "pipeline.sql")) as f:
+                cur.execute(f.read())
+        else:
+            cur.execute(FLAT_SQL)
+        conn.commit()
+        n, load_seconds, trip_ids = load(conn, days, args.vehicles, partitioned)
+        step = max(1, len(trip_ids) // args.queries)
+        picks = [(t,) for t in trip_ids[::step][:args.queries]]
+        trip_p50, trip_max = timed(conn, TRIP_SQL, picks)
+        box_p50, _ = timed(conn, BOX_SQL, [()] * 5)
+        cur.execute("SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree('breadcrumb')"
+                    if partitioned else "SELECT pg_total_relation_size('breadcrumb')")
+        size = cur.fetchone()[0]
+        conn.commit()
+        results[name] = (conn, schema, picks)
+        print(f"{name:12s} {n} rows loaded in {load_seconds:6.2f}s, {size / 2**20:6.1f} MiB; "
+              f"trip p50 {trip_p50:7.2f} ms max {trip_max:7.2f} ms; box p50 {box_p50:7.2f} ms")
+
+    # The flat table through the migration must match the partitioned load
+    conn, schema, picks = results["flat"]
+    cur = conn.cursor()
+    start = time.perf_counter()
+    with open(os.path.join(ROOT, "migrate_breadcrumb.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    migrate_seconds = time.perf_counter() - start
+    trip_p50, trip_max = timed(conn, TRIP_SQL, picks)
+    cur.execute("SELECT count(*) FROM breadcrumb_undated")
+    undated = cur.fetchone()[0]
+    cur.execute("SELECT count(*) FROM pg_partition_tree('breadcrumb') WHERE isleaf")
+    leaves = cur.fetchone()[0]
+    cur.execute("SELECT md5(string_agg(t::text, ',' ORDER BY t::text)) FROM breadcrumb t")
+    migrated = cur.fetchone()[0]
+    other = results["partitioned"][0].cursor()
+    other.execute("SELECT md5(string_agg(t::text, ',' ORDER BY t::text)) FROM breadcrumb t")
+    print(f"migrated     in {migrate_seconds:6.2f}s to {leaves} partitions ({undated} undated rows); "
+          f"trip p50 {trip_p50:7.2f} ms max {trip_max:7.2f} ms; "
+          f"same rows as the partitioned load: {migrated == other.fetchone()[0]}")
+
+    for conn, schema, _ in results.values():
+        conn.rollback()
+        conn.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from envelope import encode_messages
+from process_ingest import ProcessIngest
+from synth import day_breadcrumbs
+
+# Messages per second through process_ingest.ProcessIngest vs. worker
+# count. Workers do the real decode/speed/validation work; the sink sleeps
+# for --flush-latency per flush in place of a COPY and commit. Scaling
+# needs as many free cores as workers.
+
+
+class Message:
+    __slots__ = ("data", "attributes", "acked", "nacked")
+
+    def __init__(self, data, attributes):
+        self.data = data
+        self.attributes = attributes
+        self.acked = False
+        self.nacked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.nacked = True
+
+
+class SleepSink:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def write(self, trips, breadcrumbs):
+        time.sleep(self.latency)
+
+
+def run(messages, workers, callback_threads, flush_latency):
+    ingest = ProcessIngest(partial(SleepSink, flush_latency), workers)
+
+    # Several callback threads, like the Pub/Sub client's executor
+    def deliver(part):
+        for msg in part:
+            ingest.receive(msg)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=deliver, args=(messages[i::callback_threads],))
+               for i in range(callback_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ingest.close()
+    return time.perf_counter() - start, ingest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--callback-threads", type=int, default=10)
+    parser.add_argument("--flush-latency", type=float, default=0.01)
+    parser.add_argument("--envelope-size", type=int, default=0)
+    args = parser.parse_args()
+
+    records = day_breadcrumbs(7, args.vehicles)
+    encoded = list(encode_messages(records, args.envelope_size))
+    print(f"{len(records)} records in {len(encoded)} messages, {os.cpu_count()} CPUs, "
+          f"{args.flush_latency * 1000:.0f} ms per flush")
+    for n in args.workers:
+        messages = [Message(data, attrs) for data, attrs in encoded]
+        seconds, ingest = run(messages, n, args.callback_threads, args.flush_latency)
+        acked = sum(m.acked for m in messages)
+        # Only the first point of a trip with no second point stays unacked
+        print(f"workers={n:2d}  {seconds:7.2f}s  {len(messages) / seconds:10.0f} msg/s  "
+              f"acked={acked} unacked={ingest.unacked} skipped={ingest.skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from run_stats import RunStats
+from synth import vehicle_breadcrumbs
+
+# The old post-run block (keep every stored record, then sets and
+# statistics.median) vs run_stats.RunStats updated per record
+
+
+def with_records(records):
+    kept = []
+    for record in records:
+        kept.append(record)
+    date_vehicle_ids = defaultdict(set)
+    act_times = []
+    for record in kept:
+        date, vid, act_time = record.get("OPD_DATE"), record.get("VEHICLE_ID"), record.get("ACT_TIME")
+        if date and vid:
+            date_vehicle_ids[date].add(vid)
+        if act_time is not None:
+            act_times.append(act_time)
+    return {d: len(v) for d, v in date_vehicle_ids.items()}, statistics.median(act_times)
+
+
+def streaming(records, vehicles):
+    stats = RunStats(vehicles)
+    for record in records:
+        stats.add(record)
+    return stats.vehicles_per_date(), stats.act_times.median()
+
+
+def measure(name, fn):
+    # Timed untraced, then run again under tracemalloc for the peak
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:12s} {seconds:7.2f}s  peak {peak / 2**20:7.2f} MiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--vehicles", type=int, default=1500)
+    args = parser.parse_args()
+
+    # Generated a vehicle at a time, so only what a path keeps adds up
+    def records():
+        for day in range(1, args.days + 1):
+            for vid in range(3000, 3000 + args.vehicles):
+                yield from vehicle_breadcrumbs(vid, points_per_trip=20, opd_date=f"{day:02d}MAY2025:00:00:00")
+
+    expected = measure("records", lambda: with_records(records()))
+    exact = measure("exact", lambda: streaming(records(), "exact"))
+    hll = measure("hll", lambda: streaming(records(), "hll"))
+
+    print(f"median ACT_TIME {expected[1]}; exact matches: {exact == expected}")
+    for date, n in expected[0].items():
+        print(f"{date}: {n} vehicles, hll {hll[0][date]} ({(hll[0][date] - n) / n:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from envelope import decode_message
+from speed_transform import TripSpeedTracker
+from trip_shards import ShardedDispatcher
+from validation_rules import RuleEngine
+from synth import day_breadcrumbs
+
+# Messages per second through the sharded subscriber path vs. shard count.
+# Each shard does the real speed/validation work and sleeps for
+# --flush-latency every 500 rows in place of a COPY round trip.
+
+
+class Message:
+    __slots__ = ("data", "attributes", "acked")
+
+    def __init__(self, data):
+        self.data = data
+        self.attributes = {}
+        self.acked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        pass
+
+
+class BenchShard:
+    def __init__(self, flush_latency):
+        self.flush_latency = flush_latency
+        self.speeds = TripSpeedTracker()
+        self.validator = RuleEngine()
+        self.buffer = []
+
+    def handle(self, msg, batch):
+        for data in batch:
+            for record in self.speeds.update(data):
+                self.validator.validate(record)
+                self.buffer.append(record)
+                if len(self.buffer) >= 500:
+                    time.sleep(self.flush_latency)
+                    self.buffer.clear()
+        msg.ack()
+
+
+def run(messages, num_shards, callback_threads, flush_latency):
+    dispatcher = ShardedDispatcher([BenchShard(flush_latency) for _ in range(num_shards)])
+
+    # Several callback threads, like the Pub/Sub client's executor
+    def deliver(part):
+        for msg in part:
+            dispatcher.submit(msg, decode_message(msg))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=deliver, args=(messages[i::callback_threads],))
+               for i in range(callback_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    dispatcher.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--callback-threads", type=int, default=10)
+    parser.add_argument("--flush-latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    records = day_breadcrumbs(7, args.vehicles)
+    print(f"{len(records)} single-record messages, {args.flush_latency * 1000:.0f} ms per flush")
+    for n in args.shards:
+        messages = [Message(json.dumps(r).encode("utf-8")) for r in records]
+        seconds = run(messages, n, args.callback_threads, args.flush_latency)
+        assert all(m.acked for m in messages)
+        print(f"shards={n:2d}  {seconds:7.2f}s  {len(messages) / seconds:10.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from copy_writer import BinaryCopyWriter
+from stop_data_subscriber import StopEventValidator
+from stop_events import (STOP_DATA_COLUMNS, STOP_ENCODING, STOP_EVENT_FIELDS, decode_stop_events,
+                         encode_stop_events, parse_stop_page)
+from synth import stop_events_page
+
+# The stop event path after scraping, old vs. new. Old: one JSON message
+# of string values per record, cast again by the validator and turned
+# back into text for COPY. New: StopEvents STOP_MESSAGE_ROWS to a
+# message, validated as they are and loaded by binary COPY. Times the
+# publish-side encoding, the subscriber's decode + validate, and the
+# COPY into stop_data, then checks both tables hold the same rows. Runs
+# on a local PostgreSQL in scratch schemas dropped afterwards.
+
+
+# ---------- OLD CODE, FOR REFERENCE ----------
+REQUIRED_FIELDS = StopEventValidator.REQUIRED_FIELDS
+
+
+def old_validate(data):
+    for field in REQUIRED_FIELDS:
+        if field not in data or data[field] in ["", None]:
+            return False
+    try:
+        if not (0 <= int(data["leave_time"]) <= 86400):
+            return False
+        if not (0 <= int(data["arrive_time"]) <= 86400):
+            return False
+        if not (0 < float(data["maximum_speed"]) <= 100):
+            return False
+        if float(data["x_coordinate"]) == 0 or float(data["y_coordinate"]) == 0:
+            return False
+    except:
+        return False
+    return True
+
+
+def old_copy(conn, batch):
+    buf = io.StringIO()
+    for r in batch:
+        row = [str(r[k]) for k in REQUIRED_FIELDS]
+        buf.write("\t".join(row) + "\n")
+    buf.seek(0)
+    cur = conn.cursor()
+    cur.copy_from(buf, "stop_data", sep="\t", null="")
+    conn.commit()
+
+
+def old_records(events):
+    # What the old publisher scraped: string cells, plus scraped_date
+    records = []
+    for e in events:
+        record = {k: "" if v is None else str(v) for k, v in zip(STOP_EVENT_FIELDS[:-1], e)}
+        record["scraped_date"] = "2025-05-07"
+        records.append(record)
+    return records
+
+
+def connect(schema):
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost"),
+        options=f"-c search_path={schema}",
+    )
+
+
+def setup(schema):
+    conn = connect(schema)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+    with open(os.path.join(ROOT, "pipeline.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    return conn
+
+
+def run_old(conn, events):
+    records = old_records(events)
+    start = time.perf_counter()
+    messages = [json.dumps(r).encode("utf-8") for r in records]
+    encoded = time.perf_counter()
+    kept = []
+    for data in messages:
+        record = json.loads(data.decode("utf-8"))
+        if old_validate(record):
+            kept.append(record)
+    validated = time.perf_counter()
+    old_copy(conn, kept)
+    copied = time.perf_counter()
+    return messages, len(kept), (encoded - start, validated - encoded, copied - validated)
+
+
+def run_new(conn, events):
+    start = time.perf_counter()
+    messages = list(encode_stop_events(events))
+    encoded = time.perf_counter()
+    validator = StopEventValidator()
+    kept = []
+    for data in messages:
+        kept.extend(e for e in decode_stop_events(data, STOP_ENCODING) if validator.validate(e))
+    validated = time.perf_counter()
+    writer = BinaryCopyWriter("stop_data", STOP_DATA_COLUMNS)
+    writer.add_rows(e[:-1] for e in kept)
+    writer.copy_to(conn.cursor())
+    conn.commit()
+    copied = time.perf_counter()
+    return messages, len(kept), (encoded - start, validated - encoded, copied - validated)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=100)
+    args = parser.parse_args()
+
+    events = []
+    for vid in range(3000, 3000 + args.vehicles):
+        events.extend(parse_stop_page(stop_events_page(vid)).rows)
+    # A few broken rows for the validator to drop
+    for i in range(0, len(events), 97):
+        events[i] = events[i]._replace(maximum_speed=None if i % 2 else 0.0)
+    print(f"{len(events)} stop events")
+
+    checksums = {}
+    for name, run in (("old", run_old), ("new", run_new)):
+        schema = f"bench_stop_data_{name}"
+        conn = setup(schema)
+        messages, stored, (encode, validate, copy) = run(conn, events)
+        print(f"{name}: {len(messages):6d} messages {sum(map(len, messages)) / 2**20:6.2f} MiB  "
+              f"encode {encode:6.3f}s  decode + validate {validate:6.3f}s  COPY {copy:6.3f}s  {stored} stored")
+        cur = conn.cursor()
+        cur.execute("SELECT md5(string_agg(t::text, ',' ORDER BY t::text)) FROM stop_data t")
+        checksums[name] = cur.fetchone()[0]
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+    print("same stop_data rows:", checksums["old"] == checksums["new"])
+
+
+if __name__ == "__main__":
+    main()
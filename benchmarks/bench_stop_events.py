@@ -0,0 +1,202 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import tracemalloc
+from urllib.request import urlopen
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # the lxml tree walk is left out
+    lxml = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fake_busdata import FakeBusData
+from stop_events import STOP_EVENT_FIELDS, STOP_EVENT_TYPES, iter_stop_events, parse_stop_page, stop_fetcher
+from synth import stop_events_page
+
+# Stop-event scraping. Parsing first, over a fixture corpus: the old
+# BeautifulSoup html.parser code of stop_data_gatherer.py and
+# stop_data_publisher.py, an lxml tree walk (if lxml is installed) and
+# stop_events.py's single-pass extractor, for time and memory per page;
+# the extractor's typed rows must equal the old string records once
+# converted. Then the whole scrape against fake_busdata.py: one vehicle
+# at a time with a 0.2 s sleep vs. the concurrent, rate-limited Fetcher.
+# --fixtures reads saved getStopEvents pages (<vehicle>.html); without it
+# synthetic pages are used, and --save-fixtures writes them.
+
+
+# ---------- OLD CODE, FOR REFERENCE ----------
+def old_gatherer(html_data, vehicle_num):
+    soup = BeautifulSoup(html_data, 'html.parser')
+    heading = soup.find('h1')
+    service_date = time.strftime("%Y-%m-%d")
+    if heading:
+        match = re.search(r"(\d{4}-\d{2}-\d{2})", heading.text)
+        if match:
+            service_date = match.group(1)
+    data = []
+    for h2 in soup.find_all('h2', string=re.compile(r'Stop events for PDX_TRIP')):
+        trip_id_match = re.search(r'PDX_TRIP\s+(-?\d+)', h2.text)
+        if not trip_id_match:
+            continue
+        table = h2.find_next('table')
+        if not table:
+            continue
+        rows = table.find_all('tr')
+        if not rows:
+            continue
+        headers = [th.text.strip() for th in rows[0].find_all('th')]
+        for row in rows[1:]:
+            values = [td.text.strip() for td in row.find_all('td')]
+            if len(values) != len(headers):
+                continue
+            record = dict(zip(headers, values))
+            record['vehicle_num'] = vehicle_num
+            record['trip_id'] = trip_id_match.group(1)
+            data.append(record)
+    return service_date, data
+
+
+def old_publisher(html, vehicle_num):
+    soup = BeautifulSoup(html.decode("utf-8"), "html.parser")
+    header = soup.find("h1")
+    date_str = "unknown_date"
+    if header and "for" in header.text:
+        parts = header.text.strip().split("for")
+        date_str = parts[1].strip() if len(parts) > 1 else "unknown_date"
+    all_records = []
+    for table in soup.find_all("table"):
+        headers = [th.text.strip() for th in table.find_all("th")]
+        for tr in table.find_all("tr")[1:]:
+            cells = [td.text.strip() for td in tr.find_all("td")]
+            if len(cells) == len(headers):
+                record = dict(zip(headers, cells))
+                record["scraped_date"] = date_str
+                record["vehicle_number"] = vehicle_num
+                all_records.append(record)
+    return all_records
+
+
+def lxml_rows(html, vehicle_num):
+    # A tree walk with lxml's C parser, same records as old_gatherer
+    doc = lxml.html.fromstring(html.decode("utf-8"))
+    data = []
+    for h2 in doc.iter("h2"):
+        match = re.search(r'PDX_TRIP\s+(-?\d+)', h2.text_content())
+        table = next(h2.itersiblings("table"), None)
+        if match is None or table is None:
+            continue
+        rows = list(table.iter("tr"))
+        headers = [th.text_content().strip() for th in rows[0].iter("th")]
+        for tr in rows[1:]:
+            values = [td.text_content().strip() for td in tr.iter("td")]
+            if len(values) == len(headers):
+                record = dict(zip(headers, values))
+                record['vehicle_num'] = vehicle_num
+                record['trip_id'] = match.group(1)
+                data.append(record)
+    return data
+
+
+def typed(records):
+    # Old string records converted as stop_events.py converts cells
+    converters = dict(STOP_EVENT_TYPES, trip_id=int)
+    return [{k: converters[k](v) if k in converters else v for k, v in r.items()} for r in records]
+
+
+# ---------- PARSE ----------
+def measure_parse(name, fn, pages):
+    start = time.perf_counter()
+    out = [fn(html, vid) for vid, html in pages]
+    seconds = time.perf_counter() - start
+    # Peak while parsing one page, and what a day of results keeps
+    tracemalloc.start()
+    fn(pages[0][1], pages[0][0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    kept = [fn(html, vid) for vid, html in pages]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    print(f"{name:18s} {seconds / len(pages) * 1000:8.2f} ms/page  peak {peak / 2**20:6.2f} MiB/page  "
+          f"results {retained / 2**20:7.2f} MiB")
+    return out
+
+
+# ---------- SCRAPE ----------
+def old_scrape(base_url, vehicles, delay):
+    records = 0
+    for vid in vehicles:
+        with urlopen(f"{base_url}{vid}") as response:
+            html = response.read()
+        records += len(old_gatherer(html, vid)[1])
+        time.sleep(delay)
+    return records
+
+
+def new_scrape(base_url, vehicles, workers, rate):
+    fetcher = stop_fetcher(base_url, max_workers=workers, rate=rate)
+    return sum(len(r.data.trip_records(r.vehicle_id)) for r in fetcher.fetch_all(vehicles))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", help="directory of saved <vehicle>.html getStopEvents pages")
+    parser.add_argument("--save-fixtures", help="write the synthetic pages here")
+    parser.add_argument("--vehicles", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake server takes per page")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5.0, help="requests/s for the concurrent scraper")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, "*.html")))
+        pages = []
+        for path in paths:
+            with open(path, "rb") as f:
+                pages.append((os.path.basename(path)[:-5], f.read()))
+    else:
+        pages = [(str(v), stop_events_page(v).encode("utf-8")) for v in range(3000, 3000 + args.vehicles)]
+        if args.save_fixtures:
+            os.makedirs(args.save_fixtures, exist_ok=True)
+            for vid, html in pages:
+                with open(os.path.join(args.save_fixtures, f"{vid}.html"), "wb") as f:
+                    f.write(html)
+    print(f"{len(pages)} pages, {sum(len(h) for _, h in pages) / len(pages) / 1024:.0f} KiB each")
+
+    gathered = measure_parse("old gatherer", lambda h, v: old_gatherer(h, v)[1], pages)
+    if lxml is not None:
+        trees = measure_parse("lxml tree", lxml_rows, pages)
+        print(f"lxml tree matches: {trees == gathered}")
+    rows = measure_parse("single pass", lambda h, v: list(iter_stop_events(h)), pages)
+    expected = [typed(records) for records in gathered]
+    got = [[dict(zip(STOP_EVENT_FIELDS, row)) for row in page_rows] for page_rows in rows]
+    print("single pass rows match the old gatherer records:",
+          got == [[{k: v for k, v in r.items() if k != "vehicle_num"} for r in page] for page in expected])
+    published = []
+    for vid, html in pages:
+        page = parse_stop_page(html)
+        published.append([{k: v for k, v in r.items() if k != "trip_id"}
+                          for r in page.table_records(page.scraped_date(), vid)])
+    print("publisher records match:", published == [typed(old_publisher(html, vid)) for vid, html in pages])
+
+    server = FakeBusData(latency=args.latency, canned_dir=args.fixtures).start()
+    vehicles = [vid for vid, _ in pages]
+    for name, run in (("sequential + sleep", lambda: old_scrape(server.stop_events_url, vehicles, 0.2)),
+                      (f"{args.workers} workers, {args.rate:g}/s",
+                       lambda: new_scrape(server.stop_events_url, vehicles, args.workers, args.rate))):
+        start = time.perf_counter()
+        records = run()
+        print(f"{name:22s} {time.perf_counter() - start:7.2f}s  {records} records")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import stop_data_subscriber
+from stop_data_subscriber import Database, StopEventSubscriber, StopEventValidator
+from stop_events import STOP_ENCODING, decode_stop_events, encode_stop_events, parse_stop_page
+from fake_pubsub import FakeSubscriberClient
+from synth import stop_events_page
+
+# stop_data_subscriber.py before and after streaming: the old subscriber
+# acks each message on arrival, keeps every event and COPYs them once
+# after the idle timeout; the new one COPYs batches as they fill and acks
+# a message once its events are committed. A day of stop event messages
+# is put on fake_pubsub.py's in-memory subscription and consumed into a
+# scratch schema on a local PostgreSQL. Reported: run time to the last
+# commit, p50 publish-to-ack latency, the most events that were acked but
+# not yet committed at any point (what a crash would lose; validation
+# drops count too) and, with --memory, peak traced memory (tracing slows
+# both runs several times over).
+
+
+# ---------- OLD CODE, FOR REFERENCE ----------
+class OldStopEventSubscriber:
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.last_msg_time = time.time()
+        self.db = Database()
+        self.validator = StopEventValidator()
+
+    def callback(self, msg):
+        with self.lock:
+            try:
+                events = decode_stop_events(msg.data, msg.attributes.get("encoding"))
+                self.records.extend(e for e in events if self.validator.validate(e))
+            except Exception as e:
+                print("Error parsing message:", e)
+            msg.ack()
+            self.last_msg_time = time.time()
+
+    def listen(self, subscriber):
+        sub_path = subscriber.subscription_path(stop_data_subscriber.PROJECT_ID,
+                                                stop_data_subscriber.SUBSCRIPTION_ID)
+        stream = subscriber.subscribe(sub_path, callback=self.callback)
+        while time.time() - self.last_msg_time <= stop_data_subscriber.IDLE_SECONDS:
+            time.sleep(0.1)
+        stream.cancel()
+        stream.result()
+        self.db.copy_records(self.records)
+        self.db.close()
+
+
+def connect(schema):
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost"),
+        options=f"-c search_path={schema}",
+    )
+
+
+def run(name, cls, messages, idle, memory):
+    schema = f"bench_stop_subscriber_{name}"
+    conn = connect(schema)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+    with open(os.path.join(ROOT, "pipeline.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    os.environ["PGOPTIONS"] = f"-c search_path={schema}"
+    stop_data_subscriber.IDLE_SECONDS = idle
+
+    client = FakeSubscriberClient(forget_acked=True)
+    subscription = client.subscription(client.subscription_path(stop_data_subscriber.PROJECT_ID,
+                                                                stop_data_subscriber.SUBSCRIPTION_ID))
+    events = {}
+    for data, n in messages:
+        events[subscription.put(data, {"encoding": STOP_ENCODING})] = n
+
+    # Acked vs. committed events, sampled while the subscriber runs
+    exposed = [0]
+    running = threading.Event()
+    running.set()
+
+    def sample():
+        while running.is_set():
+            acked = sum(events[m] for m in list(subscription.acked))
+            cur.execute("SELECT count(*) FROM stop_data")
+            exposed[0] = max(exposed[0], acked - cur.fetchone()[0])
+            conn.commit()
+            time.sleep(0.05)
+    sampler = threading.Thread(target=sample, daemon=True)
+
+    if memory:
+        tracemalloc.start()
+    subscriber = cls()
+    sampler.start()
+    start = time.perf_counter()
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        subscriber.listen(client)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    seconds = time.perf_counter() - start - idle
+    peak = f"  peak {tracemalloc.get_traced_memory()[1] / 2**20:6.1f} MiB" if memory else ""
+    tracemalloc.stop()
+    running.clear()
+    sampler.join()
+
+    cur.execute("SELECT count(*), md5(string_agg(t::text, ',' ORDER BY t::text)) FROM stop_data t")
+    stored, checksum = cur.fetchone()
+    cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
+    lat = sorted(subscription.latencies)
+    print(f"{name:9s} {seconds:6.2f}s{peak}  p50 ack {lat[len(lat) // 2] * 1000 if lat else 0:8.1f} ms  "
+          f"most acked but uncommitted {exposed[0]:6d} events  {stored} stored, "
+          f"{len(subscription.acked)}/{len(messages)} messages acked")
+    return checksum
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--memory", action="store_true", help="trace peak memory")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds without messages before stopping")
+    args = parser.parse_args()
+
+    messages = []
+    total = 0
+    for vid in range(3000, 3000 + args.vehicles):
+        rows = parse_stop_page(stop_events_page(vid)).rows
+        for data in encode_stop_events(rows):
+            n = len(decode_stop_events(data, STOP_ENCODING))
+            messages.append((data, n))
+            total += n
+    print(f"{total} stop events in {len(messages)} messages")
+
+    old = run("old", OldStopEventSubscriber, messages, args.idle, args.memory)
+    new = run("streaming", StopEventSubscriber, messages, args.idle, args.memory)
+    print("same stop_data rows:", old == new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from timestamps import TimestampCache
+from synth import day_breadcrumbs
+
+# strptime + timedelta + strftime per record (the old store_to_db) vs.
+# the cached conversions in timestamps.py, on a few days of breadcrumbs.
+
+
+def old_text(opd_date_raw, act_time):
+    tstamp_str = None
+    if opd_date_raw and act_time is not None:
+        opd_date = datetime.strptime(opd_date_raw.split(":")[0], "%d%b%Y")
+        tstamp = opd_date + timedelta(seconds=int(act_time))
+        tstamp_str = tstamp.strftime("%Y-%m-%d %H:%M:%S")
+    return tstamp_str
+
+
+def timed(label, n, fn):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    print(f"{label:28s} {seconds:7.3f}s  {n / seconds:12.0f} rec/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--vehicles", type=int, default=50)
+    args = parser.parse_args()
+
+    records = [r for day in range(1, args.days + 1) for r in day_breadcrumbs(day, args.vehicles)]
+    pairs = [(r.get("OPD_DATE"), r.get("ACT_TIME")) for r in records]
+    opd_dates = [p[0] for p in pairs]
+    act_times = [p[1] for p in pairs]
+    n = len(pairs)
+    print(f"{n} records, {len(set(opd_dates))} distinct OPD_DATE values")
+
+    cache = TimestampCache()
+    old = timed("strptime/strftime", n, lambda: [old_text(d, a) for d, a in pairs])
+    text = timed("cached text", n, lambda: [cache.text(d, a) for d, a in pairs])
+    timed("cached epoch", n, lambda: [cache.epoch(d, a) for d, a in pairs])
+    texts = timed("vectorized text", n, lambda: cache.texts(opd_dates, act_times))
+    timed("vectorized epoch", n, lambda: cache.epochs(opd_dates, act_times))
+
+    assert old == text == list(texts)
+    print("outputs match")
+
+
+if __name__ == "__main__":
+    main()
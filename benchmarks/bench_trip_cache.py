@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from copy_writer import BinaryCopyWriter, TRIP_COLUMNS
+from trip_cache import TripIdCache, TripWriter
+
+# Trip dedup per flush against a trip table that already holds --existing
+# trips: SELECT trip_id FROM trip every flush (the old subscriber2) vs.
+# trip_cache.TripWriter with a warmed or lazily loaded TripIdCache, each
+# with plain COPY and with the staging-table merge. Runs on a local
+# PostgreSQL in a scratch schema that is dropped afterwards.
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost")
+    )
+
+
+def reset_table(conn, existing):
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS trip; CREATE TABLE trip (trip_id integer PRIMARY KEY, vehicle_id integer)")
+    writer = BinaryCopyWriter("trip", TRIP_COLUMNS)
+    writer.add_rows((i, 3000 + i % 500) for i in range(existing))
+    writer.copy_to(cur)
+    conn.commit()
+
+
+def flushes(existing, count, trips_per_flush, rows_per_flush):
+    # Each flush repeats its trips many times, like one row per breadcrumb;
+    # half the trips are already in the table
+    next_trip = existing - count * trips_per_flush // 2
+    for _ in range(count):
+        trips = [(next_trip + i, 3000 + i) for i in range(trips_per_flush)]
+        next_trip += trips_per_flush
+        yield [trips[i % trips_per_flush] for i in range(rows_per_flush)]
+
+
+def select_every_flush(conn, batches):
+    cur = conn.cursor()
+    writer = BinaryCopyWriter("trip", TRIP_COLUMNS)
+    for rows in batches:
+        cur.execute("SELECT trip_id FROM trip;")
+        existing_trip_ids = set(row[0] for row in cur.fetchall())
+        seen_trip_ids = set()
+        deduped = []
+        for row in rows:
+            if row[0] not in existing_trip_ids and row[0] not in seen_trip_ids:
+                deduped.append(row)
+                seen_trip_ids.add(row[0])
+        writer.add_rows(deduped)
+        writer.copy_to(cur)
+        conn.commit()
+
+
+def with_cache(load, dedup):
+    def run(conn, batches):
+        cache = TripIdCache(load=load)
+        cache.warm(conn)
+        trips = TripWriter(cache, dedup)
+        cur = conn.cursor()
+        for rows in batches:
+            trips.write(cur, rows)
+            conn.commit()
+            trips.committed()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--existing", type=int, default=500000)
+    parser.add_argument("--flushes", type=int, default=200)
+    parser.add_argument("--trips-per-flush", type=int, default=20)
+    parser.add_argument("--rows-per-flush", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = connect()
+    conn.cursor().execute("CREATE SCHEMA IF NOT EXISTS bench_trip_cache; SET search_path TO bench_trip_cache")
+    conn.commit()
+    print(f"{args.existing} trips in the table, {args.flushes} flushes of {args.rows_per_flush} rows")
+
+    variants = [
+        ("SELECT every flush", select_every_flush),
+        ("warm cache + COPY", with_cache("warm", "copy")),
+        ("warm cache + staging", with_cache("warm", "staging")),
+        ("lazy ranges + COPY", with_cache("lazy", "copy")),
+    ]
+    expected = None
+    for label, run in variants:
+        reset_table(conn, args.existing)
+        batches = list(flushes(args.existing, args.flushes, args.trips_per_flush, args.rows_per_flush))
+        start = time.perf_counter()
+        run(conn, batches)
+        seconds = time.perf_counter() - start
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM trip")
+        count = cur.fetchone()[0]
+        expected = expected or count
+        assert count == expected
+        print(f"{label:22s} {seconds:7.2f}s  {args.flushes / seconds:9.1f} flushes/s  trips={count}")
+
+    conn.cursor().execute("DROP SCHEMA bench_trip_cache CASCADE")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from copy_writer import BinaryCopyWriter, TRIP_COLUMNS
+from stop_data_subscriber import Database
+from stop_events import parse_stop_page
+from synth import stop_events_page
+from trip_cache import TripIdCache, TripWriter
+
+# Trip's route_id, service_key and direction: filled in after the load by
+# joining stop_data to trip, vs. updated by trip_enrichment.py as
+# stop_data_subscriber.py stores each batch. Half of the trips exist
+# before the load; the other half come from the breadcrumb subscribers'
+# TripWriter half-way through, after the enrichment has inserted the
+# first of them, so their merge has to skip those.
+# Reports the load time with and without enrichment, the after-load
+# update, and a downstream query (trips per route, direction and
+# service) through the stop_data join vs. on trip alone, then checks both
+# trip tables match. Runs on a local PostgreSQL in scratch schemas
+# dropped afterwards.
+
+AFTER_LOAD_SQL = """
+    UPDATE trip SET route_id = s.route_number,
+           service_key = CASE s.service_key WHEN 'W' THEN 'Weekday' WHEN 'S' THEN 'Saturday'
+                                            WHEN 'U' THEN 'Sunday' END::service_type,
+           direction = CASE s.direction WHEN 0 THEN 'Out' WHEN 1 THEN 'Back' END::tripdir_type
+    FROM (SELECT DISTINCT ON (trip_number) trip_number, route_number, service_key, direction
+          FROM stop_data) s
+    WHERE trip.trip_id = s.trip_number"""
+JOIN_SQL = """
+    SELECT s.route_number, s.direction, s.service_key, count(*)
+    FROM trip t JOIN (SELECT DISTINCT trip_number, route_number, direction, service_key FROM stop_data) s
+      ON s.trip_number = t.trip_id
+    GROUP BY 1, 2, 3"""
+TRIP_SQL = "SELECT route_id, direction, service_key, count(*) FROM trip GROUP BY 1, 2, 3"
+
+
+def connect(schema):
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost"),
+        options=f"-c search_path={schema}",
+    )
+
+
+def timed(cur, sql, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(sql)
+        if cur.description:
+            cur.fetchall()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def add_trips(cur, trips):
+    copy = BinaryCopyWriter("trip", TRIP_COLUMNS)
+    copy.add_rows(trips)
+    copy.copy_to(cur)
+
+
+def run(name, events, trips, batch, enrich):
+    schema = f"bench_trip_enrichment_{name}"
+    conn = connect(schema)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+    with open(os.path.join(ROOT, "pipeline.sql")) as f:
+        cur.execute(f.read())
+    add_trips(cur, trips[::2])
+    conn.commit()
+
+    os.environ["PGOPTIONS"] = f"-c search_path={schema}"
+    db = Database()
+    if not enrich:
+        db.enrichment = None
+    start = time.perf_counter()
+    late = len(events) // 2
+    for i in range(0, len(events), batch):
+        if i <= late < i + batch:
+            # The rest of the trips arrive with their breadcrumbs
+            TripWriter(TripIdCache()).write(cur, trips[1::2])
+            conn.commit()
+        db.copy_records(events[i:i + batch])
+    load = time.perf_counter() - start
+    db.close()
+
+    after = 0.0
+    if not enrich:
+        start = time.perf_counter()
+        cur.execute(AFTER_LOAD_SQL)
+        conn.commit()
+        after = time.perf_counter() - start
+    cur.execute("ANALYZE")
+    conn.commit()
+    query = timed(cur, TRIP_SQL if enrich else JOIN_SQL)
+    cur.execute("SELECT count(*), md5(string_agg(t::text, ',' ORDER BY t.trip_id)) FROM trip t")
+    count, checksum = cur.fetchone()
+    cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
+    print(f"{name:13s} load {load:6.2f}s  after-load update {after:6.2f}s  "
+          f"trips per route/direction/service {query:7.2f} ms  {count} trips")
+    return checksum
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5000, help="events per COPY, as the subscriber's flushes")
+    args = parser.parse_args()
+
+    events = []
+    for vid in range(3000, 3000 + args.vehicles):
+        events.extend(parse_stop_page(stop_events_page(vid)).rows)
+    trips = sorted({(e.trip_id, e.vehicle_number) for e in events})
+    print(f"{len(events)} stop events, {len(trips)} trips")
+
+    joined = run("after_load", events, trips, args.batch, enrich=False)
+    enriched = run("at_ingest", events, trips, args.batch, enrich=True)
+    print("same trip rows:", joined == enriched)
+
+
+if __name__ == "__main__":
+    main()
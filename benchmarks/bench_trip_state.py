@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from speed_transform import TripSpeedTracker
+from synth import day_breadcrumbs
+from trip_state import TripStateStore
+
+# Speed state held over a multi-day replay: TripSpeedTracker keeps the last
+# full record of every trip ever seen, TripStateStore keeps a few fields
+# per live trip and evicts by idle time / ACT_TIME watermark
+
+
+def replay(make, days, vehicles, trace=False):
+    """Feeds the days in time order. Returns (seconds, trips held, most
+    bytes retained after a day, rows stored); bytes only when traced."""
+    state = make()
+    stored = 0
+    elapsed = 0.0
+    retained = 0
+    if trace:
+        tracemalloc.start()
+    for day in range(1, days + 1):
+        records = day_breadcrumbs(day, vehicles, glitch_rate=0.002)
+        records.sort(key=lambda r: r["ACT_TIME"])
+        start = time.perf_counter()
+        for data in records:
+            stored += len(state.update(data))
+        elapsed += time.perf_counter() - start
+        del records
+        if trace:
+            # What is still allocated once the day's records are dropped
+            # is what the state keeps alive
+            retained = max(retained, tracemalloc.get_traced_memory()[0])
+    if trace:
+        tracemalloc.stop()
+    held = len(state.previous) if hasattr(state, "previous") else len(state)
+    if hasattr(state, "drain"):
+        stored += len(state.drain())
+    return elapsed, held, retained, stored
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--vehicles", type=int, default=100)
+    args = parser.parse_args()
+
+    for name, make in (("TripSpeedTracker", TripSpeedTracker), ("TripStateStore", TripStateStore)):
+        seconds, held, _, stored = replay(make, args.days, args.vehicles)
+        _, _, retained, _ = replay(make, args.days, args.vehicles, trace=True)
+        print(f"{name:17s} {seconds:7.2f}s  trips held {held:7d}  "
+              f"retained {retained / 2**20:8.1f} MiB  rows stored {stored}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pandas as pd
+
+from validation_rules import RuleEngine
+from synth import day_breadcrumbs
+
+# Throughput of the old assert chain (subscriber2.py) vs. the compiled
+# single-record check vs. the column-batch check
+
+
+def assert_vehicle_id(data): assert data.get("VEHICLE_ID") is not None
+def assert_opd_date(data): assert data.get("OPD_DATE") is not None
+def assert_gps_coordinates(data): assert "GPS_LATITUDE" in data and "GPS_LONGITUDE" in data
+def assert_hdop_range(data):
+    hdop = data.get("GPS_HDOP")
+    if hdop is not None:
+        assert 0 < hdop <= 10
+def assert_sats_range(data):
+    sats = data.get("GPS_SATELLITES")
+    if sats is not None:
+        assert 0 <= sats <= 20
+def assert_act_time(data):
+    act_time = data.get("ACT_TIME")
+    if act_time is not None:
+        assert act_time <= 86400
+def assert_intra_hdop(data):
+    if data.get("ACT_TIME") == 0 and data.get("GPS_HDOP", 0) > 5:
+        raise AssertionError
+def assert_intra_sats(data):
+    if data.get("GPS_SATELLITES") == 0 and data.get("GPS_HDOP", 0) < 10:
+        raise AssertionError
+
+
+def legacy(records):
+    passed = failed = 0
+    for data in records:
+        try:
+            assert_vehicle_id(data)
+            assert_opd_date(data)
+            assert_gps_coordinates(data)
+            assert_hdop_range(data)
+            assert_sats_range(data)
+            assert_act_time(data)
+            assert_intra_hdop(data)
+            assert_intra_sats(data)
+            passed += 1
+        except AssertionError:
+            failed += 1
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=200)
+    args = parser.parse_args()
+
+    records = day_breadcrumbs(7, args.vehicles)
+    # Sprinkle in failures so the exception path is exercised too
+    for i, r in enumerate(records):
+        if i % 50 == 0:
+            r["GPS_HDOP"] = 12.0
+        elif i % 77 == 0:
+            r["GPS_SATELLITES"] = 0.0
+    frame = pd.DataFrame(records)
+    n = len(records)
+
+    start = time.perf_counter()
+    legacy_passed = legacy(records)
+    t_legacy = time.perf_counter() - start
+
+    engine = RuleEngine()
+    start = time.perf_counter()
+    for r in records:
+        engine.validate(r)
+    t_record = time.perf_counter() - start
+
+    batch = RuleEngine()
+    start = time.perf_counter()
+    batch.validate_frame(frame)
+    t_frame = time.perf_counter() - start
+
+    print(f"{n} records, {n - legacy_passed} failing")
+    print(f"assert chain     {t_legacy:7.3f}s  {n / t_legacy:12.0f} rec/s")
+    print(f"compiled record  {t_record:7.3f}s  {n / t_record:12.0f} rec/s  passed={engine.passed}")
+    print(f"column batch     {t_frame:7.3f}s  {n / t_frame:12.0f} rec/s  passed={batch.passed}")
+    print("Per-rule failures:")
+    batch.report()
+
+
+if __name__ == "__main__":
+    main()
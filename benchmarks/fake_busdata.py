@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from synth import stop_events_page, vehicle_breadcrumbs
+
+# Local stand-in for busdata.cs.pdx.edu serving canned getBreadCrumbs
+# responses and getStopEvents pages. Point a Fetcher at server.base_url
+# (or server.stop_events_url) to exercise it offline.
+
+
+class FakeBusData(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, canned_dir=None, latency=0.0, failure_rate=0.0,
+                 points_per_trip=400):
+        super().__init__(("127.0.0.1", port), BreadCrumbHandler)
+        self.canned_dir = canned_dir
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.points_per_trip = points_per_trip
+        self.requests = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/getBreadCrumbs?vehicle_id="
+
+    def body_for(self, vehicle_id):
+        with self._lock:
+            self.requests += 1
+            if vehicle_id in self._cache:
+                return self._cache[vehicle_id]
+
+        body = None
+        if self.canned_dir:
+            path = os.path.join(self.canned_dir, f"{vehicle_id}.json")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    body = f.read()
+        if body is None and vehicle_id.isdigit():
+            records = vehicle_breadcrumbs(vehicle_id, points_per_trip=self.points_per_trip)
+            body = json.dumps(records).encode("utf-8")
+
+        with self._lock:
+            self._cache[vehicle_id] = body
+        return body
+
+    @property
+    def stop_events_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/getStopEvents?vehicle_num="
+
+    def stop_page_for(self, vehicle_num):
+        key = ("stops", vehicle_num)
+        with self._lock:
+            self.requests += 1
+            if key in self._cache:
+                return self._cache[key]
+
+        body = None
+        if self.canned_dir:
+            path = os.path.join(self.canned_dir, f"{vehicle_num}.html")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    body = f.read()
+        if body is None and vehicle_num.isdigit():
+            body = stop_events_page(vehicle_num).encode("utf-8")
+
+        with self._lock:
+            self._cache[key] = body
+        return body
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class BreadCrumbHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path not in ("/api/getBreadCrumbs", "/api/getStopEvents"):
+            self.send_error(404)
+            return
+        if random.random() < self.server.failure_rate:
+            self.send_error(503)
+            return
+
+        if url.path == "/api/getStopEvents":
+            body = self.server.stop_page_for(query.get("vehicle_num", [""])[0])
+            content_type = "text/html; charset=utf-8"
+        else:
+            body = self.server.body_for(query.get("vehicle_id", [""])[0])
+            content_type = "application/json"
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned getBreadCrumbs and getStopEvents responses")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--canned-dir", help="directory of <vehicle_id>.json and <vehicle_num>.html responses")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeBusData(args.port, args.canned_dir, args.latency, args.failure_rate)
+    print("serving at", server.base_url)
+    server.serve_forever()
@@ -0,0 +1,206 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# In-memory stand-in for pubsub_v1.PublisherClient. Messages are kept per
+# topic so a run can be inspected, or replayed to FakeSubscriberClient below;
+# with subscriptions given, every published message is also put on each of
+# them at once, as a topic delivers to its subscriptions.
+
+
+class FakePublisherClient:
+    def __init__(self, latency=0.0, failure_rate=0.0, keep_messages=True, subscriptions=()):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.keep_messages = keep_messages
+        self.subscriptions = list(subscriptions)
+        self.topics = {}
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def topic_path(self, project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attrs):
+        future = Future()
+        if self.latency:
+            timer = threading.Timer(self.latency, self._complete, (future, topic, data, attrs))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._complete(future, topic, data, attrs)
+        return future
+
+    def _complete(self, future, topic, data, attrs):
+        if random.random() < self.failure_rate:
+            future.set_exception(RuntimeError("injected publish failure"))
+            return
+        with self._lock:
+            self.published += 1
+            message_id = str(self.published)
+            if self.keep_messages:
+                self.topics.setdefault(topic, []).append((data, dict(attrs), time.time()))
+        for subscription in self.subscriptions:
+            subscription.put(data, attrs)
+        future.set_result(message_id)
+
+
+# In-memory stand-in for pubsub_v1.SubscriberClient. A subscription hands
+# out leases on its messages; an ack ends the lease, a nack puts the
+# message back, and expire() puts back every outstanding lease as if the
+# subscriber had crashed. Acks and nacks from an expired lease are ignored.
+# The time from put() to the first ack of each message is kept in latencies;
+# forget_acked drops a message's payload once it is acked.
+
+
+class FakeReceivedMessage:
+    __slots__ = ("subscription", "message_id", "data", "attributes", "lease", "delivery_attempt")
+
+    def __init__(self, subscription, message_id, data, attributes, lease, delivery_attempt):
+        self.subscription = subscription
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.lease = lease
+        self.delivery_attempt = delivery_attempt
+
+    def ack(self):
+        self.subscription._settle(self, True)
+
+    def nack(self):
+        self.subscription._settle(self, False)
+
+
+class FakeSubscription:
+    def __init__(self, messages=(), forget_acked=False):
+        self.forget_acked = forget_acked
+        self._cond = threading.Condition()
+        self._messages = {}
+        self._put_at = {}
+        self._count = 0
+        self.latencies = []
+        self.first_put = None
+        self.last_ack = None
+        self._ready = deque()
+        self.max_outstanding = 0
+        self._leases = {}
+        self._attempts = {}
+        self._next_lease = 0
+        self.acked = set()
+        self.delivered = 0
+        self.nacked = 0
+        self.expired = 0
+        for data, attrs in messages:
+            self.put(data, attrs)
+
+    def put(self, data, attrs=None):
+        with self._cond:
+            self._count += 1
+            message_id = str(self._count)
+            self._messages[message_id] = (data, dict(attrs or {}))
+            self._put_at[message_id] = now = time.time()
+            if self.first_put is None:
+                self.first_put = now
+            self._ready.append(message_id)
+            self._cond.notify_all()
+            return message_id
+
+    @property
+    def outstanding(self):
+        return len(self._leases)
+
+    def pending(self):
+        """Messages not acked yet, leased or waiting."""
+        with self._cond:
+            return self._count - len(self.acked)
+
+    def pull(self, max_outstanding=None, timeout=0.05):
+        """Leases the next waiting message, or returns None."""
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            while not self._ready or (max_outstanding and len(self._leases) >= max_outstanding):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            message_id = self._ready.popleft()
+            self._next_lease += 1
+            self._leases[self._next_lease] = message_id
+            self.max_outstanding = max(self.max_outstanding, len(self._leases))
+            self._attempts[message_id] = self._attempts.get(message_id, 0) + 1
+            self.delivered += 1
+            data, attrs = self._messages[message_id]
+            return FakeReceivedMessage(self, message_id, data, attrs, self._next_lease,
+                                       self._attempts[message_id])
+
+    def _settle(self, msg, ok):
+        with self._cond:
+            if self._leases.pop(msg.lease, None) is None:
+                return
+            if ok:
+                if msg.message_id not in self.acked:
+                    self.acked.add(msg.message_id)
+                    self.last_ack = now = time.time()
+                    self.latencies.append(now - self._put_at.pop(msg.message_id))
+                    if self.forget_acked:
+                        del self._messages[msg.message_id]
+            else:
+                self.nacked += 1
+                self._ready.append(msg.message_id)
+            self._cond.notify_all()
+
+    def expire(self):
+        """Returns every outstanding lease to the queue."""
+        with self._cond:
+            for message_id in self._leases.values():
+                self._ready.append(message_id)
+            self.expired += len(self._leases)
+            self._leases.clear()
+            self._cond.notify_all()
+
+
+class FakeStreamingPull:
+    """What subscribe() returns: delivers on a thread pool until cancel()."""
+
+    def __init__(self, subscription, callback, max_messages, callback_threads):
+        self.subscription = subscription
+        self.callback = callback
+        self.max_messages = max_messages
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=callback_threads)
+        self._thread = threading.Thread(target=self._deliver, daemon=True, name="fake-pull")
+        self._thread.start()
+
+    def _deliver(self):
+        while not self._cancelled.is_set():
+            msg = self.subscription.pull(self.max_messages)
+            if msg is not None:
+                self._executor.submit(self.callback, msg)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def result(self, timeout=None):
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+
+class FakeSubscriberClient:
+    def __init__(self, callback_threads=10, forget_acked=False):
+        self.callback_threads = callback_threads
+        self.forget_acked = forget_acked
+        self.subscriptions = {}
+
+    def subscription_path(self, project, subscription):
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def subscription(self, path):
+        if path not in self.subscriptions:
+            self.subscriptions[path] = FakeSubscription(forget_acked=self.forget_acked)
+        return self.subscriptions[path]
+
+    def subscribe(self, path, callback, flow_control=None):
+        max_messages = getattr(flow_control, "max_messages", None)
+        return FakeStreamingPull(self.subscription(path), callback, max_messages, self.callback_threads)
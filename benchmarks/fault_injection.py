@@ -0,0 +1,183 @@
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from envelope import decode_payload, encode_messages
+from timestamps import timestamp_epoch
+from fake_pubsub import FakeSubscriberClient
+from synth import day_breadcrumbs
+
+# Fault-injection harness for ack-after-commit. Runs a subscriber's shards
+# against FakeSubscriberClient and a scratch schema on a local PostgreSQL
+# (DB_NAME, DB_HOST, ... as for the subscribers), while
+#   - failing a share of the COPY flushes (--flush-failure-rate), and
+#   - "crashing" the subscriber every --crash-every seconds: the pull is
+#     cancelled, the old shards stop committing, every outstanding lease
+#     expires and a fresh set of shards picks up the redeliveries.
+# At each crash, every message acked so far must have all of its rows in
+# the database; at the end every breadcrumb must be there at least once.
+
+SUBSCRIBERS = {
+    "bulk_insert": os.path.join(ROOT, "vehicle_data", "merged_data", "subscriber_bulk_insert.py"),
+    "subscriber2": os.path.join(ROOT, "project_assignment3", "subscriber2.py"),
+}
+SCHEMA = "fault_injection"
+
+
+def load_subscriber(name):
+    spec = importlib.util.spec_from_file_location(name, SUBSCRIBERS[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stored_keys(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT trip_id, extract(epoch FROM tstamp)::bigint FROM breadcrumb")
+    rows = cur.fetchall()
+    conn.commit()
+    return set(rows), len(rows)
+
+
+def message_keys(records):
+    return [(r["EVENT_NO_TRIP"], timestamp_epoch(r["OPD_DATE"], r["ACT_TIME"])) for r in records]
+
+
+class Generation:
+    """One subscriber process' worth of shards, dispatcher and pull."""
+
+    def __init__(self, module, client, sub_path, max_unacked, failure_rate, rng):
+        trip_cache = module.TripIdCache()
+        partitions = module.BreadcrumbPartitions()
+        conn = module.connect()
+        trip_cache.warm(conn)
+        partitions.load(conn)
+        conn.close()
+        self.shards = [module.BreadcrumbShard(trip_cache, partitions, f"shard-{i}")
+                       for i in range(module.SUBSCRIBER_SHARDS)]
+        for shard in self.shards:
+            copy_to = shard.breadcrumb_copy.copy_to
+
+            def flaky(cur, copy_to=copy_to):
+                if rng.random() < failure_rate:
+                    raise RuntimeError("injected COPY failure")
+                return copy_to(cur)
+            shard.breadcrumb_copy.copy_to = flaky
+
+        self.dispatcher = module.ShardedDispatcher(self.shards)
+        flow_control = module.pubsub_v1.types.FlowControl(max_messages=max_unacked)
+        self.pull = client.subscribe(sub_path, callback=module.make_callback(self.dispatcher),
+                                     flow_control=flow_control)
+
+    def crash(self):
+        # From here on nothing this generation does reaches the database
+        def dead(items):
+            raise RuntimeError("crashed")
+        for shard in self.shards:
+            shard.writer.flush = dead
+        # Wait for the pull to stop, so no lease is taken after expire()
+        self.pull.cancel()
+        self.pull.result()
+
+    def close(self):
+        self.pull.cancel()
+        self.pull.result()
+        self.dispatcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscriber", choices=sorted(SUBSCRIBERS), default="bulk_insert")
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--envelope-size", type=int, default=0)
+    parser.add_argument("--flush-failure-rate", type=float, default=0.2)
+    parser.add_argument("--crash-every", type=float, default=2.0)
+    parser.add_argument("--crashes", type=int, default=3)
+    parser.add_argument("--max-unacked", type=int, default=2000)
+    parser.add_argument("--idle-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Every connection the subscriber opens works in the scratch schema
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+    os.environ.setdefault("FLUSH_MAX_LATENCY", "0.2")
+    # Quiet trips are evicted while the last generation drains, so their
+    # held first points are stored (and retried) before it closes
+    os.environ.setdefault("TRIP_IDLE_SECONDS", "1")
+    os.environ.setdefault("SHARD_IDLE_SECONDS", "0.5")
+    module = load_subscriber(args.subscriber)
+    # subscriber2 appends a JSONL file in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="fault_injection_"))
+
+    conn = module.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    with open(os.path.join(ROOT, "pipeline.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+
+    records = day_breadcrumbs(7, args.vehicles)
+    client = FakeSubscriberClient()
+    sub_path = client.subscription_path("local", "fault-injection")
+    subscription = client.subscription(sub_path)
+    keys_by_message = {}
+    for data, attrs in encode_messages(records, args.envelope_size):
+        message_id = subscription.put(data, attrs)
+        keys_by_message[message_id] = message_keys(decode_payload(data, attrs.get("encoding")))
+    expected = {key for keys in keys_by_message.values() for key in keys}
+    print(f"{len(records)} records in {len(keys_by_message)} messages, {args.subscriber}, "
+          f"{args.flush_failure_rate:.0%} of flushes fail, crash every {args.crash_every}s x{args.crashes}")
+
+    rng = random.Random(args.seed)
+    start = time.time()
+    generation = Generation(module, client, sub_path, args.max_unacked, args.flush_failure_rate, rng)
+    violations = 0
+    for crash in range(args.crashes):
+        time.sleep(args.crash_every)
+        acked = set(subscription.acked)
+        generation.crash()
+        subscription.expire()
+        stored, _ = stored_keys(conn)
+        missing = [m for m in acked if not all(k in stored for k in keys_by_message[m])]
+        violations += len(missing)
+        print(f"crash {crash + 1}: {len(acked)} acked, {len(stored)} rows stored, "
+              f"{len(missing)} acked messages missing rows")
+        generation = Generation(module, client, sub_path, args.max_unacked, args.flush_failure_rate, rng)
+
+    # Let the last generation drain until nothing moves any more
+    last, idle_since = -1, time.time()
+    while subscription.pending() and time.time() - idle_since < args.idle_timeout:
+        time.sleep(0.2)
+        if len(subscription.acked) != last:
+            last, idle_since = len(subscription.acked), time.time()
+    generation.close()
+
+    stored, rows = stored_keys(conn)
+    print(f"done in {time.time() - start:.1f}s: delivered {subscription.delivered}, "
+          f"nacked {subscription.nacked}, expired {subscription.expired}, "
+          f"max outstanding {subscription.max_outstanding} (cap {args.max_unacked})")
+    print(f"messages acked {len(subscription.acked)}/{len(keys_by_message)}, unacked {subscription.pending()}; "
+          f"breadcrumbs stored {len(stored & expected)}/{len(expected)}, extra rows {rows - len(stored)}")
+
+    cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+    assert violations == 0, f"{violations} messages were acked before their rows committed"
+    assert subscription.max_outstanding <= args.max_unacked
+    # A message left unacked (its last flush failed at close) is
+    # redelivered on the next run; every acked one is stored
+    acked_keys = {key for m in subscription.acked for key in keys_by_message[m]}
+    assert acked_keys <= stored
+    print("no acked message lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import random
+
+# Synthetic breadcrumbs shaped like the getBreadCrumbs API output
+OPD_DATE = "07MAY2025:00:00:00"
+
+
+def vehicle_breadcrumbs(vehicle_id, trips=8, points_per_trip=400, opd_date=OPD_DATE, seed=None,
+                        glitch_rate=0.0):
+    rng = random.Random(seed if seed is not None else f"{vehicle_id}-{opd_date}")
+    records = []
+    act_time = rng.randint(16000, 22000)
+    trip_no = 230000000 + int(vehicle_id) * 1000 + int(opd_date[:2]) * 20
+
+    for t in range(trips):
+        trip_no += 1
+        meters = 0
+        lat = 45.5 + rng.uniform(-0.1, 0.1)
+        lon = -122.65 + rng.uniform(-0.1, 0.1)
+        for _ in range(points_per_trip):
+            act_time += rng.choice((5, 5, 5, 10, 15))
+            meters += rng.randint(0, 120)
+            # A glitch is a one-off odometer spike the >45 m/s filter drops
+            reported = meters + 5000 if rng.random() < glitch_rate else meters
+            lat += rng.uniform(-0.0005, 0.0005)
+            lon += rng.uniform(-0.0005, 0.0005)
+            sats = rng.randint(4, 14)
+            records.append({
+                "EVENT_NO_TRIP": trip_no,
+                "EVENT_NO_STOP": trip_no + rng.randint(1, 50),
+                "OPD_DATE": opd_date,
+                "VEHICLE_ID": int(vehicle_id),
+                "METERS": reported,
+                "ACT_TIME": act_time,
+                "GPS_LONGITUDE": round(lon, 6),
+                "GPS_LATITUDE": round(lat, 6),
+                "GPS_SATELLITES": float(sats),
+                "GPS_HDOP": round(rng.uniform(0.5, 3.0), 1),
+            })
+        act_time += rng.randint(300, 1800)
+    return records
+
+
+def day_breadcrumbs(day, vehicles=200, first_vehicle=3000, **kwargs):
+    opd_date = f"{day:02d}MAY2025:00:00:00"
+    records = []
+    for vid in range(first_vehicle, first_vehicle + vehicles):
+        records.extend(vehicle_breadcrumbs(vid, opd_date=opd_date, **kwargs))
+    return records
+
+
+STOP_EVENT_COLUMNS = (
+    "vehicle_number", "leave_time", "train", "route_number", "direction", "service_key",
+    "trip_number", "stop_time", "arrive_time", "dwell", "location_id", "door", "lift",
+    "ons", "offs", "estimated_load", "maximum_speed", "train_mileage", "pattern_distance",
+    "location_distance", "x_coordinate", "y_coordinate", "data_source", "schedule_status",
+)
+
+
+def stop_events_page(vehicle_num, trips=10, stops_per_trip=60, service_date="2025-05-07", seed=None):
+    """HTML shaped like a getStopEvents page: an h1 with the date, then per
+    trip an h2 "Stop events for PDX_TRIP n" and a table of stop events."""
+    rng = random.Random(seed if seed is not None else f"stops-{vehicle_num}-{service_date}")
+    parts = [f"<html><head><title>Stop events for vehicle {vehicle_num}</title></head><body>\n",
+             f"<h1>Trimet CAD/AVL stop data for {service_date}</h1>\n"]
+    trip_no = 240000000 + int(vehicle_num) * 1000
+    leave = rng.randint(16000, 22000)
+    header = "".join(f"<th>{c}</th>" for c in STOP_EVENT_COLUMNS)
+    for t in range(trips):
+        trip_no += 1
+        route, direction = rng.choice((9, 14, 20, 72, 75)), rng.randint(0, 1)
+        mileage = rng.uniform(0, 50000)
+        parts.append(f"<h2>Stop events for PDX_TRIP {trip_no}</h2>\n<table border=\"1\">\n<tr>{header}</tr>\n")
+        for s in range(stops_per_trip):
+            arrive = leave + rng.randint(20, 120)
+            dwell = rng.randint(0, 40)
+            leave = arrive + dwell
+            mileage += rng.uniform(0.05, 0.6)
+            values = (
+                vehicle_num, leave, 0, route, direction, "W", trip_no, arrive - rng.randint(-60, 60),
+                arrive, dwell, rng.randint(1000, 14000), rng.randint(0, 2), 0, rng.randint(0, 8),
+                rng.randint(0, 8), rng.randint(0, 40), rng.randint(5, 25), round(mileage, 2),
+                round(s * 1500.5, 1), round(rng.uniform(0, 20), 1),
+                round(7640000 + rng.uniform(-20000, 20000), 1), round(680000 + rng.uniform(-20000, 20000), 1),
+                0, rng.choice((0, 1)),
+            )
+            parts.append("<tr>" + "".join(f"<td>{v}</td>" for v in values) + "</tr>\n")
+        parts.append("</table>\n")
+        leave += rng.randint(300, 1800)
+    parts.append("</body></html>\n")
+    return "".join(parts)
@@ -0,0 +1,158 @@
+import re
+from datetime import date, timedelta
+
+from copy_writer import BinaryCopyWriter
+
+# ---------- LAYOUT ----------
+# pipeline.sql range-partitions breadcrumb by tstamp, one partition per
+# day named breadcrumb_YYYYMMDD, plus breadcrumb_undated (the default
+# partition) for rows with no tstamp. Day partitions are created here as
+# rows for a new day show up.
+PARENT = "breadcrumb"
+UNDATED = "breadcrumb_undated"
+DAY_SECONDS = 86400
+EPOCH_DATE = date(1970, 1, 1)
+DAY_NAME = re.compile(r"^breadcrumb_(\d{8})$")
+
+CREATE_SQL = "CREATE TABLE IF NOT EXISTS {name} PARTITION OF breadcrumb FOR VALUES FROM (%s) TO (%s)"
+# Serializes partition creation across shards and processes
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('breadcrumb_partitions'))"
+
+
+def day_of(epoch):
+    """Day number (days since 1970-01-01) of an epoch seconds tstamp, or None."""
+    return None if epoch is None else int(epoch // DAY_SECONDS)
+
+
+def partition_name(day):
+    return f"{PARENT}_{EPOCH_DATE + timedelta(days=day):%Y%m%d}"
+
+
+class BreadcrumbPartitions:
+    """The day partitions of breadcrumb known to exist.
+
+    load() checks whether breadcrumb is partitioned at all; on a database
+    still using the flat table every row goes to breadcrumb. Shared by
+    every shard of a subscriber process, like TripIdCache.
+    """
+
+    def __init__(self):
+        self.partitioned = False
+        self._days = set()
+        self._names = {}
+
+    def load(self, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+                    (PARENT,))
+        self.partitioned = cur.fetchone()[0]
+        if self.partitioned:
+            cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                        "WHERE i.inhparent = to_regclass(%s)", (PARENT,))
+            for (name,) in cur.fetchall():
+                m = DAY_NAME.match(name)
+                if m:
+                    d = date(int(m[1][:4]), int(m[1][4:6]), int(m[1][6:]))
+                    self._days.add((d - EPOCH_DATE).days)
+        cur.close()
+        conn.commit()
+
+    def table(self, day):
+        """The table rows of day are written to; day None is a missing tstamp."""
+        if not self.partitioned:
+            return PARENT
+        if day is None:
+            return UNDATED
+        name = self._names.get(day)
+        if name is None:
+            name = self._names[day] = partition_name(day)
+        return name
+
+    def ensure(self, conn, days):
+        """Creates the missing day partitions and commits.
+
+        Runs in a transaction of its own, so call it before the flush's
+        writes. Creating a partition locks breadcrumb briefly; once a day
+        is known this is a set lookup.
+        """
+        if not self.partitioned:
+            return
+        missing = sorted({d for d in days if d is not None} - self._days)
+        if not missing:
+            return
+        cur = conn.cursor()
+        try:
+            cur.execute(LOCK_SQL)
+            for day in missing:
+                self._create(cur, day)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        self._days.update(missing)
+
+    def _create(self, cur, day):
+        start = EPOCH_DATE + timedelta(days=day)
+        cur.execute(CREATE_SQL.format(name=partition_name(day)), (start, start + timedelta(days=1)))
+
+    def __contains__(self, day):
+        return day in self._days
+
+    def __len__(self):
+        return len(self._days)
+
+
+class PartitionedCopyWriter:
+    """BinaryCopyWriter buffers per day partition of breadcrumb.
+
+    Rows are routed on their first column, the tstamp in epoch seconds,
+    and COPYed straight into their partition, so PostgreSQL does no
+    tuple routing. Call prepare() before the flush's writes to create
+    missing partitions; on an error roll back and reset().
+    """
+
+    def __init__(self, partitions, columns):
+        self.partitions = partitions
+        self.columns = tuple(columns)
+        # day (None for no tstamp) -> BinaryCopyWriter
+        self._writers = {}
+
+    def _writer(self, day):
+        writer = self._writers.get(day)
+        if writer is None:
+            writer = self._writers[day] = BinaryCopyWriter(self.partitions.table(day), self.columns)
+        return writer
+
+    def add_rows(self, rows):
+        if not self.partitions.partitioned:
+            self._writer(None).add_rows(rows)
+            return
+        writers = self._writers
+        for row in rows:
+            epoch = row[0]
+            day = None if epoch is None else int(epoch // DAY_SECONDS)
+            writer = writers.get(day)
+            if writer is None:
+                writer = self._writer(day)
+            writer.add(row)
+
+    def prepare(self, conn):
+        """Creates the partitions the buffered rows need; commits."""
+        self.partitions.ensure(conn, [day for day, writer in self._writers.items() if writer.rows])
+
+    def copy_to(self, cur):
+        # Buffers of days that had no rows since the last flush are dropped
+        self._writers = {day: w for day, w in self._writers.items() if w.rows}
+        rows = 0
+        for writer in self._writers.values():
+            rows += writer.copy_to(cur)
+        return rows
+
+    def reset(self):
+        for writer in self._writers.values():
+            writer.reset()
+
+    def __len__(self):
+        return sum(writer.rows for writer in self._writers.values())
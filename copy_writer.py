@@ -0,0 +1,173 @@
+import io
+import struct
+
+# ---------- BINARY COPY FORMAT ----------
+# Header: signature, flags, header extension length. Each row is an int16
+# field count, then per field an int32 byte length (-1 for NULL) and the
+# value in network byte order. The trailer is a field count of -1.
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+
+# PostgreSQL timestamps count microseconds from 2000-01-01
+POSTGRES_EPOCH = 946684800
+
+# type name -> (struct code, byte length, expression turning value v into
+# what struct packs). Timestamps take epoch seconds, as from timestamps.py.
+# text has no fixed length: its UTF-8 bytes follow their length.
+FIELD_TYPES = {
+    "int4": ("i", 4, "{v}"),
+    "float8": ("d", 8, "{v}"),
+    "timestamp": ("q", 8, f"({{v}} - {POSTGRES_EPOCH}) * 1000000"),
+    "text": (None, 0, "{v}.encode()"),
+}
+
+BREADCRUMB_COLUMNS = (
+    ("tstamp", "timestamp"),
+    ("latitude", "float8"),
+    ("longitude", "float8"),
+    ("speed", "float8"),
+    ("trip_id", "int4"),
+)
+TRIP_COLUMNS = (
+    ("trip_id", "int4"),
+    ("vehicle_id", "int4"),
+)
+
+
+def row_bytes(columns):
+    """Encoded size of a row of the given columns with no NULLs (text
+    fields count their length prefix only)."""
+    return 2 + sum(4 + FIELD_TYPES[t][1] for _, t in columns)
+
+
+def encode_field(value, type_name):
+    """One field with its length prefix; None becomes NULL."""
+    if value is None:
+        return NULL_FIELD
+    code, size, _ = FIELD_TYPES[type_name]
+    if type_name == "text":
+        data = str(value).encode()
+        return struct.pack(">i", len(data)) + data
+    if type_name == "timestamp":
+        value = round((value - POSTGRES_EPOCH) * 1000000)
+    elif code == "i":
+        value = int(value)
+    else:
+        value = float(value)
+    return struct.pack(">i" + code, size, value)
+
+
+def compile_row_encoder(types, write):
+    """Builds add(row) writing one row to write() in binary COPY form.
+
+    A row with no NULLs and plain int/float values is one struct.pack
+    call; anything else (None, a float where an int is expected) goes
+    through encode_field() one field at a time. A text field splits the
+    pack in two around its bytes.
+    """
+    n = len(types)
+    names = [f"v{i}" for i in range(n)]
+    namespace = {
+        "struct_error": struct.error,
+        "count": struct.pack(">h", n),
+        "encode_field": encode_field,
+        "write": write,
+    }
+    # Runs of fixed-size fields are packed together; each text field ends
+    # a run with its length and is written as is
+    lines = []
+    parts = []
+    codes, args = ">h", [str(n)]
+    for t, v in zip(types, names):
+        code, size, expr = FIELD_TYPES[t]
+        if code is None:
+            lines.append(f"        b{v} = {expr.format(v=v)}")
+            codes += "i"
+            args.append(f"len(b{v})")
+            pack = f"pack{len(parts)}"
+            namespace[pack] = struct.Struct(codes).pack
+            parts += [f"{pack}({', '.join(args)})", f"b{v}"]
+            codes, args = ">", []
+        else:
+            codes += "i" + code
+            args += [str(size), expr.format(v=v)]
+    if args or not parts:
+        pack = f"pack{len(parts)}"
+        namespace[pack] = struct.Struct(codes).pack
+        parts.append(f"{pack}({', '.join(args)})")
+    lines = [
+        "def add(row):",
+        f"    {', '.join(names)}, = row",
+        "    try:",
+        *lines,
+        f"        write({' + '.join(parts)})",
+        "    except (TypeError, AttributeError, struct_error):",
+        f"        write(count + b''.join([{', '.join(f'encode_field({v}, {t!r})' for t, v in zip(types, names))}]))",
+    ]
+    exec("\n".join(lines), namespace)
+    return namespace["add"]
+
+
+class BinaryCopyWriter:
+    """Buffers rows for one table in binary COPY form and loads them.
+
+    columns is a sequence of (column name, type name) pairs, see
+    FIELD_TYPES. The same BytesIO is reused for every copy_to().
+    """
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = tuple(columns)
+        names = ", ".join(name for name, _ in self.columns)
+        self.sql = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT binary)"
+        self.rows = 0
+        self._buf = io.BytesIO()
+        self._buf.write(PGCOPY_HEADER)
+        self._add = compile_row_encoder([t for _, t in self.columns], self._buf.write)
+
+    def add(self, row):
+        self._add(row)
+        self.rows += 1
+
+    def add_rows(self, rows):
+        add = self._add
+        n = 0
+        for row in rows:
+            add(row)
+            n += 1
+        self.rows += n
+
+    def __len__(self):
+        return self.rows
+
+    def getvalue(self):
+        return self._buf.getvalue() + PGCOPY_TRAILER
+
+    def copy_to(self, cur):
+        """COPYs the buffered rows through cur and clears the buffer.
+
+        Committing is left to the caller. On an error the rows are kept,
+        so the caller can roll back and either retry or reset().
+        """
+        if not self.rows:
+            return 0
+        buf = self._buf
+        buf.write(PGCOPY_TRAILER)
+        buf.seek(0)
+        try:
+            cur.copy_expert(self.sql, buf)
+        except Exception:
+            # Drop the trailer again so more rows can be added
+            buf.seek(-len(PGCOPY_TRAILER), io.SEEK_END)
+            buf.truncate()
+            raise
+        rows = self.rows
+        self.reset()
+        return rows
+
+    def reset(self):
+        self._buf.seek(0)
+        self._buf.truncate()
+        self._buf.write(PGCOPY_HEADER)
+        self.rows = 0
@@ -1,13 +1,14 @@
-from urllib import request
 import csv
-import json
 import os
 from datetime import datetime
+from fetch_engine import Fetcher
+from day_archive import open_day_writer
 
 # Constants
 BASE_URL = "https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id="
 CSV_FILE = "Glitch Vehicle IDs - VehicleGroupsIDs.csv"
 OUTPUT_DIR = "vehicle_data"
+FETCH_REPORT = os.path.join(OUTPUT_DIR, "fetch_times.csv")
 
 # Create output directory if it doesn't exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -23,32 +24,27 @@ def get_vehicle_ids(csv_file):
                     vehicle_ids.add(item)
     return list(vehicle_ids)
 
+fetcher = Fetcher(BASE_URL)
+
 def fetch_data(vehicle_id):
-    url = f"{BASE_URL}{vehicle_id}"
-    try:
-        with request.urlopen(url) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            return data
-    except Exception as e:
-        pass  
-    return None
+    return fetcher.fetch_one(vehicle_id).data
 
 def save_json(vehicle_id, data):
     today_str = datetime.now().strftime("%Y-%m-%d")
-    filename = f"{OUTPUT_DIR}/{today_str}_{vehicle_id}.json"
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
-    print(f"[{vehicle_id}] Data saved to {filename}")
+    with open_day_writer(f"{OUTPUT_DIR}/{today_str}_{vehicle_id}") as writer:
+        writer.write(data)
+    print(f"[{vehicle_id}] Data saved to {writer.path}")
 
 def main():
     vehicle_ids = get_vehicle_ids(CSV_FILE)
     print(f"Found {len(vehicle_ids)} vehicle IDs.")
 
-    for vid in vehicle_ids:
-        print(f"Fetching data for vehicle ID: {vid}...")
-        data = fetch_data(vid)
-        if data:
-            save_json(vid, data)
+    for result in fetcher.fetch_all(vehicle_ids):
+        if result.data:
+            save_json(result.vehicle_id, result.data)
+
+    fetcher.report()
+    fetcher.write_csv(FETCH_REPORT)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+import glob
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# ---------- CONFIG ----------
+# "json" keeps the original day files; "parquet" writes typed, compressed
+# columns that can be read back in chunks and counted from metadata
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "json")
+ROW_GROUP_SIZE = 128 * 1024
+DAY_FILE_PATTERN = "2025-??-??"
+
+# Breadcrumb columns as returned by getBreadCrumbs. A Parquet day file
+# keeps only these: any other key is dropped (with a warning, once per
+# file) and "" is stored as null. GPS_SATELLITES comes as a float.
+COLUMNS = [
+    ("EVENT_NO_TRIP", "int64", int),
+    ("EVENT_NO_STOP", "int64", int),
+    ("OPD_DATE", "string", str),
+    ("VEHICLE_ID", "int32", int),
+    ("METERS", "int32", int),
+    ("ACT_TIME", "int32", int),
+    ("GPS_LONGITUDE", "float64", float),
+    ("GPS_LATITUDE", "float64", float),
+    ("GPS_SATELLITES", "float64", float),
+    ("GPS_HDOP", "float64", float),
+]
+
+
+COLUMN_NAMES = {name for name, _, _ in COLUMNS}
+
+
+def _require_arrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for parquet day files (pip install pyarrow)")
+
+
+def breadcrumb_schema():
+    _require_arrow()
+    return pa.schema([(name, getattr(pa, typ)()) for name, typ, _ in COLUMNS])
+
+
+# Append-only writer for a day file. Records are written as they arrive,
+# and the file is still a plain JSON array that json.load() can read.
+class JsonArrayWriter:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._f = open(path, "w")
+        self._f.write("[")
+
+    def write(self, records):
+        for record in records:
+            self._f.write(",\n" if self.count else "\n")
+            self._f.write(json.dumps(record))
+            self.count += 1
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.write("\n]\n" if self.count else "]\n")
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Append-only Parquet writer with the same interface. Records are
+# buffered until a full row group is ready, so memory is bounded by
+# row_group_size rather than by the size of the day.
+class ParquetDayWriter:
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._schema = breadcrumb_schema()
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._pending = []
+        self._warned = False
+
+    def write(self, records):
+        self._pending.extend(records)
+        while len(self._pending) >= self.row_group_size:
+            self._flush(self._pending[:self.row_group_size])
+            del self._pending[:self.row_group_size]
+
+    def _flush(self, records):
+        if not self._warned:
+            extra = {key for r in records for key in r} - COLUMN_NAMES
+            if extra:
+                print(f"{self.path}: not archived, not in day_archive.COLUMNS: {', '.join(sorted(extra))}")
+                self._warned = True
+        arrays = []
+        for (name, _, cast), field in zip(COLUMNS, self._schema):
+            values = []
+            for r in records:
+                v = r.get(name)
+                values.append(None if v is None or v == "" else cast(v))
+            arrays.append(pa.array(values, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self.count += len(records)
+
+    def close(self):
+        if self._writer is None:
+            return
+        if self._pending:
+            self._flush(self._pending)
+            self._pending = []
+        self._writer.close()
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_day_writer(base_path, fmt=ARCHIVE_FORMAT):
+    """Opens base_path + ".json" or ".parquet" for appending records."""
+    if fmt == "parquet":
+        return ParquetDayWriter(base_path + ".parquet")
+    return JsonArrayWriter(base_path + ".json")
+
+
+def is_parquet(path):
+    return path.endswith(".parquet")
+
+
+def day_files(directory=".", pattern=DAY_FILE_PATTERN):
+    paths = glob.glob(os.path.join(directory, pattern + ".json"))
+    paths += glob.glob(os.path.join(directory, pattern + ".parquet"))
+    return sorted(paths)
+
+
+def count_records(path):
+    # Parquet keeps the row count in the footer, no data is read
+    if is_parquet(path):
+        _require_arrow()
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, "r") as f:
+        return len(json.load(f))
+
+
+def iter_batches(path, columns=None, batch_size=65536):
+    """Yields pyarrow RecordBatches of the requested columns."""
+    _require_arrow()
+    if is_parquet(path):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
+        return
+    with open(path, "r") as f:
+        records = json.load(f)
+    names = columns or [name for name, _, _ in COLUMNS]
+    for i in range(0, len(records), batch_size):
+        chunk = records[i:i + batch_size]
+        yield pa.RecordBatch.from_pydict({n: [r.get(n) for r in chunk] for n in names})
+
+
+def iter_records(path, batch_size=65536):
+    """Yields record dicts, as json.load() on a day file would."""
+    if is_parquet(path):
+        for batch in iter_batches(path, batch_size=batch_size):
+            yield from batch.to_pylist()
+        return
+    with open(path, "r") as f:
+        yield from json.load(f)
@@ -0,0 +1,68 @@
+import json
+import os
+import zlib
+
+from trip_shards import TRIP_ATTR, trip_key, trip_tag
+
+# ---------- CONFIG ----------
+# Records per Pub/Sub message. 0 or 1 keeps the original one record per
+# message format, which subscribers still accept.
+ENVELOPE_SIZE = int(os.getenv("ENVELOPE_SIZE", "0"))
+ENVELOPE_ENCODING = "zlib-json-v1"
+
+# Most trips that can be collecting records at once before the oldest is
+# sent early, so unsorted input cannot hold a whole day in memory
+MAX_OPEN_TRIPS = 1000
+
+
+def pack_envelope(records):
+    payload = json.dumps(records, separators=(",", ":")).encode("utf-8")
+    attrs = {
+        "encoding": ENVELOPE_ENCODING,
+        "records": str(len(records)),
+        TRIP_ATTR: trip_tag(trip_key(records[0])),
+    }
+    return zlib.compress(payload), attrs
+
+
+def encode_messages(records, envelope_size=ENVELOPE_SIZE, max_open_trips=MAX_OPEN_TRIPS):
+    """Yields (data, attributes) pairs ready for publisher.publish().
+
+    With envelopes on, records are grouped by (VEHICLE_ID, EVENT_NO_TRIP)
+    in arrival order and each envelope holds up to envelope_size records
+    from a single trip. Every message names its trip in the "trip"
+    attribute, so subscribers can route it without decoding the payload.
+    """
+    if envelope_size <= 1:
+        for record in records:
+            yield json.dumps(record).encode("utf-8"), {TRIP_ATTR: trip_tag(trip_key(record))}
+        return
+
+    open_trips = {}
+    for record in records:
+        key = trip_key(record)
+        group = open_trips.get(key)
+        if group is None:
+            if len(open_trips) >= max_open_trips:
+                oldest = next(iter(open_trips))
+                yield pack_envelope(open_trips.pop(oldest))
+            group = open_trips[key] = []
+        group.append(record)
+        if len(group) >= envelope_size:
+            yield pack_envelope(open_trips.pop(key))
+
+    for group in open_trips.values():
+        yield pack_envelope(group)
+
+
+def decode_payload(data, encoding=None):
+    """Returns the list of records in a message body with the given encoding."""
+    if encoding == ENVELOPE_ENCODING:
+        return json.loads(zlib.decompress(data))
+    return [json.loads(data.decode("utf-8"))]
+
+
+def decode_message(msg):
+    """Returns the list of records carried by a Pub/Sub message."""
+    attrs = getattr(msg, "attributes", None) or {}
+    return decode_payload(msg.data, attrs.get("encoding"))
@@ -0,0 +1,143 @@
+import csv
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib import request, error
+
+# ---------- CONFIG ----------
+BREADCRUMB_URL = "https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id="
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "16"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "0.5"))
+# Most requests per second across all workers, retries included; 0 is unlimited
+FETCH_RATE = float(os.getenv("FETCH_RATE", "0"))
+
+
+class FetchResult:
+    __slots__ = ("vehicle_id", "data", "seconds", "attempts", "error")
+
+    def __init__(self, vehicle_id, data, seconds, attempts, error=None):
+        self.vehicle_id = vehicle_id
+        self.data = data
+        self.seconds = seconds
+        self.attempts = attempts
+        self.error = error
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart across threads.
+
+    A caller reserves the next slot under the lock and sleeps outside it,
+    so waiting workers do not hold each other up.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            at = max(time.monotonic(), self._next)
+            self._next = at + self.interval
+        delay = at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Fetcher:
+    """Fetches one URL per vehicle on a bounded thread pool.
+
+    Each request gets its own timeout and is retried with jittered
+    exponential backoff. With a rate, requests are spaced to at most
+    that many per second. Results are yielded as they complete, and the
+    time spent on every vehicle is kept for report().
+    """
+
+    def __init__(self, base_url=BREADCRUMB_URL, max_workers=FETCH_WORKERS,
+                 timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES,
+                 backoff=FETCH_BACKOFF, parse=json.loads, rate=FETCH_RATE):
+        self.base_url = base_url
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.parse = parse
+        self.limiter = RateLimiter(rate)
+        self.results = []
+
+    def fetch_one(self, vehicle_id):
+        url = f"{self.base_url}{vehicle_id}"
+        start = time.time()
+        attempts = 0
+        last_error = None
+
+        while attempts <= self.retries:
+            attempts += 1
+            self.limiter.wait()
+            try:
+                with request.urlopen(url, timeout=self.timeout) as response:
+                    data = self.parse(response.read())
+                return FetchResult(vehicle_id, data, time.time() - start, attempts)
+            except error.HTTPError as e:
+                last_error = e
+                # A 4xx will not change on retry (e.g. unknown vehicle id)
+                if e.code < 500 and e.code != 429:
+                    break
+            except Exception as e:
+                last_error = e
+
+            if attempts <= self.retries:
+                # Full jitter keeps retries from many workers from lining up
+                time.sleep(random.uniform(0, self.backoff * (2 ** (attempts - 1))))
+
+        return FetchResult(vehicle_id, None, time.time() - start, attempts, last_error)
+
+    def fetch_all(self, vehicle_ids):
+        # At most max_workers requests are submitted at a time, so a huge
+        # id list never turns into a huge backlog of pending futures
+        ids = iter(vehicle_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = set()
+            for vid in ids:
+                pending.add(pool.submit(self.fetch_one, vid))
+                if len(pending) >= self.max_workers:
+                    break
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.results.append(result)
+                    yield result
+                    for vid in ids:
+                        pending.add(pool.submit(self.fetch_one, vid))
+                        break
+
+    def report(self, slowest=10):
+        if not self.results:
+            print("No vehicles fetched.")
+            return
+        failed = [r for r in self.results if r.error is not None]
+        total = sum(r.seconds for r in self.results)
+        print("\n--- Fetch Report ---")
+        print(f"Vehicles: {len(self.results)} ({len(failed)} failed)")
+        print(f"Workers: {self.max_workers}" + (f", {1 / self.limiter.interval:g} requests/s" if self.limiter.interval else ""))
+        print(f"Mean fetch time: {total / len(self.results):.3f} seconds")
+        for r in sorted(self.results, key=lambda r: r.seconds, reverse=True)[:slowest]:
+            status = f"error: {r.error}" if r.error is not None else "ok"
+            print(f"  [{r.vehicle_id}] {r.seconds:.3f}s, {r.attempts} attempt(s), {status}")
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["vehicle_id", "seconds", "attempts", "error"])
+            for r in self.results:
+                writer.writerow([r.vehicle_id, round(r.seconds, 4), r.attempts,
+                                 "" if r.error is None else str(r.error)])
@@ -0,0 +1,172 @@
+import os
+import queue
+import threading
+import time
+
+# ---------- CONFIG ----------
+# A batch is flushed at FLUSH_MAX_ROWS rows, FLUSH_MAX_BYTES bytes or
+# FLUSH_MAX_LATENCY seconds after its first row, whichever comes first
+FLUSH_MIN_ROWS = int(os.getenv("FLUSH_MIN_ROWS", "500"))
+FLUSH_MAX_ROWS = int(os.getenv("FLUSH_MAX_ROWS", "20000"))
+FLUSH_MAX_BYTES = int(os.getenv("FLUSH_MAX_BYTES", str(4 * 1024 * 1024)))
+FLUSH_MAX_LATENCY = float(os.getenv("FLUSH_MAX_LATENCY", "1.0"))
+# The row trigger moves between the min and max so a flush takes about this long
+FLUSH_TARGET_SECONDS = float(os.getenv("FLUSH_TARGET_SECONDS", "0.2"))
+# Batches waiting for the writer before add() blocks
+FLUSH_QUEUE_SIZE = int(os.getenv("FLUSH_QUEUE_SIZE", "4"))
+
+_STOP = object()
+
+
+class FlushStats:
+    __slots__ = ("flushes", "failed", "rows", "bytes", "seconds", "max_seconds",
+                 "max_rows", "max_queue", "triggers")
+
+    def __init__(self):
+        self.flushes = 0
+        self.failed = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_rows = 0
+        self.max_queue = 0
+        self.triggers = {"rows": 0, "bytes": 0, "latency": 0, "close": 0}
+
+    def record(self, rows, nbytes, seconds, trigger, ok):
+        self.flushes += 1
+        self.failed += not ok
+        self.rows += rows
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.max_rows = max(self.max_rows, rows)
+        self.triggers[trigger] += 1
+
+    def merge(self, other):
+        for name in ("flushes", "failed", "rows", "bytes", "seconds"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.max_rows = max(self.max_rows, other.max_rows)
+        self.max_queue = max(self.max_queue, other.max_queue)
+        for name, n in other.triggers.items():
+            self.triggers[name] += n
+
+    def __str__(self):
+        if not self.flushes:
+            return "no flushes"
+        triggers = ", ".join(f"{name} {n}" for name, n in self.triggers.items() if n)
+        return (f"{self.flushes} flushes ({self.failed} failed), "
+                f"avg {self.rows / self.flushes:.0f} rows / {self.bytes / self.flushes / 1024:.0f} KiB "
+                f"in {self.seconds / self.flushes * 1000:.1f} ms, max {self.max_rows} rows "
+                f"in {self.max_seconds * 1000:.1f} ms, max queue {self.max_queue}; by {triggers}")
+
+
+class FlushScheduler:
+    """Collects rows and writes them in batches on a background thread.
+
+    add() only appends; the batch is handed to the writer thread when it
+    reaches batch_rows rows or max_bytes bytes, or max_latency seconds
+    after its first row. flush(items) runs on the writer thread, so a
+    slow COPY never holds up the thread calling add(); only a writer
+    queue_size batches behind makes add() wait.
+
+    batch_rows starts at min_rows and is moved after every flush toward
+    the size that would have taken target_seconds at the measured rows
+    per second, within [min_rows, max_rows]. A flush that raises counts
+    as failed; handling it (rollback, logging) is up to flush().
+    """
+
+    def __init__(self, flush, name="writer", min_rows=FLUSH_MIN_ROWS, max_rows=FLUSH_MAX_ROWS,
+                 max_bytes=FLUSH_MAX_BYTES, max_latency=FLUSH_MAX_LATENCY,
+                 target_seconds=FLUSH_TARGET_SECONDS, queue_size=FLUSH_QUEUE_SIZE):
+        self.flush = flush
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.target_seconds = target_seconds
+        self.batch_rows = min_rows
+        self.stats = FlushStats()
+
+        self._items = []
+        self._bytes = 0
+        self._opened = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True, name=name)
+        self._thread.start()
+
+    def add(self, item, nbytes=0):
+        with self._lock:
+            if not self._items:
+                self._opened = time.monotonic()
+            self._items.append(item)
+            self._bytes += nbytes
+            if len(self._items) >= self.batch_rows:
+                self._hand_off("rows")
+            elif self._bytes >= self.max_bytes:
+                self._hand_off("bytes")
+
+    def _hand_off(self, trigger):
+        # Caller holds the lock, so batches reach the writer in order
+        batch = (self._items, self._bytes, trigger)
+        self._items = []
+        self._bytes = 0
+        self._opened = None
+        self._queue.put(batch)
+        self.stats.max_queue = max(self.stats.max_queue, self._queue.qsize())
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            opened = self._opened
+            if opened is None:
+                timeout = self.max_latency / 4
+            else:
+                timeout = max(0.0, opened + self.max_latency - time.monotonic())
+            try:
+                batch = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # Nothing handed off in time: take the open batch if it is
+                # due. This thread is the only consumer, so it must not
+                # block on a full queue.
+                with self._lock:
+                    if (self._opened is not None and not self._queue.full() and
+                            time.monotonic() - self._opened >= self.max_latency):
+                        self._hand_off("latency")
+                continue
+            if batch is _STOP:
+                break
+            self._write(*batch)
+
+    def _write(self, items, nbytes, trigger):
+        start = time.monotonic()
+        try:
+            self.flush(items)
+            ok = True
+        except Exception:
+            ok = False
+        seconds = time.monotonic() - start
+        self.stats.record(len(items), nbytes, seconds, trigger, ok)
+        if ok and trigger != "latency":
+            self._adapt(len(items), seconds)
+
+    def _adapt(self, rows, seconds):
+        # Half way toward the size that fits the target, to damp noise
+        if seconds <= 0:
+            target = self.max_rows
+        else:
+            target = rows * self.target_seconds / seconds
+        size = (self.batch_rows + target) / 2
+        self.batch_rows = int(min(self.max_rows, max(self.min_rows, size)))
+
+    def close(self):
+        """Flushes what is left and stops the writer thread."""
+        with self._lock:
+            if self._items:
+                self._hand_off("close")
+            self._queue.put(_STOP)
+        self._thread.join()
@@ -1,6 +1,6 @@
 import os
-import json
 from collections import defaultdict
+from day_archive import open_day_writer, iter_records
 
 DATA_FOLDER = "/opt/Project-DataEng/vehicle_data/"
 MERGE_FOLDER = os.path.join(DATA_FOLDER, "merged_data")
@@ -11,25 +11,19 @@ os.makedirs(MERGE_FOLDER, exist_ok=True)
 
 # Group filenames by date
 for fname in os.listdir(DATA_FOLDER):
-    if fname.endswith(".json") and "_" in fname:
+    if fname.endswith((".json", ".parquet")) and "_" in fname:
         date = fname.split("_")[0]
         grouped_files[date].append(fname)
 
-# Merge and move
+# Merge and move; each vehicle file is streamed into the day file
+# (ARCHIVE_FORMAT picks .json or .parquet output)
 for date, files in grouped_files.items():
-    merged = []
-    for fname in files:
-        path = os.path.join(DATA_FOLDER, fname)
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-                merged.extend(data)
-        except Exception as e:
-            print(f"Skipping {fname} (error: {e})")
+    with open_day_writer(os.path.join(MERGE_FOLDER, date)) as writer:
+        for fname in files:
+            path = os.path.join(DATA_FOLDER, fname)
+            try:
+                writer.write(list(iter_records(path)))
+            except Exception as e:
+                print(f"Skipping {fname} (error: {e})")
 
-    merged_filename = f"{date}.json"
-    merged_path = os.path.join(MERGE_FOLDER, merged_filename)
-    with open(merged_path, "w") as f:
-        json.dump(merged, f, indent=2)
-
-    print(f"{date}: Merged {len(merged)} records to {merged_path}")
+    print(f"{date}: Merged {writer.count} records to {writer.path}")
@@ -0,0 +1,44 @@
+-- Moves an existing flat BreadCrumb table into the day-partitioned
+-- layout of pipeline.sql, keeping its rows. Run once, with the
+-- subscribers stopped:  psql -d trimet -f migrate_breadcrumb.sql
+
+begin;
+
+alter table BreadCrumb rename to BreadCrumb_flat;
+
+create table BreadCrumb (
+        tstamp timestamp,
+        latitude float,
+        longitude float,
+        speed float,
+        trip_id integer,
+        FOREIGN KEY (trip_id) REFERENCES Trip
+) partition by range (tstamp);
+
+create table BreadCrumb_undated partition of BreadCrumb (
+        check (tstamp is null)
+) default;
+
+-- A partition for every day already stored, named as the subscribers do
+do $$
+declare
+        d date;
+begin
+        for d in select distinct tstamp::date from BreadCrumb_flat where tstamp is not null loop
+                execute format('create table %I partition of BreadCrumb for values from (%L) to (%L)',
+                               'breadcrumb_' || to_char(d, 'YYYYMMDD'), d, d + 1);
+        end loop;
+end $$;
+
+insert into BreadCrumb (tstamp, latitude, longitude, speed, trip_id)
+select tstamp, latitude, longitude, speed, trip_id from BreadCrumb_flat;
+
+-- Indexes are built after the copy, once per partition
+create index breadcrumb_trip_tstamp on BreadCrumb (trip_id, tstamp);
+create index breadcrumb_location on BreadCrumb using gist (point(longitude, latitude));
+
+drop table BreadCrumb_flat;
+
+commit;
+
+analyze BreadCrumb;
@@ -0,0 +1,37 @@
+-- Gives an existing stop_data table, loaded by the old text COPY, the
+-- column types of pipeline.sql, keeping its rows: the subscriber's binary
+-- COPY (stop_events.STOP_DATA_COLUMNS) fails on text columns. Empty
+-- strings become NULL. Run once, with the subscribers stopped:
+-- psql -d trimet -f migrate_stop_data.sql
+
+begin;
+
+alter table stop_data
+        alter column vehicle_number type integer using nullif(trim(vehicle_number::text), '')::numeric::integer,
+        alter column leave_time type integer using nullif(trim(leave_time::text), '')::numeric::integer,
+        alter column train type integer using nullif(trim(train::text), '')::numeric::integer,
+        alter column route_number type integer using nullif(trim(route_number::text), '')::numeric::integer,
+        alter column direction type integer using nullif(trim(direction::text), '')::numeric::integer,
+        alter column service_key type text using nullif(trim(service_key::text), ''),
+        alter column trip_number type integer using nullif(trim(trip_number::text), '')::numeric::integer,
+        alter column stop_time type integer using nullif(trim(stop_time::text), '')::numeric::integer,
+        alter column arrive_time type integer using nullif(trim(arrive_time::text), '')::numeric::integer,
+        alter column dwell type integer using nullif(trim(dwell::text), '')::numeric::integer,
+        alter column location_id type integer using nullif(trim(location_id::text), '')::numeric::integer,
+        alter column door type integer using nullif(trim(door::text), '')::numeric::integer,
+        alter column lift type integer using nullif(trim(lift::text), '')::numeric::integer,
+        alter column ons type integer using nullif(trim(ons::text), '')::numeric::integer,
+        alter column offs type integer using nullif(trim(offs::text), '')::numeric::integer,
+        alter column estimated_load type integer using nullif(trim(estimated_load::text), '')::numeric::integer,
+        alter column maximum_speed type float using nullif(trim(maximum_speed::text), '')::float,
+        alter column train_mileage type float using nullif(trim(train_mileage::text), '')::float,
+        alter column pattern_distance type float using nullif(trim(pattern_distance::text), '')::float,
+        alter column location_distance type float using nullif(trim(location_distance::text), '')::float,
+        alter column x_coordinate type float using nullif(trim(x_coordinate::text), '')::float,
+        alter column y_coordinate type float using nullif(trim(y_coordinate::text), '')::float,
+        alter column data_source type integer using nullif(trim(data_source::text), '')::numeric::integer,
+        alter column schedule_status type integer using nullif(trim(schedule_status::text), '')::numeric::integer;
+
+commit;
+
+analyze stop_data;
@@ -1,4 +1,5 @@
 drop table if exists BreadCrumb;
+drop table if exists stop_data;
 drop table if exists Trip;
 drop type if exists service_type;
 drop type if exists tripdir_type;
@@ -22,4 +23,46 @@ create table BreadCrumb (
         speed float,
         trip_id integer,
         FOREIGN KEY (trip_id) REFERENCES Trip
+) partition by range (tstamp);
+
+-- One partition per day, breadcrumb_YYYYMMDD, created by the subscribers
+-- (breadcrumb_partitions.py) as days show up. Rows with no tstamp go to
+-- the default partition; its check lets a new day partition skip scanning it.
+create table BreadCrumb_undated partition of BreadCrumb (
+        check (tstamp is null)
+) default;
+
+-- Extracting a trip: where trip_id = ... order by tstamp
+create index breadcrumb_trip_tstamp on BreadCrumb (trip_id, tstamp);
+-- Bounding boxes (tunnel, PSU, Ladd's Addition) without PostGIS:
+-- where point(longitude, latitude) <@ box '((lon1, lat1), (lon2, lat2))'
+create index breadcrumb_location on BreadCrumb using gist (point(longitude, latitude));
+
+-- Stop events (stop_data_subscriber.py), loaded by binary COPY: the
+-- column types must match stop_events.STOP_DATA_COLUMNS
+create table stop_data (
+        vehicle_number integer,
+        leave_time integer,
+        train integer,
+        route_number integer,
+        direction integer,
+        service_key text,
+        trip_number integer,
+        stop_time integer,
+        arrive_time integer,
+        dwell integer,
+        location_id integer,
+        door integer,
+        lift integer,
+        ons integer,
+        offs integer,
+        estimated_load integer,
+        maximum_speed float,
+        train_mileage float,
+        pattern_distance float,
+        location_distance float,
+        x_coordinate float,
+        y_coordinate float,
+        data_source integer,
+        schedule_status integer
 );
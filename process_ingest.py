@@ -0,0 +1,346 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+try:
+    import psycopg2
+except ImportError:  # only PostgresSink needs it
+    psycopg2 = None
+
+from ack_tracking import AckGroup, RecordOrigins, released, tracked_speeds
+from breadcrumb_partitions import BreadcrumbPartitions, PartitionedCopyWriter
+from copy_writer import BREADCRUMB_COLUMNS
+from run_stats import RunStats
+from envelope import decode_message, decode_payload
+from timestamps import timestamp_epoch
+from trip_cache import TripIdCache, TripWriter
+from trip_shards import TRIP_ATTR, shard_of_tag, trip_key, trip_tag
+from trip_state import TripStateStore
+from validation_rules import RuleEngine
+
+# ---------- CONFIG ----------
+# Worker processes; 0 keeps the threaded in-process subscriber
+SUBSCRIBER_PROCESSES = int(os.getenv("SUBSCRIBER_PROCESSES", "0"))
+# Messages per batch handed to a worker, and the longest one waits to fill
+RECEIVE_BATCH = int(os.getenv("RECEIVE_BATCH", "200"))
+RECEIVE_DELAY = float(os.getenv("RECEIVE_DELAY", "0.2"))
+# Batches queued per worker before the receiver blocks
+WORKER_QUEUE_BATCHES = int(os.getenv("WORKER_QUEUE_BATCHES", "64"))
+# Breadcrumb rows per COPY, and the longest rows wait before one
+WORKER_FLUSH_ROWS = int(os.getenv("WORKER_FLUSH_ROWS", "5000"))
+WORKER_FLUSH_SECONDS = float(os.getenv("WORKER_FLUSH_SECONDS", "1.0"))
+
+
+# ---------- SINK ----------
+class PostgresSink:
+    """Writes one flush of trip and breadcrumb rows in a single transaction."""
+
+    def __init__(self, **params):
+        self.conn = psycopg2.connect(**params)
+        self.cur = self.conn.cursor()
+        self.trip_writer = TripWriter(TripIdCache())
+        self.trip_writer.cache.warm(self.conn)
+        # Each worker learns the day partitions on its own
+        partitions = BreadcrumbPartitions()
+        partitions.load(self.conn)
+        self.breadcrumb_copy = PartitionedCopyWriter(partitions, BREADCRUMB_COLUMNS)
+
+    def write(self, trips, breadcrumbs):
+        try:
+            # New day partitions are created and committed first
+            self.breadcrumb_copy.add_rows(breadcrumbs)
+            self.breadcrumb_copy.prepare(self.conn)
+            self.trip_writer.write(self.cur, trips)
+            self.breadcrumb_copy.copy_to(self.cur)
+            self.conn.commit()
+            self.trip_writer.committed()
+        except Exception:
+            self.conn.rollback()
+            self.trip_writer.rolled_back()
+            self.breadcrumb_copy.reset()
+            raise
+
+    def close(self):
+        self.cur.close()
+        self.conn.close()
+
+
+def breadcrumb_row(data):
+    return (
+        timestamp_epoch(data.get("OPD_DATE"), data.get("ACT_TIME")),
+        data.get("GPS_LATITUDE"),
+        data.get("GPS_LONGITUDE"),
+        data.get("SPEED"),
+        data.get("EVENT_NO_TRIP"),
+    )
+
+
+# ---------- WORKER PROCESS ----------
+class _Worker:
+    """Decode, speed, validate and COPY for the trips of one shard."""
+
+    def __init__(self, index, outbox, sink):
+        self.index = index
+        self.outbox = outbox
+        self.sink = sink
+        self.speeds = TripStateStore()
+        self.validator = RuleEngine()
+        self.origins = RecordOrigins()
+        self.run_stats = RunStats()
+
+        self.trips = {}
+        self.breadcrumbs = []
+        self.groups = []
+        self.first_row_at = None
+        self.stored = 0
+        self.failed_flushes = 0
+
+    def handle(self, batch_id, payloads):
+        group = AckGroup(lambda ok: self.outbox.put(("done", batch_id, ok)))
+        for data, encoding in payloads:
+            try:
+                records = decode_payload(data, encoding)
+            except Exception as e:
+                # Acked like the threaded callback does with bad JSON
+                print("Invalid JSON:", e)
+                continue
+            for record in records:
+                self.process_record(record, group)
+        group.seal()
+        if len(self.breadcrumbs) >= WORKER_FLUSH_ROWS:
+            self.flush()
+
+    def process_record(self, data, group):
+        self.store_records(tracked_speeds(self.speeds, self.origins, data, group))
+
+    def store_records(self, pairs):
+        for record, origin in pairs:
+            self.validator.validate(record)
+            self.run_stats.add(record)
+            trip_id = record.get("EVENT_NO_TRIP")
+            vehicle_id = record.get("VEHICLE_ID")
+            if trip_id and vehicle_id:
+                self.trips.setdefault(trip_id, vehicle_id)
+            self.breadcrumbs.append(breadcrumb_row(record))
+            if origin is not None:
+                self.groups.append(origin)
+        if self.first_row_at is None and self.breadcrumbs:
+            self.first_row_at = time.monotonic()
+
+    def due(self):
+        return self.first_row_at is not None and time.monotonic() - self.first_row_at >= WORKER_FLUSH_SECONDS
+
+    def flush(self):
+        if not self.breadcrumbs and not self.groups:
+            return
+        try:
+            self.sink.write(list(self.trips.items()), self.breadcrumbs)
+            ok = True
+            self.stored += len(self.breadcrumbs)
+        except Exception as e:
+            print(f"Worker {self.index} flush failed:", e)
+            ok = False
+            self.failed_flushes += 1
+
+        # Messages are acked only once all their rows are committed; a
+        # failed flush nacks them so Pub/Sub redelivers
+        for group in self.groups:
+            if ok:
+                group.done()
+            else:
+                group.fail()
+        self.trips = {}
+        self.breadcrumbs = []
+        self.groups = []
+        self.first_row_at = None
+
+
+def _worker_main(index, inbox, outbox, make_sink):
+    worker = _Worker(index, outbox, make_sink())
+    while True:
+        try:
+            item = inbox.get(timeout=WORKER_FLUSH_SECONDS)
+        except queue.Empty:
+            # Quiet trips are evicted and their held first points stored
+            worker.store_records(released(worker.speeds.evict(), worker.origins))
+            worker.flush()
+            continue
+        if item is None:
+            break
+        worker.handle(*item)
+        if worker.due():
+            worker.flush()
+
+    worker.store_records(released(worker.speeds.drain(), worker.origins))
+    worker.flush()
+    close = getattr(worker.sink, "close", None)
+    if close is not None:
+        close()
+    outbox.put(("stats", index, {
+        "validator": worker.validator,
+        "run_stats": worker.run_stats,
+        "skipped": worker.speeds.skipped,
+        "stored": worker.stored,
+        "failed_flushes": worker.failed_flushes,
+        "evicted": worker.speeds.evicted,
+    }))
+
+
+# ---------- RECEIVER ----------
+class ProcessIngest:
+    """Receives Pub/Sub messages and leaves the CPU work to worker processes.
+
+    The receiving process only reads each message's "trip" attribute and
+    groups the raw payloads into per-shard batches; every worker owns the
+    trips that hash to it, so trip order and speed state stay in one
+    process. A message is acked once the worker has committed all of its
+    rows, and nacked if that commit fails.
+
+    make_sink must be picklable (a top-level class or a functools.partial
+    of one) and return an object with write(trips, breadcrumbs) that
+    commits, and optionally close(). Build ProcessIngest before creating
+    the SubscriberClient so the workers are forked before gRPC starts its
+    threads.
+    """
+
+    def __init__(self, make_sink, workers=SUBSCRIBER_PROCESSES,
+                 batch_messages=RECEIVE_BATCH, max_delay=RECEIVE_DELAY):
+        ctx = multiprocessing.get_context()
+        self.workers = workers
+        self.batch_messages = batch_messages
+        self.max_delay = max_delay
+
+        self._inboxes = [ctx.Queue(maxsize=WORKER_QUEUE_BATCHES) for _ in range(workers)]
+        self._outbox = ctx.Queue()
+        self._procs = [
+            ctx.Process(target=_worker_main, args=(i, self._inboxes[i], self._outbox, make_sink),
+                        daemon=True, name=f"ingest-{i}")
+            for i in range(workers)
+        ]
+        for p in self._procs:
+            p.start()
+
+        self._locks = [threading.Lock() for _ in range(workers)]
+        self._ids = itertools.count()
+        self._msgs = [[] for _ in range(workers)]
+        self._payloads = [[] for _ in range(workers)]
+        self._held = {}
+
+        self.batches = [0] * workers
+        self.acked = 0
+        self.nacked = 0
+        self.stats = {}
+
+        self._stopping = threading.Event()
+        self._results = threading.Thread(target=self._read_results, daemon=True, name="ingest-results")
+        self._timer = threading.Thread(target=self._flush_partial, daemon=True, name="ingest-timer")
+        self._results.start()
+        self._timer.start()
+
+    def receive(self, msg):
+        """Pub/Sub callback: route the raw payload to its trip's worker."""
+        attrs = getattr(msg, "attributes", None) or {}
+        tag = attrs.get(TRIP_ATTR)
+        if tag is None:
+            # Messages from older publishers carry no trip attribute
+            try:
+                records = decode_message(msg)
+            except Exception as e:
+                print("Invalid JSON:", e)
+                msg.ack()
+                return
+            if not records:
+                msg.ack()
+                return
+            tag = trip_tag(trip_key(records[0]))
+
+        i = shard_of_tag(tag, self.workers)
+        # Batches of a shard are queued in the order they were filled
+        with self._locks[i]:
+            self._msgs[i].append(msg)
+            self._payloads[i].append((msg.data, attrs.get("encoding")))
+            if len(self._msgs[i]) >= self.batch_messages:
+                self._send(i)
+
+    def _send(self, i):
+        # Caller holds self._locks[i]; put() blocks while the worker is behind
+        batch_id = next(self._ids)
+        self._held[batch_id] = self._msgs[i]
+        self._inboxes[i].put((batch_id, self._payloads[i]))
+        self._msgs[i] = []
+        self._payloads[i] = []
+        self.batches[i] += 1
+
+    def _send_partial(self):
+        for i in range(self.workers):
+            with self._locks[i]:
+                if self._msgs[i]:
+                    self._send(i)
+
+    def _flush_partial(self):
+        while not self._stopping.wait(self.max_delay):
+            self._send_partial()
+
+    def _read_results(self):
+        remaining = self.workers
+        while remaining:
+            kind, key, value = self._outbox.get()
+            if kind == "stats":
+                self.stats[key] = value
+                remaining -= 1
+                continue
+            msgs = self._held.pop(key)
+            for msg in msgs:
+                if value:
+                    msg.ack()
+                else:
+                    msg.nack()
+            if value:
+                self.acked += len(msgs)
+            else:
+                self.nacked += len(msgs)
+
+    def queue_depths(self):
+        return [q.qsize() for q in self._inboxes]
+
+    def close(self):
+        """Sends what is batched, lets every worker flush and waits for them."""
+        self._stopping.set()
+        self._timer.join()
+        self._send_partial()
+        for q in self._inboxes:
+            q.put(None)
+        self._results.join()
+        for p in self._procs:
+            p.join()
+
+        # Only messages whose rows failed to commit at shutdown are left
+        self.unacked = sum(len(msgs) for msgs in self._held.values())
+
+    @property
+    def validator(self):
+        merged = RuleEngine()
+        for stats in self.stats.values():
+            merged.merge(stats["validator"])
+        return merged
+
+    @property
+    def run_stats(self):
+        merged = RunStats()
+        for stats in self.stats.values():
+            merged.merge(stats["run_stats"])
+        return merged
+
+    @property
+    def skipped(self):
+        return sum(stats["skipped"] for stats in self.stats.values())
+
+    def report(self):
+        stored = sum(stats["stored"] for stats in self.stats.values())
+        failed = sum(stats["failed_flushes"] for stats in self.stats.values())
+        print(f"Workers: {self.workers}, batches per worker: {self.batches}")
+        print(f"Rows stored: {stored}, failed flushes: {failed}")
+        print(f"Messages acked: {self.acked}, nacked: {self.nacked}, unacked: {self.unacked}")
@@ -2,12 +2,18 @@ from urllib import request
 import csv
 import json
 import os
+import sys
 import time
 from datetime import datetime
-from concurrent import futures
 from google.oauth2 import service_account
 from google.cloud import pubsub_v1
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from publish_flow import FlowControlledPublisher
+from envelope import encode_messages
+
 # ---------- CONFIG ----------
 CSV_FILE = "Glitch Vehicle IDs - VehicleGroupsIDs.csv"
 SERVICE_ACCOUNT_FILE = "/opt/dataengr-dataguru-809ccf8d3880.json"
@@ -23,6 +29,7 @@ COMBINED_FILE = f"{DATE_STR}.json"
 credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
 publisher = pubsub_v1.PublisherClient(credentials=credentials)
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+flow = FlowControlledPublisher(publisher, topic_path)
 
 # ---------- FUNCTIONS ----------
 def get_vehicle_ids(csv_file):
@@ -47,12 +54,6 @@ def fetch_data(vehicle_id):
         print(f"[{vehicle_id}] Error fetching data: {e}")
     return []
 
-def callback(future):
-    try:
-        future.result()
-    except Exception as e:
-        print(f"Unable to publish message: {e}")
-
 # ---------- MAIN ----------
 def main():
     vehicle_ids = get_vehicle_ids(CSV_FILE)
@@ -72,24 +73,14 @@ def main():
     print(f"Data gathering took {round(time.time() - start_gather, 2)} seconds")
 
     # Publish records to Pub/Sub
-    future_list = []
     start_publish = time.time()
 
-    for i, record in enumerate(all_records):
-        data_str = json.dumps(record)
-        data = data_str.encode("utf-8")
-
-        future = publisher.publish(topic_path, data)
-        future.add_done_callback(callback)
-        future_list.append(future)
-
-        if (i + 1) % 50000 == 0:
-            print(f"Published {i + 1} messages...")
+    for data, attrs in encode_messages(all_records):
+        flow.publish(data, **attrs)
 
-    for future in futures.as_completed(future_list):
-        continue
+    flow.wait()
 
-    print(f"Published {len(all_records)} messages to {topic_path}")
+    flow.report()
     print(f"Publishing took {round(time.time() - start_publish, 2)} seconds")
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
 from google.cloud import pubsub_v1 
+import os
+import sys
 import time
 import threading
 import json
@@ -8,6 +10,11 @@ from collections import defaultdict
 import statistics
 from datetime import datetime, timedelta
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from envelope import decode_message
+
 # Pub/Sub configuration
 project_id = "dataengr-dataguru"
 sub_id = "project-topic-sub"
@@ -125,69 +132,70 @@ def calculate_speed(current, previous):
 #         last_msg_time = time.time()
 
 # MESSAGE HANDLER
+# A message is one breadcrumb or an envelope of several (envelope.py)
 def callback(msg):
     global last_msg_time
     with lock:
-        decoded = msg.data.decode("utf-8")
-
         try:
-            data = json.loads(decoded)
+            batch = decode_message(msg)
         except Exception as e:
             print("Invalid JSON:", e)
             msg.ack()
             return
 
-        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
-
-        if key in previous_data:
-            prev = previous_data[key]
-
-            # Calculate speed using current and previous breadcrumb
-            speed = calculate_speed(data, prev)
-
-            # Filter unrealistic speed only if > 45 m/s
-            if speed > 45:
-                print(f"Skipping message with unrealistic speed: {speed:.2f} m/s")
-                msg.ack()
-                return
-
-            # Assign same speed to both prev and current (first+second)
-            prev["SPEED"] = speed
-            data["SPEED"] = speed
-
-            # Validate both
-            validate_message(prev)
-            validate_message(data)
-            
-            # Store both to DB
-            store_to_db(prev)
-            store_to_db(data)
-
-            records.append(prev)
-            records.append(data)
-
-            # Append and write both (only if prev["SPEED"] wasn't already set)
-            # try:
-                # with open("testing.jsonl", "a") as f:
-                    # if "SPEED" not in prev:  # Only write prev once
-                        # f.write(json.dumps(prev) + "\n")
-                        # records.append(prev)
-                    # f.write(json.dumps(data) + "\n")
-                    # records.append(data)
-            # except Exception as e:
-                # print("Failed to write to file:", e)
-
-        else:
-            # First breadcrumb — store for now (write later)
-            previous_data[key] = data
-            msg.ack()
-            last_msg_time = time.time()
+        for data in batch:
+            process_record(data)
+        msg.ack()
+        last_msg_time = time.time()
+
+# RECORD HANDLER
+def process_record(data):
+    key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
+
+    if key in previous_data:
+        prev = previous_data[key]
+
+        # Calculate speed using current and previous breadcrumb
+        speed = calculate_speed(data, prev)
+
+        # Filter unrealistic speed only if > 45 m/s
+        if speed > 45:
+            print(f"Skipping message with unrealistic speed: {speed:.2f} m/s")
             return
 
-        # Update last seen breadcrumb for this vehicle/trip
+        # Assign same speed to both prev and current (first+second)
+        prev["SPEED"] = speed
+        data["SPEED"] = speed
+
+        # Validate both
+        validate_message(prev)
+        validate_message(data)
+        
+        # Store both to DB
+        store_to_db(prev)
+        store_to_db(data)
+
+        records.append(prev)
+        records.append(data)
+
+        # Append and write both (only if prev["SPEED"] wasn't already set)
+        # try:
+            # with open("testing.jsonl", "a") as f:
+                # if "SPEED" not in prev:  # Only write prev once
+                    # f.write(json.dumps(prev) + "\n")
+                    # records.append(prev)
+                # f.write(json.dumps(data) + "\n")
+                # records.append(data)
+        # except Exception as e:
+            # print("Failed to write to file:", e)
+
+    else:
+        # First breadcrumb — store for now (write later)
         previous_data[key] = data
-        msg.ack()
-        last_msg_time = time.time()
+        return
+
+    # Update last seen breadcrumb for this vehicle/trip
+    previous_data[key] = data
 
 # DB Insertion
 def store_to_db(data):
@@ -1,8 +1,15 @@
-import glob
-import json
+import os
+import sys
 import time
 from google.cloud import pubsub_v1
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from publish_flow import FlowControlledPublisher
+from envelope import encode_messages
+from day_archive import day_files, iter_records
+
 # Configuration
 SERVICE_ACCOUNT_FILE = "/opt/dataengr-dataguru-809ccf8d3880.json"
 PROJECT_ID = "dataengr-dataguru"
@@ -11,49 +18,33 @@ TOPIC_ID = "project-topic"
 # Publisher setup
 publisher = pubsub_v1.PublisherClient()
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+flow = FlowControlledPublisher(publisher, topic_path)
+
+total_count = 0
+
+def counted(records):
+    global total_count
+    for record in records:
+        total_count += 1
+        yield record
 
 def main():
-    json_files = sorted(glob.glob("2025-??-??.json"))
-    total_count = 0
+    json_files = day_files()
     start = time.time()
 
     for filename in json_files:
-        with open(filename, "r") as f:
-            records = json.load(f)
-
-        batch = []
-        for i, record in enumerate(records):
-            data = json.dumps(record).encode("utf-8")
-            batch.append(data)
-
-            # Send in batches of 5000 for performance
-            if len(batch) == 5000:
-                publish_batch(batch)
-                batch = []
-
-            total_count += 1
-            if total_count % 50000 == 0:
-                print(f"Published {total_count} messages...")
-
-        # Publish any leftover messages
-        if batch:
-            publish_batch(batch)
+        # Parquet day files are read one column chunk at a time;
+        # publish() blocks once too many messages are outstanding
+        for data, attrs in encode_messages(counted(iter_records(filename))):
+            flow.publish(data, **attrs)
 
         print(f"Done with file: {filename}")
 
+    flow.wait()
     end = time.time()
-    print(f" Published {total_count} messages to {topic_path}")
+    print(f" Read {total_count} records from {len(json_files)} files")
+    flow.report()
     print(f" Total runtime: {round(end - start, 2)} seconds")
 
-def publish_batch(batch):
-    futures = []
-    for data in batch:
-        future = publisher.publish(topic_path, data)
-        futures.append(future)
-    # Wait for just the last one to complete to avoid overwhelming memory
-    if futures:
-        futures[-1].result()
-
 if __name__ == "__main__":
     main()
-
@@ -5,8 +5,15 @@ import time
 import threading
 import pandas as pd
 import io
+import os
+import sys
 import psycopg2
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from stop_events import STOP_ENCODING, decode_stop_events
+
 # ========== Configurations ==========
 PROJECT_ID = "dataengr-dataguru"
 SUBSCRIPTION_ID = "stop-event-sub"
@@ -94,9 +101,15 @@ class StopEventSubscriber:
     def callback(self, msg):
         with self.lock:
             try:
-                data = json.loads(msg.data.decode("utf-8"))
-                if self.validator.validate(data):
-                    self.records.append(data)
+                # One JSON record, or a batch of stop events from
+                # stop_data_publisher.py (stop_events.py)
+                if msg.attributes.get("encoding") == STOP_ENCODING:
+                    batch = [e._asdict() for e in decode_stop_events(msg.data, STOP_ENCODING)]
+                else:
+                    batch = [json.loads(msg.data.decode("utf-8"))]
+                for data in batch:
+                    if self.validator.validate(data):
+                        self.records.append(data)
             except Exception as e:
                 print("Error parsing message:", e)
             msg.ack()
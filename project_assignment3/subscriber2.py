@@ -1,14 +1,29 @@
-from google.cloud import pubsub_v1 
+from google.cloud import pubsub_v1
 import time
 import threading
 import json
-import pandas as pd
 import psycopg2
-import io
 from collections import defaultdict
 import statistics
-from datetime import datetime, timedelta
+import argparse
 import os
+import sys
+from functools import partial
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from envelope import decode_message
+from validation_rules import ASSERT_BREADCRUMB_RULES, RuleEngine
+from trip_state import TripStateStore
+from timestamps import timestamp_epoch
+from copy_writer import BREADCRUMB_COLUMNS, row_bytes
+from breadcrumb_partitions import BreadcrumbPartitions, PartitionedCopyWriter
+from flush_scheduler import FlushScheduler, FlushStats
+from ack_tracking import AckGroup, RecordOrigins, released, settle, tracked_speeds
+from trip_cache import TripIdCache, TripWriter
+from trip_shards import ShardedDispatcher, SUBSCRIBER_SHARDS
+from replay import Replay
 
 # Toggle this to True to enable debug prints
 DEBUG = False
@@ -18,262 +33,248 @@ project_id = "dataengr-dataguru"
 sub_id = "project-topic-sub"
 
 # PostgreSQL connection using environment variables
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME", "trimet"),
-    user=os.getenv("DB_USER", "postgres"),
-    password=os.getenv("DB_PASSWORD", "123456"),
-    host=os.getenv("DB_HOST", "localhost")
-)
-cur = conn.cursor()
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost")
+    )
+
+# Most messages leased and not yet acked. A message is acked only after
+# the COPY holding its rows commits, so this also caps what a crash can
+# send back for redelivery.
+MAX_UNACKED = int(os.getenv("SUBSCRIBER_MAX_UNACKED", "10000"))
 
 # Shared state
-msgs = []
-records = []
-lock = threading.Lock()
 idle_seconds = 10
-
 last_msg_time = time.time()
-passed_count = 0
-failed_count = 0
-previous_data = {}
-
-trip_buffer = []
-breadcrumb_buffer = []
-
-# Load File
-with open("2025-05-05.json", "r") as f:
-    reference_data = pd.DataFrame(json.load(f))
-
-# Assertions Validations
-def assert_vehicle_id(data): assert data.get("VEHICLE_ID") is not None
-def assert_opd_date(data): assert data.get("OPD_DATE") is not None
-def assert_gps_coordinates(data): assert "GPS_LATITUDE" in data and "GPS_LONGITUDE" in data
-def assert_hdop_range(data):
-    hdop = data.get("GPS_HDOP")
-    if hdop is not None:
-        assert 0 < hdop <= 10
-def assert_sats_range(data):
-    sats = data.get("GPS_SATELLITES")
-    if sats is not None:
-        assert 0 <= sats <= 20
-def assert_act_time(data):
-    act_time = data.get("ACT_TIME")
-    if act_time is not None:
-        assert act_time <= 86400
-def assert_intra_hdop(data):
-    if data.get("ACT_TIME") == 0 and data.get("GPS_HDOP", 0) > 5:
-        raise AssertionError
-def assert_intra_sats(data):
-    if data.get("GPS_SATELLITES") == 0 and data.get("GPS_HDOP", 0) < 10:
-        raise AssertionError
-
-def validate_message(data):
-    global passed_count, failed_count
-    try:
-        assert_vehicle_id(data)
-        assert_opd_date(data)
-        assert_gps_coordinates(data)
-        assert_hdop_range(data)
-        assert_sats_range(data)
-        assert_act_time(data)
-        assert_intra_hdop(data)
-        assert_intra_sats(data)
-        passed_count += 1
-        if passed_count % 100000 == 0:
-            print(f"Processed {passed_count} valid records...")
-    except AssertionError:
-        failed_count += 1
+
+# Shards append their transformed records to one file
+JSONL_FILE = "transformed_output.jsonl"
+JSONL_BATCH = 500
+jsonl_lock = threading.Lock()
+
+BREADCRUMB_ROW_BYTES = row_bytes(BREADCRUMB_COLUMNS)
+
+# Shard: a slice of the trips with its own buffers and connection
+# The DB connection belongs to the shard's writer thread
+class BreadcrumbShard:
+    def __init__(self, trip_cache, partitions, name="shard"):
+        self.conn = connect()
+        self.cur = self.conn.cursor()
+        self.speeds = TripStateStore()
+        self.validator = RuleEngine(ASSERT_BREADCRUMB_RULES)
+        self.origins = RecordOrigins()
+
+        self.jsonl_buffer = []
+        self.trip_writer = TripWriter(trip_cache)
+        self.breadcrumb_copy = PartitionedCopyWriter(partitions, BREADCRUMB_COLUMNS)
+        self.writer = FlushScheduler(self.flush_buffers, name=f"{name}-writer")
+
+    # Acked once all of the message's rows are committed, nacked if that fails
+    def handle(self, msg, batch):
+        group = AckGroup(partial(settle, msg))
+        for data in batch:
+            self.process_record(data, group)
+        group.seal()
+
+    def process_record(self, data, group):
+        self.store_records(tracked_speeds(self.speeds, self.origins, data, group))
+
+    def store_records(self, pairs):
+        for record, origin in pairs:
+            self.validate_message(record)
+            self.store_to_db(record, origin)
+            self.save_to_jsonl(record)
+
+    # Evicts quiet trips; a held first point is stored with no speed
+    def idle(self):
+        self.store_records(released(self.speeds.evict(), self.origins))
+
+    # Assertions Validations
+    # Rules live in validation_rules.py, compiled once into a single-record check;
+    # VEHICLE_ID and OPD_DATE only have to be non-None, as the asserts checked
+    def validate_message(self, data):
+        if self.validator.validate(data):
+            if self.validator.passed % 100000 == 0:
+                print(f"Processed {self.validator.passed} valid records...")
+            return True
         if DEBUG:
             print("Validation failed:", data)
+        return False
 
-# Cal Speed
-def calculate_speed(current, previous):
-    try:
-        delta_distance = current["METERS"] - previous["METERS"]
-        delta_time = current["ACT_TIME"] - previous["ACT_TIME"]
-        if delta_time > 0:
-            return delta_distance / delta_time
-    except Exception as e:
-        if DEBUG:
-            print("Speed calc error:", e)
-    return 0.0
-
-# Clean Buffers
-def flush_buffers():
-    global conn, cur
-    try:
-        if conn.closed:
-            if DEBUG:
-                print("Reconnecting to database...")
-            conn = psycopg2.connect(
-                dbname=os.getenv("DB_NAME", "trimet"),
-                user=os.getenv("DB_USER", "postgres"),
-                password=os.getenv("DB_PASSWORD", "123456"),
-                host=os.getenv("DB_HOST", "localhost")
+    # Clean Buffers
+    # Runs on the writer thread with a batch of (trip row, breadcrumb row, ack group) items
+    def flush_buffers(self, items):
+        try:
+            if self.conn.closed:
+                if DEBUG:
+                    print("Reconnecting to database...")
+                self.conn = connect()
+                self.cur = self.conn.cursor()
+
+            # Rows with a missing field are still left out; SPEED may be
+            # NULL for a trip with a single breadcrumb. Each day partition
+            # gets its own COPY; new partitions are committed first.
+            self.breadcrumb_copy.add_rows(row for _, row, _ in items if None not in row[:3] and row[4] is not None)
+            self.breadcrumb_copy.prepare(self.conn)
+
+            # Only trips the cache has not seen are written
+            self.trip_writer.write(self.cur, [trip for trip, _, _ in items if trip])
+            self.breadcrumb_copy.copy_to(self.cur)
+
+            self.conn.commit()
+            self.trip_writer.committed()
+            for _, _, group in items:
+                if group is not None:
+                    group.done()
+
+        except Exception as e:
+            self.conn.rollback()
+            self.trip_writer.rolled_back()
+            self.breadcrumb_copy.reset()
+            for _, _, group in items:
+                if group is not None:
+                    group.fail()
+            print("Flush buffer failed:", e)
+            raise
+
+    # Store to PostGres DB
+    def store_to_db(self, data, group=None):
+        try:
+            # Epoch seconds; OPD_DATE is parsed once per date and cached
+            tstamp = timestamp_epoch(data.get("OPD_DATE"), data.get("ACT_TIME"))
+
+            trip_id = data.get("EVENT_NO_TRIP")
+            vehicle_id = data.get("VEHICLE_ID")
+            trip_row = (trip_id, vehicle_id) if trip_id and vehicle_id else None
+            breadcrumb_row = (
+                tstamp,
+                data.get("GPS_LATITUDE"),
+                data.get("GPS_LONGITUDE"),
+                data.get("SPEED"),
+                trip_id
             )
-            cur = conn.cursor()
-
-        cur.execute("SELECT trip_id FROM trip;")
-        existing_trip_ids = set(row[0] for row in cur.fetchall())
-
-        seen_trip_ids = set()
-        deduped_trip_buffer = []
-        for row in trip_buffer:
-            trip_id = row[0]
-            if trip_id not in existing_trip_ids and trip_id not in seen_trip_ids:
-                deduped_trip_buffer.append(row)
-                seen_trip_ids.add(trip_id)
-
-        if deduped_trip_buffer:
-            trip_csv = io.StringIO()
-            for row in deduped_trip_buffer:
-                safe_row = [str(row[0]) if row[0] is not None else '',
-                            str(row[1]) if row[1] is not None else '']
-                trip_csv.write(','.join(safe_row) + '\n')
-            trip_csv.seek(0)
-            cur.copy_from(trip_csv, 'trip', sep=',', columns=('trip_id', 'vehicle_id'))
-
-        if breadcrumb_buffer:
-            breadcrumb_csv = io.StringIO()
-            for row in breadcrumb_buffer:
-                if None in row:
-                    # if DEBUG: print("Skipping invalid breadcrumb row:", row)
-                    continue
-                safe_row = [
-                    str(row[0]) if row[0] is not None else '',
-                    str(row[1]) if row[1] is not None else '',
-                    str(row[2]) if row[2] is not None else '',
-                    str(row[3]) if row[3] is not None else '',
-                    str(row[4]) if row[4] is not None else ''
-                ]
-                breadcrumb_csv.write(','.join(safe_row) + '\n')
-            breadcrumb_csv.seek(0)
-            cur.copy_from(breadcrumb_csv, 'breadcrumb', sep=',', columns=('tstamp', 'latitude', 'longitude', 'speed', 'trip_id'))
-
-        conn.commit()
-        trip_buffer.clear()
-        breadcrumb_buffer.clear()
-
-    except Exception as e:
-        conn.rollback()
-        print("Flush buffer failed:", e)
-
-# Store to PostGres DB
-def store_to_db(data):
-    try:
-        opd_date_raw = data.get("OPD_DATE")
-        act_time = data.get("ACT_TIME")
-        tstamp_str = None
-        if opd_date_raw and act_time is not None:
-            opd_date = datetime.strptime(opd_date_raw.split(":")[0], "%d%b%Y")
-            tstamp = opd_date + timedelta(seconds=int(act_time))
-            tstamp_str = tstamp.strftime("%Y-%m-%d %H:%M:%S")
-
-        trip_id = data.get("EVENT_NO_TRIP")
-        vehicle_id = data.get("VEHICLE_ID")
-        if trip_id and vehicle_id:
-            trip_buffer.append((trip_id, vehicle_id))
-
-        breadcrumb_buffer.append((
-            tstamp_str,
-            data.get("GPS_LATITUDE"),
-            data.get("GPS_LONGITUDE"),
-            data.get("SPEED"),
-            trip_id
-        ))
-
-        if len(breadcrumb_buffer) >= 500:
-            flush_buffers()
-    except Exception as e:
-        if DEBUG:
-            print("DB buffer append failed:", e)
-
-# WRITE TO .jsonl
-def save_to_jsonl(data):
-    try:
-        with open("transformed_output.jsonl", "a") as f:
-            f.write(json.dumps(data) + "\n")
-    except Exception as e:
-        if DEBUG:
-            print("Write to jsonl failed:", e)
 
-def callback(msg):
-    global last_msg_time
-    with lock:
+            # Flushed on row count, bytes or age, on the writer thread
+            self.writer.add((trip_row, breadcrumb_row, group), BREADCRUMB_ROW_BYTES)
+        except Exception as e:
+            if DEBUG:
+                print("DB buffer append failed:", e)
+            # The row is dropped, so it no longer holds back the ack
+            if group is not None:
+                group.done()
+
+    # WRITE TO .jsonl
+    # Lines are buffered per shard and appended JSONL_BATCH at a time
+    def save_to_jsonl(self, data):
+        self.jsonl_buffer.append(json.dumps(data) + "\n")
+        if len(self.jsonl_buffer) >= JSONL_BATCH:
+            self.write_jsonl()
+
+    def write_jsonl(self):
+        if not self.jsonl_buffer:
+            return
+        try:
+            with jsonl_lock:
+                with open(JSONL_FILE, "a") as f:
+                    f.writelines(self.jsonl_buffer)
+        except Exception as e:
+            if DEBUG:
+                print("Write to jsonl failed:", e)
+        self.jsonl_buffer.clear()
+
+    def close(self):
+        self.store_records(released(self.speeds.drain(), self.origins))
+        self.writer.close()
+        self.write_jsonl()
+        self.cur.close()
+        self.conn.close()
+
+def make_callback(dispatcher):
+    def callback(msg):
+        global last_msg_time
         try:
-            data = json.loads(msg.data.decode("utf-8"))
+            batch = decode_message(msg)
         except Exception as e:
             if DEBUG:
                 print("Invalid JSON:", e)
             msg.ack()
             return
 
-        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
-
-        if key in previous_data:
-            prev = previous_data[key]
-            speed = calculate_speed(data, prev)
-
-            if speed > 45:
-                # if DEBUG: print(f"Skipping speed: {speed:.2f}")
-                msg.ack()
-                return
-
-            prev["SPEED"] = speed
-            data["SPEED"] = speed
-
-            validate_message(prev)
-            validate_message(data)
-
-            store_to_db(prev)
-            store_to_db(data)
-
-            save_to_jsonl(prev)
-            save_to_jsonl(data)
-
-            records.append(prev)
-            records.append(data)
-
-        else:
-            previous_data[key] = data
-            msg.ack()
-            last_msg_time = time.time()
-            return
-
-        previous_data[key] = data
-        msg.ack()
+        dispatcher.submit(msg, batch)
         last_msg_time = time.time()
+    return callback
+
+# subscriber is a pubsub_v1.SubscriberClient unless one is passed in
+def main(replay_files=None, subscriber=None):
+    # Known trip_ids are read once here instead of on every flush
+    trip_cache = TripIdCache()
+    # Rows are COPYed straight into breadcrumb's day partitions
+    partitions = BreadcrumbPartitions()
+    conn = connect()
+    trip_cache.warm(conn)
+    partitions.load(conn)
+    conn.close()
+
+    shards = [BreadcrumbShard(trip_cache, partitions, f"shard-{i}") for i in range(SUBSCRIBER_SHARDS)]
+    dispatcher = ShardedDispatcher(shards)
+
+    start = time.time()
+    replay = None
+    if replay_files:
+        # Day files go straight to the shards: no Pub/Sub, no JSON decoding
+        replay = Replay(replay_files)
+        replay.run(lambda msg: dispatcher.submit(msg, msg.records))
+    else:
+        # Subscriber
+        if subscriber is None:
+            subscriber = pubsub_v1.SubscriberClient()
+        sub_path = subscriber.subscription_path(project_id, sub_id)
+        flow_control = pubsub_v1.types.FlowControl(max_messages=MAX_UNACKED)
+        pull = subscriber.subscribe(sub_path, callback=make_callback(dispatcher), flow_control=flow_control)
+
+        print("Listening for Messages at", sub_path, "...")
 
-# Subscriber
-subscriber = pubsub_v1.SubscriberClient()
-sub_path = subscriber.subscription_path(project_id, sub_id)
-pull = subscriber.subscribe(sub_path, callback=callback)
-
-start = time.time()
-print("Listening for Messages at", sub_path, "...")
-
-try:
-    while True:
-        time.sleep(1)
-        if time.time() - last_msg_time > idle_seconds:
+        try:
+            while True:
+                time.sleep(1)
+                if time.time() - last_msg_time > idle_seconds:
+                    pull.cancel()
+                    break
+        except KeyboardInterrupt:
             pull.cancel()
-            break
-except KeyboardInterrupt:
-    pull.cancel()
-
-try:
-    pull.result()
-except Exception as e:
-    print("Subscriber shutdown exception (ignored):", e)
-flush_buffers()
-cur.close()
-conn.close()
-
-# Output
-end = time.time()
-print("\n--- Validation Summary ---")
-print("Passed:", passed_count)
-print("Failed:", failed_count)
-print("Total:", passed_count + failed_count)
-print("Total runtime:", round(end - start, 2), "seconds")
 
+        try:
+            pull.result()
+        except Exception as e:
+            print("Subscriber shutdown exception (ignored):", e)
+
+    dispatcher.close()
+
+    validator = RuleEngine(ASSERT_BREADCRUMB_RULES)
+    flushes = FlushStats()
+    for shard in shards:
+        validator.merge(shard.validator)
+        flushes.merge(shard.writer.stats)
+
+    # Output
+    end = time.time()
+    print("\n--- Validation Summary ---")
+    print("Passed:", validator.passed)
+    print("Failed:", validator.failed)
+    print("Total:", validator.passed + validator.failed)
+    validator.report()
+    print("Messages per shard:", dispatcher.processed)
+    print("Failed messages per shard:", dispatcher.failed)
+    if replay is not None:
+        replay.report()
+    print("Flushes:", flushes)
+    print("Total runtime:", round(end - start, 2), "seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", nargs="+", metavar="DAY_FILE",
+                        help="ingest archived day files (.json or .parquet) instead of Pub/Sub")
+    main(parser.parse_args().replay)
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from functools import partial
+
+# ---------- CONFIG ----------
+PUBLISH_MAX_MESSAGES = int(os.getenv("PUBLISH_MAX_MESSAGES", "5000"))
+PUBLISH_MAX_BYTES = int(os.getenv("PUBLISH_MAX_BYTES", str(20 * 1024 * 1024)))
+
+
+class FlowControlledPublisher:
+    """Wraps a Pub/Sub PublisherClient with a cap on outstanding messages.
+
+    publish() blocks while max_messages or max_bytes are already in flight.
+    Futures are not kept: each one releases its capacity and updates the
+    counters from its done callback, so memory stays flat however many
+    messages go through. Any object with publish(topic, data, **attrs)
+    returning a future works as the client.
+    """
+
+    def __init__(self, client, topic_path, max_messages=PUBLISH_MAX_MESSAGES,
+                 max_bytes=PUBLISH_MAX_BYTES, progress_every=50000):
+        self.client = client
+        self.topic_path = topic_path
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.progress_every = progress_every
+
+        self.outstanding = 0
+        self.outstanding_bytes = 0
+        self.published = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self._cond = threading.Condition()
+
+    def publish(self, data, **attrs):
+        size = len(data)
+        with self._cond:
+            if self.started is None:
+                self.started = time.time()
+            # A single message larger than max_bytes is still let through
+            # once nothing else is outstanding
+            while self.outstanding and (self.outstanding >= self.max_messages or
+                                        self.outstanding_bytes + size > self.max_bytes):
+                self._cond.wait()
+            self.outstanding += 1
+            self.outstanding_bytes += size
+
+        try:
+            future = self.client.publish(self.topic_path, data, **attrs)
+        except Exception as e:
+            self._release(size, e)
+            return None
+        future.add_done_callback(partial(self._on_done, size))
+        return future
+
+    def _on_done(self, size, future):
+        try:
+            future.result()
+            self._release(size, None)
+        except Exception as e:
+            self._release(size, e)
+
+    def _release(self, size, error):
+        if error is not None:
+            print(f"Unable to publish message: {error}")
+        with self._cond:
+            self.outstanding -= 1
+            self.outstanding_bytes -= size
+            if error is None:
+                self.published += 1
+                if self.progress_every and self.published % self.progress_every == 0:
+                    print(f"Published {self.published} messages...")
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            while self.outstanding:
+                self._cond.wait()
+            self.finished = time.time()
+
+    @property
+    def messages_per_second(self):
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.time()) - self.started
+        return self.published / elapsed if elapsed else 0.0
+
+    def report(self):
+        print(f"Published {self.published} messages to {self.topic_path} "
+              f"({self.failed} failed, {self.messages_per_second:.0f} msg/s)")
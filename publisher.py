@@ -1,12 +1,14 @@
-from urllib import request
 import csv
-import json
 import os
 import time
 from datetime import datetime
-from concurrent import futures
 from google.oauth2 import service_account
 from google.cloud import pubsub_v1
+from fetch_engine import Fetcher
+from stream_pipeline import StreamingPipeline
+from day_archive import open_day_writer
+from publish_flow import FlowControlledPublisher
+from envelope import encode_messages
 
 # ---------- CONFIG ----------
 CSV_FILE = "Glitch Vehicle IDs - VehicleGroupsIDs.csv"
@@ -15,14 +17,19 @@ PROJECT_ID = "dataengr-dataguru"
 TOPIC_ID = "project-topic"
 BASE_URL = "https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id="
 
-# Output file for today's records
+# Output file for today's records (.json, or .parquet with ARCHIVE_FORMAT=parquet)
 DATE_STR = datetime.now().strftime("%Y-%m-%d")
-COMBINED_FILE = f"{DATE_STR}.json"
+FETCH_REPORT = f"{DATE_STR}_fetch_times.csv"
+
+# Max fetched batches (one per vehicle) waiting on each stage
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
 
 # ---------- SETUP ----------
 credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
 publisher = pubsub_v1.PublisherClient(credentials=credentials)
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+flow = FlowControlledPublisher(publisher, topic_path)
+fetcher = Fetcher(BASE_URL)
 
 # ---------- FUNCTIONS ----------
 def get_vehicle_ids(csv_file):
@@ -36,62 +43,50 @@ def get_vehicle_ids(csv_file):
                     vehicle_ids.add(item)
     return list(vehicle_ids)
 
+def log_result(result):
+    if result.error is not None:
+        print(f"[{result.vehicle_id}] Error fetching data: {result.error}")
+        return []
+    print(f"[{result.vehicle_id}] Fetched {len(result.data)} records.")
+    return result.data
+
 def fetch_data(vehicle_id):
-    url = f"{BASE_URL}{vehicle_id}"
-    try:
-        with request.urlopen(url) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            print(f"[{vehicle_id}] Fetched {len(data)} records.")
-            return data
-    except Exception as e:
-        print(f"[{vehicle_id}] Error fetching data: {e}")
-    return []
+    return log_result(fetcher.fetch_one(vehicle_id))
+
+def fetched_batches(vehicle_ids):
+    for result in fetcher.fetch_all(vehicle_ids):
+        records = log_result(result)
+        if records:
+            yield records
 
-def callback(future):
-    try:
-        future.result()
-    except Exception as e:
-        print(f"Unable to publish message: {e}")
+def publish_records(records):
+    for data, attrs in encode_messages(records):
+        flow.publish(data, **attrs)
 
 # ---------- MAIN ----------
 def main():
     vehicle_ids = get_vehicle_ids(CSV_FILE)
     print(f"Found {len(vehicle_ids)} vehicle IDs.")
 
-    all_records = []
-    start_gather = time.time()
-
-    for vid in vehicle_ids:
-        records = fetch_data(vid)
-        all_records.extend(records)
-
-    # Save all gathered records to a single file
-    with open(COMBINED_FILE, "w") as f:
-        json.dump(all_records, f, indent=2)
-    print(f"Saved {len(all_records)} records to {COMBINED_FILE}")
-    print(f"Data gathering took {round(time.time() - start_gather, 2)} seconds")
-
-    # Publish records to Pub/Sub
-    future_list = []
-    start_publish = time.time()
-
-    for i, record in enumerate(all_records):
-        data_str = json.dumps(record)
-        data = data_str.encode("utf-8")
-
-        future = publisher.publish(topic_path, data)
-        future.add_done_callback(callback)
-        future_list.append(future)
-
-        if (i + 1) % 50000 == 0:
-            print(f"Published {i + 1} messages...")
-
-    for future in futures.as_completed(future_list):
-        continue
-
-    print(f"Published {len(all_records)} messages to {topic_path}")
-    print(f"Publishing took {round(time.time() - start_publish, 2)} seconds")
+    start = time.time()
+
+    # Fetch -> (publish, archive) run concurrently; bounded queues between
+    # the stages keep memory flat for the whole day
+    with open_day_writer(DATE_STR) as archive:
+        pipeline = StreamingPipeline(
+            fetched_batches(vehicle_ids),
+            {"publish": publish_records, "archive": archive.write},
+            queue_size=PIPELINE_QUEUE_SIZE,
+        )
+        pipeline.run()
+    flow.wait()
+
+    print(f"Saved {archive.count} records to {archive.path}")
+    flow.report()
+    print(f"Fetch and publish took {round(time.time() - start, 2)} seconds")
+    pipeline.report()
+    fetcher.report()
+    fetcher.write_csv(FETCH_REPORT)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from collections import deque
+
+from day_archive import iter_records
+from envelope import encode_messages
+from trip_shards import trip_key
+
+# ---------- CONFIG ----------
+# Records per replayed message; a message only holds records of one trip
+REPLAY_BATCH = int(os.getenv("REPLAY_BATCH", "100"))
+# Messages handed to the pipeline and not acked yet before replay waits,
+# like the subscribers' Pub/Sub FlowControl
+REPLAY_MAX_UNACKED = int(os.getenv("REPLAY_MAX_UNACKED", os.getenv("SUBSCRIBER_MAX_UNACKED", "10000")))
+# Deliveries of a nacked message before it counts as failed
+REPLAY_MAX_ATTEMPTS = int(os.getenv("REPLAY_MAX_ATTEMPTS", "5"))
+
+
+class ReplayMessage:
+    """Stands in for a received Pub/Sub message.
+
+    records holds the decoded records, for callbacks that skip decoding;
+    with encode=True, data and attributes are what the publisher would
+    have sent. ack() and nack() report back to the Replay.
+    """
+
+    __slots__ = ("replay", "records", "data", "attributes", "attempt", "settled")
+
+    def __init__(self, replay, records, data=None, attributes=None, attempt=1):
+        self.replay = replay
+        self.records = records
+        self.data = data
+        self.attributes = attributes or {}
+        self.attempt = attempt
+        self.settled = False
+
+    def ack(self):
+        self.replay._settle(self, True)
+
+    def nack(self):
+        self.replay._settle(self, False)
+
+
+class Replay:
+    """Feeds archived day files to a subscriber callback, no Pub/Sub.
+
+    run(callback) calls callback(msg) for every message as fast as the
+    pipeline takes them, waiting only while max_unacked messages are
+    outstanding. Nacked messages are delivered again, up to max_attempts
+    times. Messages are acked as the pipeline commits them, so once
+    run() returns the caller still closes the pipeline, then calls
+    report().
+    """
+
+    def __init__(self, paths, batch=REPLAY_BATCH, encode=False,
+                 max_unacked=REPLAY_MAX_UNACKED, max_attempts=REPLAY_MAX_ATTEMPTS):
+        self.paths = list(paths)
+        self.batch = batch
+        self.encode = encode
+        self.max_unacked = max_unacked
+        self.max_attempts = max_attempts
+
+        self._cond = threading.Condition()
+        self._retry = deque()
+        self.outstanding = 0
+        self.records = 0
+        self.messages = 0
+        self.delivered = 0
+        self.acked = 0
+        self.nacked = 0
+        self.failed = 0
+        self.started = None
+        self.fed_seconds = 0.0
+
+    def _counted(self, records):
+        for record in records:
+            self.records += 1
+            yield record
+
+    def _trip_batches(self, records):
+        # Consecutive records of one trip, up to batch per message; day
+        # files are written vehicle by vehicle, so trips come in runs
+        batch, key = [], None
+        for record in records:
+            k = trip_key(record)
+            if batch and (k != key or len(batch) >= self.batch):
+                yield batch
+                batch = []
+            batch.append(record)
+            key = k
+        if batch:
+            yield batch
+
+    def iter_messages(self):
+        for path in self.paths:
+            records = self._counted(iter_records(path))
+            if self.encode:
+                for data, attrs in encode_messages(records, self.batch):
+                    yield ReplayMessage(self, None, data, attrs)
+            else:
+                for batch in self._trip_batches(records):
+                    yield ReplayMessage(self, batch)
+
+    def run(self, callback):
+        self.started = time.time()
+        for msg in self.iter_messages():
+            self.messages += 1
+            self._deliver(callback, msg)
+            self._redeliver(callback)
+        self._redeliver(callback)
+        self.fed_seconds = time.time() - self.started
+
+    def _deliver(self, callback, msg):
+        with self._cond:
+            while self.outstanding >= self.max_unacked:
+                self._cond.wait()
+            self.outstanding += 1
+            self.delivered += 1
+        callback(msg)
+
+    def _redeliver(self, callback):
+        while self._retry:
+            old = self._retry.popleft()
+            # Fresh dicts, as a redelivered message is decoded again
+            records = None if old.records is None else [dict(r) for r in old.records]
+            self._deliver(callback, ReplayMessage(self, records, old.data, old.attributes, old.attempt + 1))
+
+    def _settle(self, msg, ok):
+        with self._cond:
+            # A message split across shards may be nacked by several parts
+            if msg.settled:
+                return
+            msg.settled = True
+            self.outstanding -= 1
+            if ok:
+                self.acked += 1
+            else:
+                self.nacked += 1
+                if msg.attempt < self.max_attempts:
+                    self._retry.append(msg)
+                else:
+                    self.failed += 1
+            self._cond.notify_all()
+
+    def report(self):
+        """Call once the pipeline is closed; the rate is up to the last commit."""
+        seconds = time.time() - self.started if self.started else 0
+        rate = self.records / seconds if seconds else 0
+        print(f"Replayed {self.records} records in {self.messages} messages from {len(self.paths)} files "
+              f"in {seconds:.2f}s ({rate:.0f} records/s, fed in {self.fed_seconds:.2f}s)")
+        # Nacks that arrive after run() returned are not retried
+        print(f"Messages delivered: {self.delivered}, acked: {self.acked}, nacked: {self.nacked}, "
+              f"failed: {self.failed + len(self._retry)}, unacked: {self.outstanding}")
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# Breadcrumbs implying more than this many m/s are dropped
+MAX_SPEED = 45
+TRIP_KEY = ["VEHICLE_ID", "EVENT_NO_TRIP"]
+
+
+# ---------- PER-MESSAGE PATH ----------
+def calculate_speed(current, previous):
+    try:
+        delta_distance = current["METERS"] - previous["METERS"]
+        delta_time = current["ACT_TIME"] - previous["ACT_TIME"]
+        if delta_time > 0:
+            return delta_distance / delta_time
+    except Exception:
+        pass
+    return 0.0
+
+
+class TripSpeedTracker:
+    """The speed step of the subscriber callbacks, one record at a time.
+
+    update() returns the records to store: nothing for the first point of
+    a trip or for a point over max_speed, otherwise [previous, current]
+    with both given the speed between them. A rejected point is skipped
+    and the next one is measured against the last accepted point.
+    """
+
+    def __init__(self, max_speed=MAX_SPEED):
+        self.max_speed = max_speed
+        self.previous = {}
+        self.skipped = 0
+
+    def update(self, data):
+        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
+        prev = self.previous.get(key)
+        if prev is None:
+            self.previous[key] = data
+            return []
+
+        speed = calculate_speed(data, prev)
+        if speed > self.max_speed:
+            self.skipped += 1
+            return []
+
+        prev["SPEED"] = speed
+        data["SPEED"] = speed
+        self.previous[key] = data
+        return [prev, data]
+
+
+# ---------- BATCH PATH ----------
+def _speeds(meters, act_time, same_trip):
+    delta_distance = np.diff(meters, prepend=np.nan)
+    delta_time = np.diff(act_time, prepend=np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(same_trip & (delta_time > 0), delta_distance / delta_time, 0.0)
+    # Missing METERS/ACT_TIME gives 0.0, like the except branch above
+    return np.nan_to_num(speed, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def compute_trip_speeds(frame, max_speed=MAX_SPEED):
+    """Vectorized trip_state.TripStateStore over a whole block of breadcrumbs.
+
+    frame is a DataFrame (or anything with to_pandas(), such as a pyarrow
+    batch from day_archive.iter_batches). Rows are sorted by trip and
+    ACT_TIME and a SPEED column is added. Each accepted breadcrumb appears
+    once; the first point of a trip gets the second point's speed, and a
+    trip with a single accepted point keeps it with SPEED NaN, as the
+    store writes it when the trip is evicted.
+    """
+    if hasattr(frame, "to_pandas"):
+        frame = frame.to_pandas()
+    frame = frame.sort_values(TRIP_KEY + ["ACT_TIME"], kind="stable").reset_index(drop=True)
+    if frame.empty:
+        return frame.assign(SPEED=pd.Series(dtype="float64"))
+
+    trip = frame.groupby(TRIP_KEY, sort=False, dropna=False).ngroup().to_numpy()
+    meters = frame["METERS"].to_numpy(dtype="float64", na_value=np.nan)
+    act_time = frame["ACT_TIME"].to_numpy(dtype="float64", na_value=np.nan)
+    keep = np.ones(len(frame), dtype=bool)
+
+    # Dropping a point changes the delta of the point after it, so only the
+    # first offending point of each trip is removed per pass, and later
+    # passes only revisit the trips that still had offending points.
+    dirty = keep.copy()
+    while True:
+        rows = np.flatnonzero(keep & dirty)
+        t = trip[rows]
+        same_trip = np.concatenate(([False], t[1:] == t[:-1]))
+        speed = _speeds(meters[rows], act_time[rows], same_trip)
+
+        bad = np.flatnonzero(same_trip & (speed > max_speed))
+        if not bad.size:
+            break
+        first_bad = bad[np.concatenate(([True], t[bad][1:] != t[bad][:-1]))]
+        keep[rows[first_bad]] = False
+        dirty = np.isin(trip, t[first_bad])
+
+    rows = np.flatnonzero(keep)
+    t = trip[rows]
+    same_trip = np.concatenate(([False], t[1:] == t[:-1]))
+    speed = _speeds(meters[rows], act_time[rows], same_trip)
+
+    has_next = np.concatenate((same_trip[1:], [False]))
+    backfill = np.flatnonzero(~same_trip & has_next)
+    speed[backfill] = speed[backfill + 1]
+
+    speed[~same_trip & ~has_next] = np.nan
+    result = frame.iloc[rows].copy()
+    result["SPEED"] = speed
+    return result.reset_index(drop=True)
@@ -1,12 +1,10 @@
 import csv
-import json
 import os
-import time
-from urllib import request, error
-from bs4 import BeautifulSoup
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1 import types
 
+from stop_events import STOP_ENCODING, encode_stop_events, stop_fetcher
+
 PROJECT_ID = "dataengr-dataguru"
 TOPIC_ID = "stop-event-topic"
 CSV_FILE = "Glitch Vehicle IDs - VehicleGroupsIDs.csv"
@@ -14,43 +12,29 @@ BASE_URL = "https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num="
 
 
 # --- SCRAPER ---
+# Pages are fetched on a thread pool at most STOP_FETCH_RATE requests per
+# second and read in one pass into StopEvents (stop_events.py)
 class StopEventScraper:
     def __init__(self, base_url):
         self.base_url = base_url
+        self.fetcher = stop_fetcher(base_url)
 
     def fetch_vehicle_data(self, vehicle_num):
-        url = f"{self.base_url}{vehicle_num}"
-        try:
-            with request.urlopen(url) as response:
-                html = response.read().decode("utf-8")
-                soup = BeautifulSoup(html, "html.parser")
-
-                date_str = self._extract_date(soup)
-                records = self._parse_tables(soup, date_str, vehicle_num)
-                return records
-        except Exception as e:
-            print(f"[{vehicle_num}] Error fetching/parsing HTML: {e}")
-            return []
+        return self._records(self.fetcher.fetch_one(vehicle_num))
 
-    def _extract_date(self, soup):
-        header = soup.find("h1")
-        if header and "for" in header.text:
-            parts = header.text.strip().split("for")
-            return parts[1].strip() if len(parts) > 1 else "unknown_date"
-        return "unknown_date"
-
-    def _parse_tables(self, soup, date_str, vehicle_num):
-        all_records = []
-        for table in soup.find_all("table"):
-            headers = [th.text.strip() for th in table.find_all("th")]
-            for tr in table.find_all("tr")[1:]:
-                cells = [td.text.strip() for td in tr.find_all("td")]
-                if len(cells) == len(headers):
-                    record = dict(zip(headers, cells))
-                    record["scraped_date"] = date_str
-                    record["vehicle_number"] = vehicle_num
-                    all_records.append(record)
-        return all_records
+    def fetch_all(self, vehicle_nums):
+        """Yields (vehicle_num, scraped_date, events) as pages arrive."""
+        for result in self.fetcher.fetch_all(vehicle_nums):
+            page = result.data
+            yield result.vehicle_id, page.scraped_date() if page else None, self._records(result)
+
+    def _records(self, result):
+        if result.error is not None:
+            print(f"[{result.vehicle_id}] Error fetching/parsing HTML: {result.error}")
+            return []
+        # Every event is for the vehicle asked for
+        vid = int(result.vehicle_id)
+        return [e if e.vehicle_number == vid else e._replace(vehicle_number=vid) for e in result.data.rows]
 
 
 # --- PUBLISHER ---
@@ -64,13 +48,13 @@ class StopEventPublisher:
         self.publisher = pubsub_v1.PublisherClient(batch_settings=batch_settings)
         self.topic_path = self.publisher.topic_path(project_id, topic_id)
 
-    def publish_records(self, records):
-        count = 0
+    # events go out STOP_MESSAGE_ROWS to a message, typed (stop_events.py)
+    def publish_records(self, records, scraped_date="unknown_date"):
         futures = []
 
-        for record in records:
-            data_str = json.dumps(record)
-            future = self.publisher.publish(self.topic_path, data=data_str.encode("utf-8"))
+        for data in encode_stop_events(records):
+            future = self.publisher.publish(self.topic_path, data=data, encoding=STOP_ENCODING,
+                                            scraped_date=scraped_date)
             futures.append(future)
 
         for i, future in enumerate(futures, 1):
@@ -81,7 +65,7 @@ class StopEventPublisher:
             if i % 50000 == 0:
                 print(f"Published {i} messages...")
 
-        print(f"Finished publishing {len(records)} messages.")
+        print(f"Finished publishing {len(records)} records in {len(futures)} messages.")
 
 
 # --- OPERATING PUBLISHER ---
@@ -95,12 +79,12 @@ class StopEventPipeline:
         vehicle_ids = self._load_vehicle_ids()
         print(f"Found {len(vehicle_ids)} vehicle IDs.")
 
-        for vid in vehicle_ids:
-            print(f"Fetching stop events for vehicle {vid}...")
-            records = self.scraper.fetch_vehicle_data(vid)
+        print(f"Fetching stop events for {len(vehicle_ids)} vehicles...")
+        for vid, scraped_date, records in self.scraper.fetch_all(vehicle_ids):
             if records:
                 print(f"Publishing {len(records)} records for vehicle {vid}...")
-                self.publisher.publish_records(records)
+                self.publisher.publish_records(records, scraped_date)
+        self.scraper.fetcher.report()
 
     def _load_vehicle_ids(self):
         vehicle_ids = set()
@@ -1,81 +1,100 @@
 from datetime import datetime
+from functools import partial
 from google.cloud import pubsub_v1
-import json
+import os
 import time
 import threading
 import pandas as pd
-import io
 import psycopg2
 
+from ack_tracking import AckGroup, settle
+from copy_writer import BinaryCopyWriter, row_bytes
+from flush_scheduler import FlushScheduler
+from stop_events import STOP_DATA_COLUMNS, STOP_EVENT_FIELDS, decode_stop_events
+from trip_enrichment import TRIP_ENRICHMENT, TripEnrichment
+
 # ========== Configurations ==========
 PROJECT_ID = "dataengr-dataguru"
 SUBSCRIPTION_ID = "stop-event-sub"
 IDLE_SECONDS = 30
 TABLE_NAME = "stop_data"
+# Most messages leased and not yet acked (each holds up to
+# STOP_MESSAGE_ROWS events). A message is acked once its events are
+# committed, so this bounds what the subscriber holds and what a crash
+# sends back for redelivery.
+MAX_UNACKED = int(os.getenv("STOP_SUBSCRIBER_MAX_UNACKED", "100"))
+# service_key's one letter on top of the fixed-size fields
+STOP_ROW_BYTES = row_bytes(STOP_DATA_COLUMNS) + 1
 
 # ========== Database Handler ==========
 class Database:
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname="trimet",
-            user="postgres",
-            password="123456",
-            host="localhost"
+            dbname=os.getenv("DB_NAME", "trimet"),
+            user=os.getenv("DB_USER", "postgres"),
+            password=os.getenv("DB_PASSWORD", "123456"),
+            host=os.getenv("DB_HOST", "localhost")
         )
         self.cur = self.conn.cursor()
+        self.writer = BinaryCopyWriter(TABLE_NAME, STOP_DATA_COLUMNS)
+        # Trip's route_id, service_key and direction, from the same events
+        self.enrichment = TripEnrichment() if TRIP_ENRICHMENT == "on" else None
 
+    # batch holds StopEvents; their values go to COPY in binary as they
+    # are, trip_id left out. Their trips are upserted in the same
+    # transaction. Commits, or rolls back and raises.
     def copy_records(self, batch):
         if not batch:
             return
-        buf = io.StringIO()
-        for r in batch:
-            row = [str(r[k]) for k in StopEventValidator.REQUIRED_FIELDS]
-            buf.write("\t".join(row) + "\n")
-        buf.seek(0)
+        self.writer.add_rows(event[:-1] for event in batch)
         try:
-            self.cur.copy_from(buf, TABLE_NAME, sep="\t", null="")
+            self.writer.copy_to(self.cur)
+            if self.enrichment is not None:
+                self.enrichment.write(self.cur, batch)
             self.conn.commit()
+            if self.enrichment is not None:
+                self.enrichment.committed()
         except Exception as e:
             self.conn.rollback()
+            self.writer.reset()
+            if self.enrichment is not None:
+                self.enrichment.rolled_back()
             print("COPY failed:", e)
+            raise
 
     def close(self):
         self.cur.close()
         self.conn.close()
 
 # ========== Validator ==========
+# Events arrive typed (stop_events.StopEvent), with None for a missing or
+# malformed field, so the checks compare values without casting them
 class StopEventValidator:
-    REQUIRED_FIELDS = [
-        "vehicle_number", "leave_time", "train", "route_number", "direction", "service_key",
-        "trip_number", "stop_time", "arrive_time", "dwell", "location_id", "door", "lift",
-        "ons", "offs", "estimated_load", "maximum_speed", "train_mileage", "pattern_distance",
-        "location_distance", "x_coordinate", "y_coordinate", "data_source", "schedule_status"
-    ]
+    REQUIRED_FIELDS = list(STOP_EVENT_FIELDS[:-1])
 
     def __init__(self):
         self.passed = 0
         self.failed = 0
 
-    def validate(self, data):
-        for field in self.REQUIRED_FIELDS:
-            if field not in data or data[field] in ["", None]:
-                self.failed += 1
-                return False
+    def validate(self, event):
+        if None in event[:-1]:
+            self.failed += 1
+            return False
 
         try:
-            if not (0 <= int(data["leave_time"]) <= 86400):
+            if not (0 <= event.leave_time <= 86400):
                 self.failed += 1
                 return False
-            if not (0 <= int(data["arrive_time"]) <= 86400):
+            if not (0 <= event.arrive_time <= 86400):
                 self.failed += 1
                 return False
-            if not (0 < float(data["maximum_speed"]) <= 100):
+            if not (0 < event.maximum_speed <= 100):
                 self.failed += 1
                 return False
-            if float(data["x_coordinate"]) == 0 or float(data["y_coordinate"]) == 0:
+            if event.x_coordinate == 0 or event.y_coordinate == 0:
                 self.failed += 1
                 return False
-        except:
+        except TypeError:
             self.failed += 1
             return False
 
@@ -83,29 +102,60 @@ class StopEventValidator:
         return True
 
 # ========== Subscriber ==========
+# Validated events are COPYed in batches as they arrive, on the
+# FlushScheduler's writer thread (flush_scheduler.py): by rows, bytes or
+# age, each batch in its own transaction. A message is acked when the
+# last of its events is committed and nacked if their batch fails; one
+# with no valid events is acked at once.
 class StopEventSubscriber:
     def __init__(self):
-        self.records = []
+        self.stored = 0
         self.lock = threading.Lock()
         self.last_msg_time = time.time()
         self.db = Database()
         self.validator = StopEventValidator()
+        self.writer = FlushScheduler(self.flush, name="stop-writer")
 
     def callback(self, msg):
-        with self.lock:
-            try:
-                data = json.loads(msg.data.decode("utf-8"))
-                if self.validator.validate(data):
-                    self.records.append(data)
-            except Exception as e:
-                print("Error parsing message:", e)
+        try:
+            events = decode_stop_events(msg.data, msg.attributes.get("encoding"))
+        except Exception as e:
+            print("Error parsing message:", e)
             msg.ack()
+            return
+        group = AckGroup(partial(settle, msg))
+        with self.lock:
+            valid = [e for e in events if self.validator.validate(e)]
             self.last_msg_time = time.time()
-
-    def listen(self):
-        subscriber = pubsub_v1.SubscriberClient()
+        group.add(len(valid))
+        for event in valid:
+            self.writer.add((event, group), STOP_ROW_BYTES)
+        group.seal()
+
+    # Runs on the writer thread with a batch of (event, ack group) items;
+    # a message's events are mostly in one batch, so each group is told
+    # once
+    def flush(self, items):
+        counts = {}
+        for _, group in items:
+            counts[group] = counts.get(group, 0) + 1
+        try:
+            self.db.copy_records([event for event, _ in items])
+        except Exception:
+            for group in counts:
+                group.fail()
+            raise
+        self.stored += len(items)
+        for group, n in counts.items():
+            group.done(n)
+
+    # subscriber is a pubsub_v1.SubscriberClient unless one is passed in
+    def listen(self, subscriber=None):
+        if subscriber is None:
+            subscriber = pubsub_v1.SubscriberClient()
         sub_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
-        stream = subscriber.subscribe(sub_path, callback=self.callback)
+        flow_control = pubsub_v1.types.FlowControl(max_messages=MAX_UNACKED)
+        stream = subscriber.subscribe(sub_path, callback=self.callback, flow_control=flow_control)
 
         print(f"Listening to {sub_path}...")
 
@@ -122,7 +172,8 @@ class StopEventSubscriber:
 
         stream.result()
 
-        self.db.copy_records(self.records)
+        # The last batch, if any
+        self.writer.close()
         self.print_summary()
         self.db.close()
 
@@ -131,7 +182,10 @@ class StopEventSubscriber:
         print(f"Total received: {self.validator.passed + self.validator.failed}")
         print(f"Passed: {self.validator.passed}")
         print(f"Failed: {self.validator.failed}")
-        print(f"Stored: {len(self.records)}")
+        print(f"Stored: {self.stored}")
+        if self.db.enrichment is not None:
+            print(f"Trips enriched: {len(self.db.enrichment)}")
+        print(f"Flushes: {self.writer.stats}")
 
 # ========== Run ==========
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import time
+import zlib
+from collections import namedtuple
+from html import unescape
+
+from fetch_engine import Fetcher
+
+# ---------- CONFIG ----------
+STOP_EVENTS_URL = "https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num="
+# Politeness limit on requests per second to busdata, shared by every
+# worker; 5/s is the old 0.2 s sleep between requests
+STOP_FETCH_RATE = float(os.getenv("STOP_FETCH_RATE", "5"))
+STOP_FETCH_WORKERS = int(os.getenv("STOP_FETCH_WORKERS", "8"))
+# Stop events per Pub/Sub message
+STOP_MESSAGE_ROWS = int(os.getenv("STOP_MESSAGE_ROWS", "500"))
+
+TRIP_HEADING = re.compile(r"PDX_TRIP\s+(-?\d+)")
+DATE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+def _clean(text):
+    # Markup inside a cell, entities and surrounding whitespace
+    if "<" in text:
+        text = INNER_TAG.sub("", text)
+    if "&" in text:
+        text = unescape(text)
+    return text.strip()
+
+
+# int() and float() skip surrounding whitespace themselves, so a cell is
+# only cleaned when the plain conversion fails
+def _int(text):
+    try:
+        return int(text)
+    except ValueError:
+        text = _clean(text)
+    try:
+        return int(text)
+    except ValueError:
+        # "12.0" and the like; anything else is missing
+        try:
+            value = float(text)
+        except ValueError:
+            return None
+        return int(value) if value.is_integer() else None
+
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return float(_clean(text))
+    except ValueError:
+        return None
+
+
+def _str(text):
+    return _clean(text) or None
+
+
+# ---------- STOP EVENT FIELDS ----------
+# The getStopEvents table columns and their types, converted during the
+# walk; an empty or malformed cell becomes None. trip_id, from the
+# "Stop events for PDX_TRIP n" heading over the table, comes last.
+STOP_EVENT_TYPES = (
+    ("vehicle_number", _int), ("leave_time", _int), ("train", _int), ("route_number", _int),
+    ("direction", _int), ("service_key", _str), ("trip_number", _int), ("stop_time", _int),
+    ("arrive_time", _int), ("dwell", _int), ("location_id", _int), ("door", _int), ("lift", _int),
+    ("ons", _int), ("offs", _int), ("estimated_load", _int), ("maximum_speed", _float),
+    ("train_mileage", _float), ("pattern_distance", _float), ("location_distance", _float),
+    ("x_coordinate", _float), ("y_coordinate", _float), ("data_source", _int), ("schedule_status", _int),
+)
+STOP_EVENT_FIELDS = tuple(name for name, _ in STOP_EVENT_TYPES) + ("trip_id",)
+_FIELD_SLOTS = {name: (i, conv) for i, (name, conv) in enumerate(STOP_EVENT_TYPES)}
+
+# The stop_data table (pipeline.sql): every field but trip_id, for
+# copy_writer.BinaryCopyWriter
+STOP_DATA_COLUMNS = tuple(
+    (name, {_int: "int4", _float: "float8", _str: "text"}[conv]) for name, conv in STOP_EVENT_TYPES
+)
+
+
+class StopEvent(namedtuple("StopEvent", STOP_EVENT_FIELDS)):
+    """One stop event, typed once when its page is read.
+
+    A plain tuple underneath: it goes into a Pub/Sub message as a JSON
+    array, and event[:-1] is a stop_data row for BinaryCopyWriter.
+    """
+
+    __slots__ = ()
+
+
+_new = tuple.__new__
+
+
+def _compile_row():
+    # One function building the StopEvent from a row's cells, for tables
+    # whose headers are STOP_EVENT_TYPES in order (the usual case)
+    namespace = {name: conv for name, conv in (("_int", _int), ("_float", _float), ("_str", _str))}
+    namespace.update(_new=_new, StopEvent=StopEvent)
+    values = ", ".join(f"{conv.__name__}(cells[{i}])" for i, (_, conv) in enumerate(STOP_EVENT_TYPES))
+    exec(f"def typed_row(cells, trip_id):\n    return _new(StopEvent, ({values}, trip_id))", namespace)
+    return namespace["typed_row"]
+
+
+_typed_row = _compile_row()
+
+# The walk stops only at these tags; a row's cells are then read with one
+# findall over the row, and anything else inside a cell is markup
+BLOCK = re.compile(r"<(/?)(h1|h2|table|tr)\b[^>]*>", re.IGNORECASE)
+TH = re.compile(r"<th\b[^>]*>(.*?)(?:</th\s*>|(?=<t[dh]\b)|\Z)", re.IGNORECASE | re.DOTALL)
+TD = re.compile(r"<td\b[^>]*>(.*?)(?:</td\s*>|(?=<t[dh]\b)|\Z)", re.IGNORECASE | re.DOTALL)
+HEADING_END = re.compile(r"</h[12]\s*>", re.IGNORECASE)
+INNER_TAG = re.compile(r"<[^>]*>")
+
+
+def iter_stop_events(html, page=None):
+    """Yields one StopEvent per stop event row.
+
+    Walks the page once, from one h1, h2, table or tr tag to the next: no
+    tree is built, and each cell is converted straight from its slice of
+    the page. As before, a table's first row holds its th headers and a
+    row whose td count differs from the headers is skipped. If page is
+    given, page.heading is set to the first h1's text.
+    """
+    if isinstance(html, bytes):
+        html = html.decode("utf-8")
+    trip_id = None      # of the last PDX_TRIP heading not yet given a table
+    table_trip = None
+    in_table = False
+    plan = None         # the table's header columns: (slot, converter) or None
+    direct = False      # headers are exactly STOP_EVENT_TYPES, in order
+    width = len(STOP_EVENT_TYPES)
+
+    matches = BLOCK.finditer(html)
+    m = next(matches, None)
+    while m is not None:
+        following = next(matches, None)
+        closing, tag = m.group(1), m.group(2).lower()
+        if closing:
+            if tag == "table":
+                in_table, plan = False, None
+            m = following
+            continue
+        end = following.start() if following is not None else len(html)
+
+        if tag == "tr":
+            if in_table:
+                if plan is None:
+                    headers = [_clean(h) for h in TH.findall(html, m.end(), end)]
+                    plan = [_FIELD_SLOTS.get(h) for h in headers]
+                    direct = headers == list(STOP_EVENT_FIELDS[:-1])
+                else:
+                    cells = TD.findall(html, m.end(), end)
+                    if len(cells) == len(plan):
+                        if direct:
+                            yield _typed_row(cells, table_trip)
+                        else:
+                            row = [None] * width
+                            for slot, text in zip(plan, cells):
+                                if slot is not None:
+                                    row[slot[0]] = slot[1](text)
+                            row.append(table_trip)
+                            yield _new(StopEvent, row)
+        elif tag == "table":
+            in_table, plan = True, None
+            table_trip, trip_id = trip_id, None
+        else:
+            segment = html[m.end():end]
+            close = HEADING_END.search(segment)
+            text = _clean(segment[:close.start()] if close else segment)
+            if tag == "h1":
+                if page is not None and page.heading is None:
+                    page.heading = text
+            elif "Stop events for PDX_TRIP" in text:
+                match = TRIP_HEADING.search(text)
+                if match:
+                    trip_id = int(match.group(1))
+        m = following
+
+
+class StopEventPage:
+    """One getStopEvents page: the h1 heading and its stop event rows."""
+
+    __slots__ = ("heading", "rows")
+
+    def __init__(self, heading=None, rows=None):
+        self.heading = heading
+        self.rows = rows if rows is not None else []
+
+    def service_date(self):
+        """The h1's YYYY-MM-DD date, else today (stop_data_gatherer.py)."""
+        match = DATE.search(self.heading) if self.heading is not None else None
+        return match.group(1) if match else time.strftime("%Y-%m-%d")
+
+    def scraped_date(self):
+        """What follows "for" in the h1 (stop_data_publisher.py)."""
+        if self.heading is not None and "for" in self.heading:
+            parts = self.heading.strip().split("for")
+            return parts[1].strip() if len(parts) > 1 else "unknown_date"
+        return "unknown_date"
+
+    def trip_records(self, vehicle_num):
+        """Rows under a PDX_TRIP heading as dicts, as stop_data_gatherer.py
+        saves them."""
+        data = []
+        for row in self.rows:
+            if row[-1] is not None:
+                record = dict(zip(STOP_EVENT_FIELDS, row))
+                record["vehicle_num"] = vehicle_num
+                data.append(record)
+        return data
+
+    def table_records(self, date_str, vehicle_num):
+        """Every row as a dict, as stop_data_publisher.py publishes them."""
+        records = []
+        for row in self.rows:
+            record = dict(zip(STOP_EVENT_FIELDS, row))
+            record["scraped_date"] = date_str
+            record["vehicle_number"] = _int(vehicle_num)
+            records.append(record)
+        return records
+
+
+def parse_stop_page(html):
+    """Parses a getStopEvents page (bytes are decoded as UTF-8)."""
+    page = StopEventPage()
+    page.rows = list(iter_stop_events(html, page))
+    return page
+
+
+def stop_fetcher(base_url=STOP_EVENTS_URL, max_workers=STOP_FETCH_WORKERS, rate=STOP_FETCH_RATE, **kwargs):
+    """A Fetcher for getStopEvents pages; each result's data is a StopEventPage."""
+    return Fetcher(base_url, max_workers=max_workers, rate=rate, parse=parse_stop_page, **kwargs)
+
+
+# ---------- MESSAGES ----------
+# A stop event message carries up to STOP_MESSAGE_ROWS events as JSON
+# arrays in STOP_EVENT_FIELDS order, zlib-compressed; the values keep
+# their types, so the subscriber casts nothing. A message without the
+# encoding attribute is one old string-valued record.
+STOP_ENCODING = "stop-rows-v1"
+
+
+def encode_stop_events(events, size=STOP_MESSAGE_ROWS):
+    """Yields one message body per size events."""
+    for i in range(0, len(events), size):
+        # Level 1: most of the size saving at half the time of the default
+        yield zlib.compress(json.dumps(events[i:i + size], separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode_stop_events(data, encoding=None):
+    """The StopEvents in a message body."""
+    if encoding == STOP_ENCODING:
+        return [_new(StopEvent, row) for row in json.loads(zlib.decompress(data))]
+    return [stop_event_from_record(json.loads(data.decode("utf-8")))]
+
+
+def stop_event_from_record(record):
+    """A StopEvent from a dict keyed by field name, string values or not."""
+    row = []
+    for name, conv in STOP_EVENT_TYPES + (("trip_id", _int),):
+        value = record.get(name)
+        row.append(None if value is None else conv(str(value)))
+    return _new(StopEvent, row)
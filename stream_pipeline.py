@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class StageStats:
+    __slots__ = ("name", "batches", "records", "busy", "started", "finished")
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.records = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def record(self, n, seconds):
+        self.batches += 1
+        self.records += n
+        self.busy += seconds
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.name:<10} {self.records:>10} records  {self.batches:>6} batches  "
+                f"{self.rate:>10.0f} rec/s  busy {self.busy:.2f}s of {self.elapsed:.2f}s")
+
+
+class StreamingPipeline:
+    """Fans batches from a source out to every sink through bounded queues.
+
+    Each sink runs on its own thread. When a sink falls behind its queue
+    fills up and the source blocks, so at most queue_size batches per
+    sink are held in memory no matter how large the day is.
+    """
+
+    def __init__(self, source, sinks, queue_size=8, source_name="fetch"):
+        self.source = source
+        self.sinks = sinks
+        self.queue_size = queue_size
+        self.stats = {source_name: StageStats(source_name)}
+        self._source_stats = self.stats[source_name]
+        for name in sinks:
+            self.stats[name] = StageStats(name)
+        self._errors = []
+
+    def _drain(self, name, sink, q):
+        stats = self.stats[name]
+        stats.started = time.time()
+        failed = False
+        while True:
+            batch = q.get()
+            if batch is _DONE:
+                break
+            if failed:
+                continue  # keep draining so the source never blocks on us
+            start = time.time()
+            try:
+                sink(batch)
+            except Exception as e:
+                self._errors.append((name, e))
+                failed = True
+                continue
+            stats.record(len(batch), time.time() - start)
+        stats.finished = time.time()
+
+    def run(self):
+        queues = {name: queue.Queue(maxsize=self.queue_size) for name in self.sinks}
+        threads = [
+            threading.Thread(target=self._drain, args=(name, sink, queues[name]), daemon=True)
+            for name, sink in self.sinks.items()
+        ]
+        for t in threads:
+            t.start()
+
+        stats = self._source_stats
+        stats.started = time.time()
+        batches = iter(self.source)
+        try:
+            while True:
+                start = time.time()
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    break
+                stats.record(len(batch), time.time() - start)
+                for q in queues.values():
+                    q.put(batch)
+        finally:
+            stats.finished = time.time()
+            for q in queues.values():
+                q.put(_DONE)
+            for t in threads:
+                t.join()
+
+        if self._errors:
+            name, e = self._errors[0]
+            raise RuntimeError(f"{name} stage failed: {e}") from e
+        return self.stats
+
+    def report(self):
+        print("\n--- Pipeline Throughput ---")
+        for stats in self.stats.values():
+            print(stats)
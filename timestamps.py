@@ -0,0 +1,80 @@
+import calendar
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# OPD_DATE looks like "14DEC2022:00:00:00" and ACT_TIME counts seconds
+# since that midnight. Timestamps are wall-clock times with no time zone,
+# so epoch seconds here treat them as UTC.
+OPD_DATE_FORMAT = "%d%b%Y"
+
+
+class TimestampCache:
+    """Turns (OPD_DATE, ACT_TIME) into a timestamp, parsing each date once.
+
+    A day of breadcrumbs has one or a few OPD_DATE strings, so strptime
+    runs once per distinct string and every later record is a dict
+    lookup plus integer arithmetic. Missing values give None; a malformed
+    OPD_DATE raises ValueError, as strptime did.
+    """
+
+    def __init__(self):
+        # OPD_DATE string -> (midnight epoch seconds, "YYYY-MM-DD " prefix)
+        self._dates = {}
+
+    def midnight(self, opd_date):
+        entry = self._dates.get(opd_date)
+        if entry is None:
+            day = datetime.strptime(opd_date.split(":")[0], OPD_DATE_FORMAT)
+            entry = (calendar.timegm(day.timetuple()), day.strftime("%Y-%m-%d "))
+            self._dates[opd_date] = entry
+        return entry
+
+    def epoch(self, opd_date, act_time):
+        """Integer epoch seconds, or None."""
+        if not opd_date or act_time is None:
+            return None
+        return self.midnight(opd_date)[0] + int(act_time)
+
+    def text(self, opd_date, act_time):
+        """"YYYY-MM-DD HH:MM:SS", or None."""
+        if not opd_date or act_time is None:
+            return None
+        midnight, prefix = self.midnight(opd_date)
+        seconds = int(act_time)
+        if 0 <= seconds < 86400:
+            minutes, s = divmod(seconds, 60)
+            h, m = divmod(minutes, 60)
+            return f"{prefix}{h:02d}:{m:02d}:{s:02d}"
+        # Past midnight (or negative) the date rolls over
+        return (datetime(1970, 1, 1) + timedelta(seconds=midnight + seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def epochs(self, opd_dates, act_times):
+        """Vectorized epoch(): a nullable Int64 Series, <NA> where missing."""
+        opd_dates = pd.Series(opd_dates, copy=False)
+        codes, uniques = pd.factorize(opd_dates)
+        midnights = np.array(
+            [self.midnight(d)[0] if d else -1 for d in uniques] + [-1], dtype="int64"
+        )
+        # factorize marks missing dates with -1, the sentinel slot above
+        day = midnights[codes]
+        act = pd.to_numeric(pd.Series(act_times, copy=False), errors="coerce").to_numpy(dtype="float64")
+        valid = (day != -1) & ~np.isnan(act)
+        out = day + np.where(valid, act, 0).astype("int64")
+        return pd.Series(pd.arrays.IntegerArray(out, ~valid), index=opd_dates.index)
+
+    def texts(self, opd_dates, act_times):
+        """Vectorized text(): an object array of strings, None where missing."""
+        epochs = self.epochs(opd_dates, act_times)
+        missing = epochs.isna().to_numpy()
+        stamps = epochs.fillna(0).to_numpy(dtype="int64").astype("datetime64[s]")
+        out = np.char.replace(np.datetime_as_string(stamps, unit="s"), "T", " ").astype(object)
+        out[missing] = None
+        return out
+
+
+# Shared by the subscribers; the cache only grows by one entry per date
+_cache = TimestampCache()
+timestamp_epoch = _cache.epoch
+timestamp_text = _cache.text
@@ -0,0 +1,140 @@
+import os
+import threading
+
+from copy_writer import BinaryCopyWriter, TRIP_COLUMNS
+
+# ---------- CONFIG ----------
+# "warm" loads every trip_id once at startup; "lazy" loads ranges of
+# TRIP_RANGE_SIZE ids the first time a trip in the range shows up
+TRIP_CACHE_LOAD = os.getenv("TRIP_CACHE_LOAD", "warm")
+TRIP_RANGE_SIZE = int(os.getenv("TRIP_RANGE_SIZE", "100000"))
+# "staging" COPYs the trips the cache has not seen into a temp table and
+# merges with INSERT ... ON CONFLICT DO NOTHING, which stays correct when
+# other processes write trips too (stop_data_subscriber.py inserts trips
+# its stop events show first); "copy" COPYs them straight into trip and
+# fails the flush on a trip another process inserted
+TRIP_DEDUP = os.getenv("TRIP_DEDUP", "staging")
+
+
+class TripIdCache:
+    """trip_ids known to be in the trip table, kept for the whole run.
+
+    Replaces SELECT trip_id FROM trip on every flush: the table is read
+    once (or range by range) and ids are added as their inserts commit.
+    Shared by every shard of a subscriber process.
+    """
+
+    def __init__(self, load=TRIP_CACHE_LOAD, range_size=TRIP_RANGE_SIZE):
+        self.lazy = load == "lazy"
+        self.range_size = range_size
+        self._ids = set()
+        self._ranges = set()
+        self._lock = threading.Lock()
+
+    def warm(self, conn):
+        """Reads every trip_id through a server-side cursor."""
+        if self.lazy:
+            return
+        cur = conn.cursor(name="trip_cache_warm")
+        cur.itersize = 100000
+        cur.execute("SELECT trip_id FROM trip")
+        self._ids.update(row[0] for row in cur)
+        cur.close()
+        conn.commit()
+
+    def _load_range(self, cur, trip_id):
+        r = trip_id // self.range_size
+        if r in self._ranges:
+            return
+        with self._lock:
+            if r in self._ranges:
+                return
+            lo = r * self.range_size
+            cur.execute("SELECT trip_id FROM trip WHERE trip_id >= %s AND trip_id < %s",
+                        (lo, lo + self.range_size))
+            self._ids.update(row[0] for row in cur.fetchall())
+            self._ranges.add(r)
+
+    def new_rows(self, rows, cur=None):
+        """The (trip_id, vehicle_id) rows whose trip is not known yet,
+        first occurrence only. Lazy loading needs cur."""
+        seen = set()
+        out = []
+        for row in rows:
+            trip_id = row[0]
+            if trip_id in seen:
+                continue
+            seen.add(trip_id)
+            if self.lazy and cur is not None:
+                self._load_range(cur, trip_id)
+            if trip_id not in self._ids:
+                out.append(row)
+        return out
+
+    def add(self, trip_ids):
+        self._ids.update(trip_ids)
+
+    def __contains__(self, trip_id):
+        return trip_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class TripWriter:
+    """Writes a flush's trip rows inside the caller's transaction.
+
+    Call committed() after the commit so the cache learns the new trips,
+    or rolled_back() after a rollback.
+    """
+
+    STAGING_DDL = ("CREATE TEMP TABLE IF NOT EXISTS trip_staging "
+                   "(trip_id integer, vehicle_id integer) ON COMMIT DELETE ROWS")
+    MERGE_SQL = ("INSERT INTO trip (trip_id, vehicle_id) "
+                 "SELECT DISTINCT ON (trip_id) trip_id, vehicle_id FROM trip_staging "
+                 "ON CONFLICT (trip_id) DO NOTHING")
+
+    def __init__(self, cache, dedup=TRIP_DEDUP):
+        self.cache = cache
+        self.staging = dedup == "staging"
+        self._copy = BinaryCopyWriter("trip_staging" if self.staging else "trip", TRIP_COLUMNS)
+        self._staging_conn = None
+        self._pending = []
+        self._verify = False
+
+    def write(self, cur, rows):
+        """Returns the number of trips sent to the database."""
+        new = self.cache.new_rows(rows, cur)
+        if new and self._verify:
+            # After a failed flush, trips another writer committed in the
+            # meantime would fail the COPY again; look them up first
+            cur.execute("SELECT trip_id FROM trip WHERE trip_id = ANY(%s)", ([row[0] for row in new],))
+            found = {row[0] for row in cur.fetchall()}
+            self.cache.add(found)
+            new = [row for row in new if row[0] not in found]
+        if not new:
+            return 0
+        self._copy.add_rows(new)
+        if self.staging:
+            # The temp table lives as long as the connection
+            if self._staging_conn is not cur.connection:
+                cur.execute(self.STAGING_DDL)
+                self._staging_conn = cur.connection
+            self._copy.copy_to(cur)
+            cur.execute(self.MERGE_SQL)
+        else:
+            self._copy.copy_to(cur)
+        self._pending = [row[0] for row in new]
+        return len(new)
+
+    def committed(self):
+        self.cache.add(self._pending)
+        self._pending = []
+        self._verify = False
+
+    def rolled_back(self):
+        self._copy.reset()
+        self._pending = []
+        self._verify = True
+        # A rolled back transaction may have taken the temp table with it
+        self._staging_conn = None
@@ -0,0 +1,95 @@
+import os
+
+from copy_writer import BinaryCopyWriter
+
+# ---------- CONFIG ----------
+# "on" fills in trip's route_id, service_key and direction from the stop
+# events as they are stored; "off" stores stop_data only
+TRIP_ENRICHMENT = os.getenv("TRIP_ENRICHMENT", "on")
+
+# stop event codes -> pipeline.sql's enums
+SERVICE_KEYS = {"W": "Weekday", "S": "Saturday", "U": "Sunday"}
+DIRECTIONS = {0: "Out", 1: "Back"}
+
+ENRICHMENT_COLUMNS = (
+    ("trip_id", "int4"),
+    ("route_id", "int4"),
+    ("vehicle_id", "int4"),
+    ("service_key", "text"),
+    ("direction", "text"),
+)
+
+
+class TripEnrichment:
+    """Upserts trip attributes from stop events inside the caller's
+    transaction.
+
+    Keeps trip_id -> (route_id, vehicle_id, service_key, direction) for
+    every trip written, so a trip is sent again only if its attributes
+    change. The trip_id is the event's PDX_TRIP heading (the breadcrumbs'
+    EVENT_NO_TRIP), else its trip_number. A trip the breadcrumbs have not
+    created yet is inserted; one they have is updated, its vehicle_id
+    kept. The breadcrumb subscribers merge their new trips with ON
+    CONFLICT DO NOTHING (trip_cache.TRIP_DEDUP=staging, the default), so
+    a trip inserted here is skipped there rather than failing their flush.
+
+    Call committed() after the commit, or rolled_back() after a rollback.
+    """
+
+    STAGING_DDL = ("CREATE TEMP TABLE IF NOT EXISTS trip_enrichment (trip_id integer, route_id integer, "
+                   "vehicle_id integer, service_key text, direction text) ON COMMIT DELETE ROWS")
+    UPSERT_SQL = """
+        INSERT INTO trip (trip_id, route_id, vehicle_id, service_key, direction)
+        SELECT trip_id, route_id, vehicle_id, service_key::service_type, direction::tripdir_type
+        FROM trip_enrichment
+        ON CONFLICT (trip_id) DO UPDATE SET
+            route_id = COALESCE(EXCLUDED.route_id, trip.route_id),
+            vehicle_id = COALESCE(trip.vehicle_id, EXCLUDED.vehicle_id),
+            service_key = COALESCE(EXCLUDED.service_key, trip.service_key),
+            direction = COALESCE(EXCLUDED.direction, trip.direction)"""
+
+    def __init__(self):
+        self.trips = {}
+        self._copy = BinaryCopyWriter("trip_enrichment", ENRICHMENT_COLUMNS)
+        self._staging_conn = None
+        self._pending = {}
+
+    def write(self, cur, events):
+        """Returns the number of trips sent to the database."""
+        trips = self.trips
+        pending = {}
+        last = None
+        for e in events:
+            trip_id = e.trip_id if e.trip_id is not None else e.trip_number
+            # A trip's events come together and share its attributes
+            if trip_id == last or trip_id is None:
+                continue
+            last = trip_id
+            attrs = (e.route_number, e.vehicle_number, SERVICE_KEYS.get(e.service_key),
+                     DIRECTIONS.get(e.direction))
+            if trips.get(trip_id) != attrs:
+                pending[trip_id] = attrs
+        if not pending:
+            return 0
+        self._copy.add_rows((trip_id,) + attrs for trip_id, attrs in pending.items())
+        # The temp table lives as long as the connection
+        if self._staging_conn is not cur.connection:
+            cur.execute(self.STAGING_DDL)
+            self._staging_conn = cur.connection
+        self._copy.copy_to(cur)
+        cur.execute(self.UPSERT_SQL)
+        self._pending = pending
+        return len(pending)
+
+    def committed(self):
+        self.trips.update(self._pending)
+        self._pending = {}
+
+    def rolled_back(self):
+        self._copy.reset()
+        self._pending = {}
+        # A rolled back transaction may have taken the temp table with it
+        self._staging_conn = None
+
+    def __len__(self):
+        return len(self.trips)
@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+import zlib
+
+# ---------- CONFIG ----------
+SUBSCRIBER_SHARDS = int(os.getenv("SUBSCRIBER_SHARDS", "4"))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# A shard with an empty queue for this long gets an idle() call
+SHARD_IDLE_SECONDS = float(os.getenv("SHARD_IDLE_SECONDS", "5"))
+
+# Message attribute naming the trip as "VEHICLE_ID:EVENT_NO_TRIP"
+TRIP_ATTR = "trip"
+
+_STOP = object()
+
+
+def trip_key(record):
+    return (record.get("VEHICLE_ID"), record.get("EVENT_NO_TRIP"))
+
+
+def trip_tag(key):
+    return f"{key[0]}:{key[1]}"
+
+
+def shard_of_tag(tag, num_shards):
+    # crc32 is stable across processes and runs, unlike hash() of a str
+    return zlib.crc32(tag.encode()) % num_shards
+
+
+def shard_of(key, num_shards):
+    return shard_of_tag(trip_tag(key), num_shards)
+
+
+class SharedAck:
+    """Acks a message once every shard holding part of it is done."""
+
+    def __init__(self, msg, parts):
+        self.msg = msg
+        self.parts = parts
+        self.nacked = False
+        self._lock = threading.Lock()
+
+    def ack(self):
+        with self._lock:
+            self.parts -= 1
+            done = self.parts == 0 and not self.nacked
+        if done:
+            self.msg.ack()
+
+    def nack(self):
+        # Once, however many of its shards fail
+        with self._lock:
+            first = not self.nacked
+            self.nacked = True
+        if first:
+            self.msg.nack()
+
+
+class ShardedDispatcher:
+    """Runs one thread per shard, each fed by its own FIFO queue.
+
+    Records are routed by a hash of (VEHICLE_ID, EVENT_NO_TRIP), so every
+    trip always lands on the same shard and is processed in arrival order.
+    A shard's state (previous breadcrumbs, DB buffer, connection) is only
+    touched by its own thread, so nothing is shared and nothing is locked.
+    A shard may define idle(), run on its thread when its queue has been
+    empty for SHARD_IDLE_SECONDS, e.g. to evict trips that went quiet.
+    A message whose handle() raises is nacked for redelivery right away
+    and counted in failed, not processed.
+    """
+
+    def __init__(self, shards, queue_size=SHARD_QUEUE_SIZE):
+        self.shards = shards
+        self.processed = [0] * len(shards)
+        self.failed = [0] * len(shards)
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in shards]
+        self._threads = [
+            threading.Thread(target=self._run, args=(i,), daemon=True, name=f"shard-{i}")
+            for i in range(len(shards))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _run(self, i):
+        shard, q = self.shards[i], self._queues[i]
+        idle = getattr(shard, "idle", None)
+        while True:
+            try:
+                item = q.get(timeout=SHARD_IDLE_SECONDS)
+            except queue.Empty:
+                if idle is not None:
+                    try:
+                        idle()
+                    except Exception as e:
+                        print(f"Shard {i} idle step failed:", e)
+                continue
+            if item is _STOP:
+                break
+            try:
+                shard.handle(*item)
+            except Exception as e:
+                print(f"Shard {i} failed to handle message:", e)
+                # msg, or the SharedAck of a message split across shards
+                item[0].nack()
+                self.failed[i] += 1
+                continue
+            self.processed[i] += 1
+
+    def submit(self, msg, records):
+        """Queues a message's records on the shard(s) owning their trips."""
+        n = len(self.shards)
+        if not records:
+            msg.ack()
+            return
+
+        key = trip_key(records[0])
+        if all(trip_key(r) == key for r in records):
+            # Common case: a single record, or an envelope from one trip
+            self._queues[shard_of(key, n)].put((msg, records))
+            return
+
+        # Records from several trips: split by shard, ack when all are done
+        parts = {}
+        for record in records:
+            parts.setdefault(shard_of(trip_key(record), n), []).append(record)
+        shared = SharedAck(msg, len(parts))
+        for i, part in parts.items():
+            self._queues[i].put((shared, part))
+
+    def queue_depths(self):
+        return [q.qsize() for q in self._queues]
+
+    def close(self):
+        """Drains every queue, stops the threads and closes the shards."""
+        for q in self._queues:
+            q.put(_STOP)
+        for t in self._threads:
+            t.join()
+        for shard in self.shards:
+            close = getattr(shard, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,205 @@
+import os
+import time
+from collections import OrderedDict
+
+from speed_transform import MAX_SPEED
+from timestamps import timestamp_epoch
+
+# ---------- CONFIG ----------
+# A trip is evicted once no breadcrumb arrived for it in TRIP_IDLE_SECONDS
+# of wall time, or once its last breadcrumb is TRIP_WATERMARK_LAG seconds
+# of event time (OPD_DATE + ACT_TIME) behind the newest one seen; the
+# watermark is what bounds memory on replays that run faster than real time
+TRIP_IDLE_SECONDS = float(os.getenv("TRIP_IDLE_SECONDS", "900"))
+TRIP_WATERMARK_LAG = int(os.getenv("TRIP_WATERMARK_LAG", "3600"))
+# Most trips held at once; past it the least recently updated is evicted
+TRIP_STATE_MAX = int(os.getenv("TRIP_STATE_MAX", "100000"))
+# Updates between eviction sweeps
+TRIP_EVICT_EVERY = int(os.getenv("TRIP_EVICT_EVERY", "1000"))
+
+# Below any ACT_TIME: no breadcrumb of the current OPD_DATE yet
+NO_TIME = float("-inf")
+
+
+class TripState:
+    """What the speed step keeps per trip: the last accepted point's
+    METERS, ACT_TIME and OPD_DATE, and the first breadcrumb until it is
+    stored."""
+
+    __slots__ = ("meters", "act_time", "opd_date", "pending", "touched")
+
+    def __init__(self, meters, act_time, opd_date, pending, touched):
+        self.meters = meters
+        self.act_time = act_time
+        self.opd_date = opd_date
+        self.pending = pending
+        self.touched = touched
+
+
+class TripStateStore:
+    """Per-trip speed state with eviction, in place of TripSpeedTracker.
+
+    update() returns the records to store, each breadcrumb once: nothing
+    for the first point of a trip (it is held) or for a point over
+    max_speed, [first, second] when the second accepted point arrives,
+    both with the speed between them, and [current] after that. This is
+    what speed_transform.compute_trip_speeds gives for a whole block.
+
+    Trips are kept in the order of the sweep they were last updated in,
+    and swept every evict_every updates; a trip has to go a whole sweep
+    without an update before it is evicted, unless the store is full.
+    Event times are only worked out by the sweep, from each quiet trip's
+    OPD_DATE and ACT_TIME: per breadcrumb, update() keeps the newest
+    ACT_TIME of the current OPD_DATE and moves a trip to the end only on
+    its first update since the last sweep. An evicted
+    trip whose first point is still held returns it with SPEED None, so
+    single-point trips are written too; drain() does the same for every
+    trip at shutdown.
+    """
+
+    def __init__(self, max_speed=MAX_SPEED, idle_seconds=TRIP_IDLE_SECONDS,
+                 watermark_lag=TRIP_WATERMARK_LAG, max_trips=TRIP_STATE_MAX,
+                 evict_every=TRIP_EVICT_EVERY):
+        self.max_speed = max_speed
+        self.idle_seconds = idle_seconds
+        self.watermark_lag = watermark_lag
+        self.max_trips = max_trips
+        self.evict_every = evict_every
+
+        self.trips = OrderedDict()
+        self.watermark = None
+        # The current OPD_DATE, its midnight and its newest ACT_TIME, folded
+        # into watermark when the date changes and at every sweep
+        self._date = None
+        self._midnight = None
+        self._latest = NO_TIME
+        self.skipped = 0
+        self.evicted = 0
+        self._updates = 0
+        # Wall clock as of the last sweep; idle time is measured in sweeps
+        self._now = time.monotonic()
+
+    def __len__(self):
+        return len(self.trips)
+
+    def holds(self, data):
+        """True if data is a first point waiting for its trip's second."""
+        state = self.trips.get((data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP")))
+        return state is not None and state.pending is data
+
+    def update(self, data):
+        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
+        opd_date = data.get("OPD_DATE")
+        act_time = data.get("ACT_TIME")
+        if opd_date != self._date:
+            self._set_date(opd_date)
+        try:
+            if act_time > self._latest:
+                self._latest = act_time
+        except TypeError:
+            pass
+
+        out = []
+        self._updates += 1
+        trips = self.trips
+        if self._updates % self.evict_every == 0 or len(trips) >= self.max_trips:
+            out = self.evict()
+
+        meters = data.get("METERS")
+        state = trips.get(key)
+        if state is None:
+            trips[key] = TripState(meters, act_time, opd_date, data, self._now)
+            return out
+
+        # calculate_speed() without building a dict for the previous point
+        speed = 0.0
+        try:
+            delta_time = act_time - state.act_time
+            if delta_time > 0:
+                speed = (meters - state.meters) / delta_time
+        except Exception:
+            pass
+        if speed > self.max_speed:
+            self.skipped += 1
+            return out
+
+        state.meters = meters
+        state.act_time = act_time
+        state.opd_date = opd_date
+        if state.touched != self._now:
+            # First update since the sweep: trips stay in sweep order
+            state.touched = self._now
+            trips.move_to_end(key)
+
+        first = state.pending
+        if first is not None:
+            first["SPEED"] = speed
+            state.pending = None
+            out.append(first)
+        data["SPEED"] = speed
+        out.append(data)
+        return out
+
+    def evict(self):
+        """Drops idle, behind-the-watermark and over-limit trips; returns
+        their held first points.
+
+        Only trips with no update since the previous sweep are looked at,
+        for the watermark too: publishers send a day file vehicle by
+        vehicle, so ACT_TIME jumps back at every new vehicle and a trip
+        far behind the watermark may still be the one being fed.
+        """
+        previous = self._now
+        now = self._now = time.monotonic()
+        self._fold_date()
+        cutoff = None if self.watermark is None else self.watermark - self.watermark_lag
+        trips = self.trips
+        over = len(trips) - self.max_trips + 1
+        expired = []
+        for key, state in trips.items():
+            if state.touched >= previous and over <= 0:
+                # Trips are in update order, so the rest were updated too
+                break
+            idle = now - state.touched >= self.idle_seconds
+            behind = False
+            if cutoff is not None and not idle:
+                event_time = timestamp_epoch(state.opd_date, state.act_time)
+                behind = event_time is not None and event_time < cutoff
+            if idle or behind or over > 0:
+                expired.append(key)
+                over -= 1
+
+        out = []
+        for key in expired:
+            state = trips.pop(key)
+            if state.pending is not None:
+                state.pending["SPEED"] = None
+                out.append(state.pending)
+        self.evicted += len(expired)
+        return out
+
+    def _set_date(self, opd_date):
+        # A malformed OPD_DATE raises here, before the date is taken on
+        midnight = timestamp_epoch(opd_date, 0)
+        self._fold_date()
+        self._date = opd_date
+        self._midnight = midnight
+        self._latest = NO_TIME
+
+    def _fold_date(self):
+        if self._midnight is None or self._latest is NO_TIME:
+            return
+        event_time = self._midnight + int(self._latest)
+        if self.watermark is None or event_time > self.watermark:
+            self.watermark = event_time
+
+    def drain(self):
+        """Evicts every trip; returns the held first points."""
+        out = []
+        for state in self.trips.values():
+            if state.pending is not None:
+                state.pending["SPEED"] = None
+                out.append(state.pending)
+        self.evicted += len(self.trips)
+        self.trips.clear()
+        return out
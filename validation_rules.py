@@ -0,0 +1,219 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# ---------- RULE KINDS ----------
+# Each rule is declared once and knows how to check itself two ways: as
+# a line of Python for the compiled single-record path, and as a boolean
+# failure mask over a whole DataFrame for bulk loads.
+
+class Required:
+    """Fails when the field is missing or falsy: None, "" or 0, as the
+    subscribers' `if not data.get(...)` checks had it."""
+
+    def __init__(self, name, message, field):
+        self.name = name
+        self.message = message
+        self.fields = (field,)
+        self.field = field
+
+    def record_source(self, var):
+        return f"not {var[self.field]}"
+
+    def frame_fails(self, frame):
+        if self.field not in frame:
+            return np.ones(len(frame), dtype=bool)
+        col = frame[self.field]
+        return (col.isna() | ~col.astype(bool)).to_numpy()
+
+
+class NotNone:
+    """Fails when the field is missing or None; 0 and "" pass."""
+
+    def __init__(self, name, message, field):
+        self.name = name
+        self.message = message
+        self.fields = (field,)
+        self.field = field
+
+    def record_source(self, var):
+        return f"{var[self.field]} is None"
+
+    def frame_fails(self, frame):
+        if self.field not in frame:
+            return np.ones(len(frame), dtype=bool)
+        return frame[self.field].isna().to_numpy()
+
+
+class HasFields:
+    """Fails when any of the keys is absent from the record.
+
+    In a DataFrame an absent key and a null value look the same, so the
+    batch check only requires the columns to exist.
+    """
+
+    def __init__(self, name, message, *fields):
+        self.name = name
+        self.message = message
+        self.fields = ()
+        self.keys = fields
+
+    def record_source(self, var):
+        return " or ".join(f"{k!r} not in r" for k in self.keys)
+
+    def frame_fails(self, frame):
+        missing = any(k not in frame for k in self.keys)
+        return np.full(len(frame), missing, dtype=bool)
+
+
+class Check:
+    """Fails when expr is true.
+
+    expr uses field names as variables and & | for and/or, so it runs on
+    plain numbers and on NumPy arrays alike. The rule is skipped when a
+    field is None, unless it has a default.
+    """
+
+    def __init__(self, name, message, expr, defaults=None):
+        self.name = name
+        self.message = message
+        self.expr = expr
+        self.defaults = defaults or {}
+        self.fields = tuple(dict.fromkeys(re.findall(r"\b[A-Z][A-Z_]+\b", expr)))
+
+    def record_source(self, var):
+        guards = [f"{var[f]} is not None" for f in self.fields if f not in self.defaults]
+        expr = self.expr
+        for f in self.fields:
+            value = var[f]
+            if f in self.defaults:
+                value = f"({var[f]} if {var[f]} is not None else {self.defaults[f]!r})"
+            expr = re.sub(rf"\b{f}\b", value, expr)
+        # On plain values short-circuiting and/or beat & and |
+        expr = expr.replace(" & ", " and ").replace(" | ", " or ")
+        return " and ".join(guards + [f"({expr})"])
+
+    def frame_fails(self, frame):
+        present = np.ones(len(frame), dtype=bool)
+        env = {}
+        for f in self.fields:
+            if f in frame:
+                col = pd.to_numeric(frame[f], errors="coerce").to_numpy(dtype="float64")
+            else:
+                col = np.full(len(frame), np.nan)
+            if f in self.defaults:
+                col = np.where(np.isnan(col), self.defaults[f], col)
+            else:
+                present &= ~np.isnan(col)
+            env[f] = col
+        with np.errstate(invalid="ignore"):
+            return present & eval(self.expr, {}, env)
+
+
+# ---------- BREADCRUMB RULES ----------
+BREADCRUMB_RULES = (
+    # Existence
+    Required("vehicle_id", "Missing VEHICLE_ID", "VEHICLE_ID"),
+    Required("opd_date", "Missing OPD_DATE", "OPD_DATE"),
+    HasFields("gps_coordinates", "Missing GPS coordinates", "GPS_LATITUDE", "GPS_LONGITUDE"),
+    # Limit
+    Check("hdop_range", "GPS_HDOP out of acceptable range (0-10)",
+          "(GPS_HDOP <= 0) | (GPS_HDOP > 10)"),
+    Check("sats_range", "GPS_SATELLITES out of range (0-20)",
+          "(GPS_SATELLITES < 0) | (GPS_SATELLITES > 20)"),
+    Check("act_time", "ACT_TIME exceeds maximum seconds in a day",
+          "ACT_TIME > 86400"),
+    # Intra-record
+    Check("intra_hdop", "GPS_HDOP too high when ACT_TIME is 0",
+          "(ACT_TIME == 0) & (GPS_HDOP > 5)", defaults={"GPS_HDOP": 0}),
+    Check("intra_sats", "GPS_HDOP too low when no satellites are visible",
+          "(GPS_SATELLITES == 0) & (GPS_HDOP < 10)", defaults={"GPS_HDOP": 0}),
+)
+
+# subscriber2.py's assert_* checks only required VEHICLE_ID and OPD_DATE
+# to be present, so a 0 there passes; the rest are the same rules
+ASSERT_BREADCRUMB_RULES = (
+    NotNone("vehicle_id", "Missing VEHICLE_ID", "VEHICLE_ID"),
+    NotNone("opd_date", "Missing OPD_DATE", "OPD_DATE"),
+) + BREADCRUMB_RULES[2:]
+
+
+def compile_record_check(rules, failures, totals):
+    """Builds check(r) -> bool for single records.
+
+    Every field is read from the dict once and all rules are tested in a
+    single expression, so a passing record costs one call and no
+    exceptions. Only a failing record goes through the rules one by one
+    to count failures[i] for each failing rule i. totals holds the
+    [passed, failed] counts.
+    """
+    fields = dict.fromkeys(f for rule in rules for f in rule.fields)
+    var = {f: f"v{i}" for i, f in enumerate(fields)}
+    sources = [f"({rule.record_source(var)})" for rule in rules]
+
+    lines = ["def check(r):", "    get = r.get"]
+    lines += [f"    {var[f]} = get({f!r})" for f in fields]
+    lines.append(f"    if not ({' or '.join(sources)}):")
+    lines.append("        totals[0] += 1")
+    lines.append("        return True")
+    for i, rule in enumerate(rules):
+        lines.append(f"    if {rule.record_source(var)}:  # {rule.name}")
+        lines.append(f"        failures[{i}] += 1")
+    lines.append("    totals[1] += 1")
+    lines.append("    return False")
+
+    namespace = {"failures": failures, "totals": totals}
+    exec("\n".join(lines), namespace)
+    return namespace["check"]
+
+
+class RuleEngine:
+    def __init__(self, rules=BREADCRUMB_RULES):
+        self.rules = rules
+        self.failures = [0] * len(rules)
+        self._totals = [0, 0]
+        # validate(record) -> bool is the compiled check itself
+        self.validate = compile_record_check(rules, self.failures, self._totals)
+
+    @property
+    def passed(self):
+        return self._totals[0]
+
+    @property
+    def failed(self):
+        return self._totals[1]
+
+    def validate_frame(self, frame):
+        """Returns a boolean mask of the rows that pass every rule."""
+        valid = np.ones(len(frame), dtype=bool)
+        for i, rule in enumerate(self.rules):
+            fails = rule.frame_fails(frame)
+            self.failures[i] += int(fails.sum())
+            valid &= ~fails
+        passed = int(valid.sum())
+        self._totals[0] += passed
+        self._totals[1] += len(frame) - passed
+        return valid
+
+    # The compiled check cannot be pickled; rebuild it from the counts so a
+    # worker process can send its engine back to be merged
+    def __getstate__(self):
+        return {"rules": self.rules, "failures": self.failures, "totals": self._totals}
+
+    def __setstate__(self, state):
+        self.__init__(state["rules"])
+        self.failures[:] = state["failures"]
+        self._totals[:] = state["totals"]
+
+    def merge(self, other):
+        self._totals[0] += other.passed
+        self._totals[1] += other.failed
+        for i, n in enumerate(other.failures):
+            self.failures[i] += n
+
+    def report(self):
+        for rule, n in zip(self.rules, self.failures):
+            if n:
+                print(f"  {rule.message}: {n}")
@@ -1,18 +1,20 @@
-import glob
-import json
 import os
+import sys
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from day_archive import day_files, count_records
 
 def main():
-    json_files = sorted(glob.glob("2025-??-??.json"))
     total = 0
 
-    for filename in json_files:
+    # .parquet files are counted from their footer without reading rows
+    for filename in day_files():
         try:
-            with open(filename, "r") as f:
-                records = json.load(f)
-                count = len(records)
-                total += count
-                print(f"{filename}: {count} records")
+            count = count_records(filename)
+            total += count
+            print(f"{filename}: {count} records")
         except Exception as e:
             print(f" Error reading {filename}: {e}")
 
@@ -20,4 +22,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
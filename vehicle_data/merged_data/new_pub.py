@@ -1,8 +1,16 @@
 from google.cloud import pubsub_v1
 import json
+import os
+import sys
 import time
 from datetime import datetime
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from publish_flow import FlowControlledPublisher
+from envelope import encode_messages
+
 # Configuration
 SERVICE_ACCOUNT_FILE = "/opt/dataengr-dataguru-809ccf8d3880.json"
 PROJECT_ID = "dataengr-dataguru"
@@ -14,34 +22,20 @@ INPUT_FILE = "2025-05-07.json"  # assuming you're running from inside merged_dat
 # Publisher setup
 publisher = pubsub_v1.PublisherClient()
 topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-
-def callback(future):
-    try:
-        future.result()
-    except Exception as e:
-        print(f"Publish failed: {e}")
+flow = FlowControlledPublisher(publisher, topic_path, progress_every=5000)
 
 def main():
     with open(INPUT_FILE, "r") as f:
         records = json.load(f)
 
-    future_list = []
     start = time.time()
-    for i, record in enumerate(records):
-        data_str = json.dumps(record)
-        data = data_str.encode("utf-8")
-        future = publisher.publish(topic_path, data)
-        future.add_done_callback(callback)
-        future_list.append(future)
-
-        if i % 5000 == 0:
-            print(f"Published {i} messages...")
+    for data, attrs in encode_messages(records):
+        flow.publish(data, **attrs)
 
-    for future in future_list:
-        future.result()
+    flow.wait()
 
     end = time.time()
-    print(f"Published {len(records)} messages to {topic_path}")
+    flow.report()
     print(f"Total runtime: {round(end - start, 2)} seconds")
 
 if __name__ == "__main__":
@@ -1,290 +1,246 @@
-import json
 import time
-import threading
-import pandas as pd
-from datetime import datetime, timedelta
+from functools import partial
 from google.cloud import pubsub_v1
-from collections import defaultdict
-import statistics
 import psycopg2
+import argparse
 import os
+import sys
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from envelope import decode_message
+from validation_rules import RuleEngine
+from run_stats import RunStats
+from trip_state import TripStateStore
+from timestamps import timestamp_epoch, timestamp_text
+from trip_cache import TripIdCache
+from breadcrumb_partitions import BreadcrumbPartitions, day_of
+from trip_shards import ShardedDispatcher, SUBSCRIBER_SHARDS
+from replay import Replay
+from process_ingest import ProcessIngest, PostgresSink, SUBSCRIBER_PROCESSES
 
 # --- PostgreSQL connection ---
-conn = psycopg2.connect(
+DB_PARAMS = dict(
     dbname="trimet",
     user="postgres",
     password="123456",
     host="::1"
     # host="localhost"
 )
-cur = conn.cursor()
-trip_ids = set()
 
-# Clear buffer files before each run
-open("trip_buffer.csv", "w").close()
-open("breadcrumb_buffer.csv", "w").close()
+def connect():
+    return psycopg2.connect(**DB_PARAMS)
 
 # --- Pub/Sub configuration ---
 project_id = "dataengr-dataguru"
 sub_id = "project-topic-sub"
-subscriber = pubsub_v1.SubscriberClient()
-sub_path = subscriber.subscription_path(project_id, sub_id)
 
 # --- Control flags ---
-msgs = []
-records = []
-lock = threading.Lock()
 idle_seconds = 10
 last_msg_time = time.time()
-passed_count = 0
-failed_count = 0
-previous_data = {}
-lock = threading.Lock()
-idle_seconds = 10
 
-last_msg_time = time.time()
-passed_count = 0
-failed_count = 0
-
-# Store previous message for inter-record checks
-previous_data = {}
-
-# Load reference data for validation
-with open("2025-05-05.json", "r") as f:
-    reference_data = pd.DataFrame(json.load(f))
-
-# VALIDATION
-def validate_message(data):
-    global passed_count, failed_count
-    errors = []
-
-    # Existence
-    if not data.get("VEHICLE_ID"):
-        errors.append("Missing VEHICLE_ID")
-    
-    if not data.get("OPD_DATE"):
-        errors.append("Missing OPD_DATE")
-    
-    if "GPS_LATITUDE" not in data or "GPS_LONGITUDE" not in data:
-        errors.append("Missing GPS coordinates")
-
-    # Limit
-
-    # Limit assertion: OPD_DATE must be in 2025
-    '''
-    date_str = data.get("OPD_DATE")
-    if date_str is not None:
-        date_val = pd.to_datetime(date_str, errors='coerce')
-        if pd.isna(date_val) or date_val.year != 2025:
-            errors.append("OPD_DATE must be in the year 2025")
-    '''
-
-    hdop = data.get("GPS_HDOP")
-    if hdop is not None and (hdop <= 0 or hdop > 10):
-        errors.append("GPS_HDOP out of acceptable range (0-10)")
-
-    sats = data.get("GPS_SATELLITES")
-    if sats is not None and (sats < 0 or sats > 20):
-        errors.append("GPS_SATELLITES out of range (0-20)")
-
-    act_time = data.get("ACT_TIME")
-    if act_time is not None and act_time > 86400:
-        errors.append("ACT_TIME exceeds maximum seconds in a day")
-
-    # Intra-record
-    if data.get("ACT_TIME") == 0 and data.get("GPS_HDOP", 0) > 5:
-        errors.append("GPS_HDOP too high when ACT_TIME is 0")
-    
-    if data.get("GPS_SATELLITES") == 0 and data.get("GPS_HDOP", 0) < 10:
-        errors.append("GPS_HDOP too low when no satellites are visible")
-
-    if errors:
-        failed_count += 1
-    else:
-        passed_count += 1
-
-# SPEED CALCULATION
-def calculate_speed(current, previous):
-    try:
-        delta_distance = current["METERS"] - previous["METERS"]
-        delta_time = current["ACT_TIME"] - previous["ACT_TIME"]
-        if delta_time > 0:
-            return delta_distance / delta_time
-    except:
-        pass
-    return 0.0
+# SHARD
+# Each shard owns a slice of the trips (by VEHICLE_ID/EVENT_NO_TRIP hash):
+# their previous breadcrumbs, a validator and its own DB connection. Only
+# the shard's thread touches them, so the callback takes no global lock.
+class BreadcrumbShard:
+    def __init__(self, trip_cache, partitions):
+        self.conn = connect()
+        self.cur = self.conn.cursor()
+        self.trip_cache = trip_cache
+        self.partitions = partitions
+        self.speeds = TripStateStore()
+        self.validator = RuleEngine()
+        self.stats = RunStats()
+
+    def handle(self, msg, batch):
+        for data in batch:
+            self.process_record(data)
+        msg.ack()
+
+    # RECORD HANDLER
+    def process_record(self, data):
+        # The first breadcrumb of a trip is held until the second arrives
+        # and both get the speed between them; after that each accepted one
+        # is stored once. Speeds > 45 m/s are skipped.
+        self.store_records(self.speeds.update(data))
+
+    def store_records(self, records):
+        for record in records:
+            self.validator.validate(record)
+            self.store_to_db(record)
+            self.stats.add(record)
+
+    # Quiet trips leave the speed state; a held first point is stored
+    # without a speed
+    def idle(self):
+        self.store_records(self.speeds.evict())
+
+    # DB Insertion
+    def store_to_db(self, data):
+        try:
+            # OPD_DATE (e.g. "14DEC2022:00:00:00") is parsed once per date and cached
+            tstamp_str = timestamp_text(data.get("OPD_DATE"), data.get("ACT_TIME"))
+            # The row goes straight into its day partition, created the
+            # first time the day shows up
+            day = day_of(timestamp_epoch(data.get("OPD_DATE"), data.get("ACT_TIME")))
+            self.partitions.ensure(self.conn, (day,))
+
+            trip_id = data.get("EVENT_NO_TRIP")
+            vehicle_id = data.get("VEHICLE_ID")
+
+            # Trips already inserted (or loaded at startup) skip the round trip
+            new_trip = bool(trip_id and vehicle_id and self.trip_cache.new_rows([(trip_id, vehicle_id)], self.cur))
+            if new_trip:
+                self.cur.execute("""
+                    INSERT INTO trip (trip_id, vehicle_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (trip_id) DO NOTHING;
+                """, (trip_id, vehicle_id))
+
+            self.cur.execute(f"""
+                INSERT INTO {self.partitions.table(day)} (tstamp, latitude, longitude, speed, trip_id)
+                VALUES (%s, %s, %s, %s, %s);
+            """, (
+                tstamp_str,
+                data.get("GPS_LATITUDE"),
+                data.get("GPS_LONGITUDE"),
+                data.get("SPEED"),
+                trip_id
+            ))
+
+            self.conn.commit()
+            if new_trip:
+                self.trip_cache.add((trip_id,))
+
+        except Exception as e:
+            self.conn.rollback()
+            print("DB insert failed:", e)
+
+    def close(self):
+        self.store_records(self.speeds.drain())
+        self.cur.close()
+        self.conn.close()
 
 # MESSAGE HANDLER
-def callback(msg):
-    global last_msg_time
-    with lock:
-        decoded = msg.data.decode("utf-8")
+def make_callback(dispatcher):
+    def callback(msg):
+        global last_msg_time
 
+        # A message carries one record, or an envelope of records from one trip
         try:
-            data = json.loads(decoded)
+            batch = decode_message(msg)
         except Exception as e:
             print("Invalid JSON:", e)
             msg.ack()
             return
 
-        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
-
-        if key in previous_data:
-            prev = previous_data[key]
-
-            # Calculate speed using current and previous breadcrumb
-            speed = calculate_speed(data, prev)
-
-            # Filter unrealistic speed only if > 45 m/s
-            if speed > 45:
-                print(f"Skipping message with unrealistic speed: {speed:.2f} m/s")
-                msg.ack()
-                return
-
-            # Assign same speed to both prev and current (first+second)
-            prev["SPEED"] = speed
-            data["SPEED"] = speed
-
-            # Validate both
-            validate_message(prev)
-            validate_message(data)
-            
-            # Store both to DB
-            store_to_db(prev)
-            store_to_db(data)
-
-            records.append(prev)
-            records.append(data)
-
-            # Append and write both (only if prev["SPEED"] wasn't already set)
-            # try:
-                # with open("testing.jsonl", "a") as f:
-                    # if "SPEED" not in prev:  # Only write prev once
-                        # f.write(json.dumps(prev) + "\n")
-                        # records.append(prev)
-                    # f.write(json.dumps(data) + "\n")
-                    # records.append(data)
-            # except Exception as e:
-                # print("Failed to write to file:", e)
-
-        else:
-            # First breadcrumb — store for now (write later)
-            previous_data[key] = data
-            msg.ack()
-            last_msg_time = time.time()
-            return
-
-        # Update last seen breadcrumb for this vehicle/trip
-        previous_data[key] = data
-        msg.ack()
+        dispatcher.submit(msg, batch)
+        last_msg_time = time.time()
+    return callback
+
+# With SUBSCRIBER_PROCESSES > 0 this process only receives and acks;
+# decoding, speeds, validation and COPY run in the worker processes
+def make_receiver(ingest):
+    def callback(msg):
+        global last_msg_time
+        ingest.receive(msg)
         last_msg_time = time.time()
+    return callback
+
+# subscriber is a pubsub_v1.SubscriberClient unless one is passed in
+def main(replay_files=None, subscriber=None):
+    # Clear buffer files before each run
+    open("trip_buffer.csv", "w").close()
+    open("breadcrumb_buffer.csv", "w").close()
+
+    # Workers are started before the Pub/Sub client creates its threads
+    ingest = dispatcher = None
+    if SUBSCRIBER_PROCESSES > 0:
+        ingest = ProcessIngest(partial(PostgresSink, **DB_PARAMS), SUBSCRIBER_PROCESSES)
+        callback = make_receiver(ingest)
+        replay_callback = ingest.receive
+    else:
+        trip_cache = TripIdCache()
+        partitions = BreadcrumbPartitions()
+        conn = connect()
+        trip_cache.warm(conn)
+        partitions.load(conn)
+        conn.close()
+        shards = [BreadcrumbShard(trip_cache, partitions) for _ in range(SUBSCRIBER_SHARDS)]
+        dispatcher = ShardedDispatcher(shards)
+        callback = make_callback(dispatcher)
+        replay_callback = lambda msg: dispatcher.submit(msg, msg.records)
+
+    start = time.time()
+    replay = None
+    if replay_files:
+        # Day files go straight into the pipeline, no Pub/Sub. Worker
+        # processes get the messages as publish_flow would send them.
+        replay = Replay(replay_files, encode=ingest is not None)
+        replay.run(replay_callback)
+    else:
+        # SUBSCRIBER
+        if subscriber is None:
+            subscriber = pubsub_v1.SubscriberClient()
+        sub_path = subscriber.subscription_path(project_id, sub_id)
+        pull = subscriber.subscribe(sub_path, callback=callback)
 
-# DB Insertion
-def store_to_db(data):
-    try:
-        opd_date_raw = data.get("OPD_DATE")  # e.g., "14DEC2022:00:00:00"
-        act_time = data.get("ACT_TIME")      # e.g., 54466 (seconds since midnight)
-        tstamp_str = None
-
-        # Safely parse OPD_DATE (e.g., "14DEC2022:00:00:00")
-        if opd_date_raw and act_time is not None:
-            # Parse using datetime.strptime
-            opd_date = datetime.strptime(opd_date_raw.split(":")[0], "%d%b%Y")  # e.g., 14DEC2022
-            tstamp = opd_date + timedelta(seconds=int(act_time))
-            tstamp_str = tstamp.strftime("%Y-%m-%d %H:%M:%S")  # final format
-
-        trip_id = data.get("EVENT_NO_TRIP")
-        vehicle_id = data.get("VEHICLE_ID")
-
-        if trip_id and vehicle_id:
-            cur.execute("""
-                INSERT INTO trip (trip_id, vehicle_id)
-                VALUES (%s, %s)
-                ON CONFLICT (trip_id) DO NOTHING;
-            """, (trip_id, vehicle_id))
-
-        cur.execute("""
-            INSERT INTO breadcrumb (tstamp, latitude, longitude, speed, trip_id)
-            VALUES (%s, %s, %s, %s, %s);
-        """, (
-            tstamp_str,
-            data.get("GPS_LATITUDE"),
-            data.get("GPS_LONGITUDE"),
-            data.get("SPEED"),
-            trip_id
-        ))
-
-        conn.commit()
-        # print(f"Inserted trip_id {trip_id} at {tstamp_str}")
-
-    except Exception as e:
-        conn.rollback()
-        print("DB insert failed:", e)
-
-# SUBSCRIBER
-subscriber = pubsub_v1.SubscriberClient()
-sub_path = subscriber.subscription_path(project_id, sub_id)
-pull = subscriber.subscribe(sub_path, callback=callback)
-
-start = time.time()
-print("Starting Listening for Messages at", sub_path, "...\n")
-
-try:
-    while True:
-        time.sleep(1)
-        if time.time() - last_msg_time > idle_seconds:
+        print("Starting Listening for Messages at", sub_path, "...\n")
+
+        try:
+            while True:
+                time.sleep(1)
+                if time.time() - last_msg_time > idle_seconds:
+                    pull.cancel()
+                    break
+        except KeyboardInterrupt:
             pull.cancel()
-            break
-except KeyboardInterrupt:
-    pull.cancel()
-
-pull.result()
-
-# Cleanup
-cur.close()
-conn.close()
-
-# POST-RUN SUMMARY
-end = time.time()
-
-# Run summary + inter-record + statistical assertions
-print("\n--- Post-run Assertions ---")
-date_vehicle_ids = defaultdict(set)
-vehicle_times = defaultdict(list)
-act_times = []
-
-for record in records:
-    date = record.get("OPD_DATE")
-    vid = record.get("VEHICLE_ID")
-    act_time = record.get("ACT_TIME")
-
-    if date and vid:
-        date_vehicle_ids[date].add(vid)
-    
-    if vid and act_time is not None:
-        vehicle_times[vid].append(act_time)
-    
-    if act_time is not None:
-        act_times.append(act_time)
-
-# Summary
-for date, vids in date_vehicle_ids.items():
-    if len(vids) < 1000:
-        print(f"Too few records on {date}: {len(vids)}")
-    
-    if len(vids) > 5000:
-        print(f"Too many vehicles on {date}: {len(vids)}")
-
-# Statistical
-if act_times:
-    median = statistics.median(act_times)
-    if median < 20000 or median > 60000:
-        print(f"Median ACT_TIME {median} is outside expected range")
-    else:
-        print(f"Median ACT_TIME {median} is within expected range")
 
-print("\n--- Validation Summary ---")
-print("Passed:", passed_count)
-print("Failed:", failed_count)
-print("Total:", passed_count + failed_count)
-print("Total runtime:", round(end - start, 2), "seconds")
+        pull.result()
+
+    # Cleanup: finish queued work and close every shard's connection
+    validator = RuleEngine()
+    stats = RunStats()
+    skipped = 0
+    if ingest is not None:
+        # Records stay in the workers; only their counts come back
+        ingest.close()
+        validator.merge(ingest.validator)
+        stats.merge(ingest.run_stats)
+        skipped = ingest.skipped
+    else:
+        dispatcher.close()
+        for shard in shards:
+            validator.merge(shard.validator)
+            stats.merge(shard.stats)
+            skipped += shard.speeds.skipped
+
+    # POST-RUN SUMMARY
+    end = time.time()
+
+    # Run summary + inter-record + statistical assertions
+    print("\n--- Post-run Assertions ---")
+    stats.report()
+
+    print("\n--- Validation Summary ---")
+    print("Passed:", validator.passed)
+    print("Failed:", validator.failed)
+    print("Total:", validator.passed + validator.failed)
+    validator.report()
+    print("Skipped (speed > 45 m/s):", skipped)
+    if ingest is not None:
+        ingest.report()
+    else:
+        print("Messages per shard:", dispatcher.processed)
+        print("Failed messages per shard:", dispatcher.failed)
+    if replay is not None:
+        replay.report()
+    print("Total runtime:", round(end - start, 2), "seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", nargs="+", metavar="DAY_FILE",
+                        help="ingest archived day files (.json or .parquet) instead of Pub/Sub")
+    main(parser.parse_args().replay)
@@ -1,258 +1,268 @@
-from google.cloud import pubsub_v1 
+from google.cloud import pubsub_v1
 import time
-import threading
-import json
-import pandas as pd
 import psycopg2
-import io
-from collections import defaultdict
-import statistics
-from datetime import datetime, timedelta
+import argparse
 import os
+import sys
+from functools import partial
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from envelope import decode_message
+from validation_rules import RuleEngine
+from run_stats import RunStats
+from trip_state import TripStateStore
+from timestamps import timestamp_epoch
+from copy_writer import BREADCRUMB_COLUMNS, row_bytes
+from breadcrumb_partitions import BreadcrumbPartitions, PartitionedCopyWriter
+from backfill import BackfillPartitions
+from flush_scheduler import FlushScheduler, FlushStats
+from ack_tracking import AckGroup, RecordOrigins, released, settle, tracked_speeds
+from trip_cache import TripIdCache, TripWriter
+from trip_shards import ShardedDispatcher, SUBSCRIBER_SHARDS
+from replay import Replay
 
 # Pub/Sub configuration
 project_id = "dataengr-dataguru"
 sub_id = "project-topic-sub"
 
 # PostgreSQL connection using environment variables
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME", "trimet"),
-    user=os.getenv("DB_USER", "postgres"),
-    password=os.getenv("DB_PASSWORD", "123456"),
-    host=os.getenv("DB_HOST", "localhost")
-)
-cur = conn.cursor()
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "trimet"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "123456"),
+        host=os.getenv("DB_HOST", "localhost")
+    )
+
+# Most messages leased and not yet acked. A message is acked only after
+# the COPY holding its rows commits, so this also caps what a crash can
+# send back for redelivery.
+MAX_UNACKED = int(os.getenv("SUBSCRIBER_MAX_UNACKED", "10000"))
 
 # Shared state
-msgs = []
-records = []
-lock = threading.Lock()
 idle_seconds = 10
-
 last_msg_time = time.time()
-passed_count = 0
-failed_count = 0
-
-previous_data = {}
-
-# Buffers for copy_from
-trip_buffer = []
-breadcrumb_buffer = []
-
-# Load reference data
-with open("2025-05-05.json", "r") as f:
-    reference_data = pd.DataFrame(json.load(f))
-
-# VALIDATION
-def validate_message(data):
-    global passed_count, failed_count
-    errors = []
-
-    if not data.get("VEHICLE_ID"):
-        errors.append("Missing VEHICLE_ID")
-    
-    if not data.get("OPD_DATE"):
-        errors.append("Missing OPD_DATE")
-    
-    if "GPS_LATITUDE" not in data or "GPS_LONGITUDE" not in data:
-        errors.append("Missing GPS coordinates")
-
-    hdop = data.get("GPS_HDOP")
-    if hdop is not None and (hdop <= 0 or hdop > 10):
-        errors.append("GPS_HDOP out of acceptable range (0-10)")
-
-    sats = data.get("GPS_SATELLITES")
-    if sats is not None and (sats < 0 or sats > 20):
-        errors.append("GPS_SATELLITES out of range (0-20)")
-
-    act_time = data.get("ACT_TIME")
-    if act_time is not None and act_time > 86400:
-        errors.append("ACT_TIME exceeds maximum seconds in a day")
-
-    if data.get("ACT_TIME") == 0 and data.get("GPS_HDOP", 0) > 5:
-        errors.append("GPS_HDOP too high when ACT_TIME is 0")
-    
-    if data.get("GPS_SATELLITES") == 0 and data.get("GPS_HDOP", 0) < 10:
-        errors.append("GPS_HDOP too low when no satellites are visible")
-
-    if errors:
-        failed_count += 1
-    else:
-        passed_count += 1
-
-# SPEED CALCULATION
-def calculate_speed(current, previous):
-    try:
-        delta_distance = current["METERS"] - previous["METERS"]
-        delta_time = current["ACT_TIME"] - previous["ACT_TIME"]
-        if delta_time > 0:
-            return delta_distance / delta_time
-    except Exception as e:
-        print("Speed calc error:", e)
-    return 0.0
-
-# FLUSH BUFFERS
-def flush_buffers():
-    try:
-        if trip_buffer:
-            trip_csv = io.StringIO()
-            for row in trip_buffer:
-                trip_csv.write(f"{row[0]},{row[1]}\n")
-            trip_csv.seek(0)
-            cur.copy_from(trip_csv, 'trip', sep=',', columns=('trip_id', 'vehicle_id'))
-
-        if breadcrumb_buffer:
-            breadcrumb_csv = io.StringIO()
-            for row in breadcrumb_buffer:
-                breadcrumb_csv.write(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]}\n")
-            breadcrumb_csv.seek(0)
-            cur.copy_from(breadcrumb_csv, 'breadcrumb', sep=',', columns=('tstamp', 'latitude', 'longitude', 'speed', 'trip_id'))
-
-        conn.commit()
-        trip_buffer.clear()
-        breadcrumb_buffer.clear()
-
-    except Exception as e:
-        conn.rollback()
-        print("Bulk insert failed:", e)
-
-# STORE TO DB
-def store_to_db(data):
-    try:
-        opd_date_raw = data.get("OPD_DATE")
-        act_time = data.get("ACT_TIME")
-        tstamp_str = None
-
-        if opd_date_raw and act_time is not None:
-            opd_date = datetime.strptime(opd_date_raw.split(":")[0], "%d%b%Y")
-            tstamp = opd_date + timedelta(seconds=int(act_time))
-            tstamp_str = tstamp.strftime("%Y-%m-%d %H:%M:%S")
-
-        trip_id = data.get("EVENT_NO_TRIP")
-        vehicle_id = data.get("VEHICLE_ID")
-
-        if trip_id and vehicle_id:
-            trip_buffer.append((trip_id, vehicle_id))
-
-        breadcrumb_buffer.append((
-            tstamp_str,
-            data.get("GPS_LATITUDE"),
-            data.get("GPS_LONGITUDE"),
-            data.get("SPEED"),
-            trip_id
-        ))
-
-        if len(breadcrumb_buffer) >= 500:
-            flush_buffers()
-
-    except Exception as e:
-        print("DB buffer append failed:", e)
 
-# CALLBACK
-def callback(msg):
-    global last_msg_time
-    with lock:
+BREADCRUMB_ROW_BYTES = row_bytes(BREADCRUMB_COLUMNS)
+
+# SHARD
+# Each shard owns a slice of the trips, its own COPY buffers and its
+# own connection. The shard's thread transforms and buffers rows; its
+# writer thread does the COPY and commit and is the only one using the
+# connection.
+class BreadcrumbShard:
+    def __init__(self, trip_cache, partitions, name="shard"):
+        self.conn = connect()
+        self.cur = self.conn.cursor()
+        self.speeds = TripStateStore()
+        self.validator = RuleEngine()
+        self.origins = RecordOrigins()
+        self.stats = RunStats()
+
+        # Binary COPY buffers, filled on the writer thread
+        self.trip_writer = TripWriter(trip_cache)
+        self.breadcrumb_copy = PartitionedCopyWriter(partitions, BREADCRUMB_COLUMNS)
+        self.writer = FlushScheduler(self.flush_buffers, name=f"{name}-writer")
+
+    # The message is acked once every one of its rows has been committed,
+    # and nacked for redelivery if their flush fails
+    def handle(self, msg, batch):
+        group = AckGroup(partial(settle, msg))
+        for data in batch:
+            self.process_record(data, group)
+        group.seal()
+
+    # RECORD HANDLER
+    def process_record(self, data, group):
+        self.store_records(tracked_speeds(self.speeds, self.origins, data, group))
+
+    def store_records(self, pairs):
+        for record, origin in pairs:
+            self.validator.validate(record)
+            self.store_to_db(record, origin)
+            self.stats.add(record)
+
+    # Trips quiet for TRIP_IDLE_SECONDS, or far behind the newest ACT_TIME,
+    # are dropped from the speed state; a trip's held first point is then
+    # stored without a speed
+    def idle(self):
+        self.store_records(released(self.speeds.evict(), self.origins))
+
+    # FLUSH BUFFERS
+    # Runs on the writer thread with one batch of (trip row, breadcrumb row,
+    # ack group) items; the scheduler picks the batch size from the
+    # measured COPY time
+    def flush_buffers(self, items):
         try:
-            data = json.loads(msg.data.decode("utf-8"))
-        except Exception as e:
-            print("Invalid JSON:", e)
-            msg.ack()
-            return
-
-        key = (data.get("VEHICLE_ID"), data.get("EVENT_NO_TRIP"))
+            # Rows are encoded straight into PostgreSQL's binary COPY format,
+            # one buffer per day partition; new partitions are committed first
+            self.breadcrumb_copy.add_rows([row for _, row, _ in items])
+            self.breadcrumb_copy.prepare(self.conn)
+            # Only trips the cache has not seen are written, once each
+            self.trip_writer.write(self.cur, [trip for trip, _, _ in items if trip])
+            self.breadcrumb_copy.copy_to(self.cur)
+
+            self.conn.commit()
+            self.trip_writer.committed()
+            for _, _, group in items:
+                if group is not None:
+                    group.done()
 
-        if key in previous_data:
-            prev = previous_data[key]
-            speed = calculate_speed(data, prev)
+        except Exception as e:
+            self.conn.rollback()
+            self.trip_writer.rolled_back()
+            self.breadcrumb_copy.reset()
+            for _, _, group in items:
+                if group is not None:
+                    group.fail()
+            print("Bulk insert failed:", e)
+            raise
+
+    # STORE TO DB
+    def store_to_db(self, data, group=None):
+        try:
+            # Epoch seconds; OPD_DATE is parsed once per date and cached
+            tstamp = timestamp_epoch(data.get("OPD_DATE"), data.get("ACT_TIME"))
 
-            if speed > 45:
-                print(f"Skipping message with unrealistic speed: {speed:.2f} m/s")
-                msg.ack()
-                return
+            trip_id = data.get("EVENT_NO_TRIP")
+            vehicle_id = data.get("VEHICLE_ID")
 
-            prev["SPEED"] = speed
-            data["SPEED"] = speed
+            trip_row = (trip_id, vehicle_id) if trip_id and vehicle_id else None
+            breadcrumb_row = (
+                tstamp,
+                data.get("GPS_LATITUDE"),
+                data.get("GPS_LONGITUDE"),
+                data.get("SPEED"),
+                trip_id
+            )
 
-            validate_message(prev)
-            validate_message(data)
+            # Flushed on row count, bytes or age, on the writer thread
+            self.writer.add((trip_row, breadcrumb_row, group), BREADCRUMB_ROW_BYTES)
 
-            store_to_db(prev)
-            store_to_db(data)
+        except Exception as e:
+            print("DB buffer append failed:", e)
+            # The row is dropped, so it no longer holds back the ack
+            if group is not None:
+                group.done()
 
-            records.append(prev)
-            records.append(data)
+    def close(self):
+        self.store_records(released(self.speeds.drain(), self.origins))
+        self.writer.close()
+        self.cur.close()
+        self.conn.close()
 
-        else:
-            previous_data[key] = data
+# CALLBACK
+def make_callback(dispatcher):
+    def callback(msg):
+        global last_msg_time
+        try:
+            batch = decode_message(msg)
+        except Exception as e:
+            print("Invalid JSON:", e)
             msg.ack()
-            last_msg_time = time.time()
             return
 
-        previous_data[key] = data
-        msg.ack()
+        dispatcher.submit(msg, batch)
         last_msg_time = time.time()
+    return callback
+
+# subscriber is a pubsub_v1.SubscriberClient unless one is passed in.
+# backfill (with replay_files) loads each day into an unlogged staging
+# table and attaches it as the day's partition at the end.
+def main(replay_files=None, subscriber=None, backfill=False):
+    # Known trip_ids are read once here instead of on every flush
+    trip_cache = TripIdCache()
+    # Rows are COPYed straight into breadcrumb's day partitions
+    if backfill and not replay_files:
+        raise ValueError("backfill needs replay_files")
+    partitions = BackfillPartitions() if backfill else BreadcrumbPartitions()
+    conn = connect()
+    trip_cache.warm(conn)
+    partitions.load(conn)
+    conn.close()
+
+    shards = [BreadcrumbShard(trip_cache, partitions, f"shard-{i}") for i in range(SUBSCRIBER_SHARDS)]
+    dispatcher = ShardedDispatcher(shards)
+
+    start = time.time()
+    replay = None
+    if replay_files:
+        # Day files go straight to the shards: no Pub/Sub, no JSON decoding
+        replay = Replay(replay_files)
+        replay.run(lambda msg: dispatcher.submit(msg, msg.records))
+    else:
+        # SUBSCRIBER
+        if subscriber is None:
+            subscriber = pubsub_v1.SubscriberClient()
+        sub_path = subscriber.subscription_path(project_id, sub_id)
+        flow_control = pubsub_v1.types.FlowControl(max_messages=MAX_UNACKED)
+        pull = subscriber.subscribe(sub_path, callback=make_callback(dispatcher), flow_control=flow_control)
 
-# SUBSCRIBER
-subscriber = pubsub_v1.SubscriberClient()
-sub_path = subscriber.subscription_path(project_id, sub_id)
-pull = subscriber.subscribe(sub_path, callback=callback)
-
-start = time.time()
-print("Starting Listening for Messages at", sub_path, "...\n")
+        print("Starting Listening for Messages at", sub_path, "...\n")
 
-try:
-    while True:
-        time.sleep(1)
-        if time.time() - last_msg_time > idle_seconds:
+        try:
+            while True:
+                time.sleep(1)
+                if time.time() - last_msg_time > idle_seconds:
+                    pull.cancel()
+                    break
+        except KeyboardInterrupt:
             pull.cancel()
-            break
-except KeyboardInterrupt:
-    pull.cancel()
-
-pull.result()
-
-# FINALIZE
-flush_buffers()
-cur.close()
-conn.close()
-
-# SUMMARY
-end = time.time()
-print("\n--- Post-run Assertions ---")
-date_vehicle_ids = defaultdict(set)
-vehicle_times = defaultdict(list)
-act_times = []
-
-for record in records:
-    date = record.get("OPD_DATE")
-    vid = record.get("VEHICLE_ID")
-    act_time = record.get("ACT_TIME")
-
-    if date and vid:
-        date_vehicle_ids[date].add(vid)
-    
-    if vid and act_time is not None:
-        vehicle_times[vid].append(act_time)
-    
-    if act_time is not None:
-        act_times.append(act_time)
-
-for date, vids in date_vehicle_ids.items():
-    if len(vids) < 1000:
-        print(f"Too few records on {date}: {len(vids)}")
-    
-    if len(vids) > 5000:
-        print(f"Too many vehicles on {date}: {len(vids)}")
-
-if act_times:
-    median = statistics.median(act_times)
-    if median < 20000 or median > 60000:
-        print(f"Median ACT_TIME {median} is outside expected range")
-    else:
-        print(f"Median ACT_TIME {median} is within expected range")
 
-print("\n--- Validation Summary ---")
-print("Passed:", passed_count)
-print("Failed:", failed_count)
-print("Total:", passed_count + failed_count)
-print("Total runtime:", round(end - start, 2), "seconds")
+        pull.result()
+
+    # FINALIZE: each shard flushes its buffers and closes its connection
+    dispatcher.close()
+
+    attached = None
+    if isinstance(partitions, BackfillPartitions):
+        conn = connect()
+        attach_start = time.time()
+        attached = partitions.finish(conn)
+        attach_seconds = time.time() - attach_start
+        conn.close()
+
+    # SUMMARY
+    end = time.time()
+
+    validator = RuleEngine()
+    flushes = FlushStats()
+    stats = RunStats()
+    skipped = 0
+    for shard in shards:
+        validator.merge(shard.validator)
+        flushes.merge(shard.writer.stats)
+        stats.merge(shard.stats)
+        skipped += shard.speeds.skipped
+
+    print("\n--- Post-run Assertions ---")
+    stats.report()
+
+    print("\n--- Validation Summary ---")
+    print("Passed:", validator.passed)
+    print("Failed:", validator.failed)
+    print("Total:", validator.passed + validator.failed)
+    validator.report()
+    print("Skipped (speed > 45 m/s):", skipped)
+    print("Messages per shard:", dispatcher.processed)
+    print("Failed messages per shard:", dispatcher.failed)
+    if replay is not None:
+        replay.report()
+    print("Flushes:", flushes)
+    if attached is not None:
+        print(f"Backfill: {len(attached)} day partitions indexed, validated and attached "
+              f"in {attach_seconds:.2f}s")
+    print("Total runtime:", round(end - start, 2), "seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", nargs="+", metavar="DAY_FILE",
+                        help="ingest archived day files (.json or .parquet) instead of Pub/Sub")
+    parser.add_argument("--backfill", action="store_true",
+                        help="with --replay, load into unlogged staging tables and attach them at the end")
+    args = parser.parse_args()
+    if args.backfill and not args.replay:
+        parser.error("--backfill needs --replay")
+    main(args.replay, backfill=args.backfill)